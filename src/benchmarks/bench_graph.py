@@ -0,0 +1,65 @@
+"""
+Benchmark for the compiled graph model used by the schema tests.
+
+Builds a synthetic compiled Dataform graph (see synthetic_graph.py) and times the
+one-off index build of DataformGraph against the linear
+`next(t for t in data["tables"] ...)` dependency lookup it replaces.
+
+Usage:
+    python src/benchmarks/bench_graph.py [--nodes 10000] [--legacy-nodes 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+from dataform_graph import DataformGraph  # noqa: E402
+from synthetic_graph import generate_graph  # noqa: E402
+
+
+def legacy_resolve(data):
+    """Dependency resolution as done by the old recursive process_table."""
+    resolved = 0
+    for table in data["tables"]:
+        for dependency in table.get("dependencyTargets", []):
+            if next((t for t in data.get("tables", []) if t.get("target") == dependency), None):
+                resolved += 1
+    return resolved
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--legacy-nodes", type=int, default=2000,
+                        help="Graph size for the quadratic legacy lookup (0 to skip).")
+    args = parser.parse_args()
+
+    data = generate_graph(args.nodes)
+    graph, build_time = timed(DataformGraph, data)
+    cycles, cycle_time = timed(graph.find_cycles)
+    order, order_time = timed(graph.topological_order)
+
+    print(f"Synthetic graph: {len(graph)} actions")
+    print(f"  DataformGraph build:  {build_time * 1000:10.1f} ms")
+    print(f"  find_cycles:          {cycle_time * 1000:10.1f} ms ({len(cycles)} cycles)")
+    print(f"  topological_order:    {order_time * 1000:10.1f} ms ({len(order)} actions)")
+
+    if args.legacy_nodes:
+        small = generate_graph(args.legacy_nodes)
+        _, legacy_time = timed(legacy_resolve, small)
+        _, indexed_time = timed(DataformGraph, small)
+        print(f"Legacy comparison on {args.legacy_nodes} actions:")
+        print(f"  linear scan lookup:   {legacy_time * 1000:10.1f} ms")
+        print(f"  DataformGraph build:  {indexed_time * 1000:10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
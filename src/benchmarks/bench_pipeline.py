@@ -0,0 +1,170 @@
+"""
+End-to-end benchmark of the schema tests against the in-process fake BigQuery client.
+
+For synthetic graphs of increasing size (see synthetic_graph.py) it measures the stages
+of a schema test run without touching BigQuery:
+  - load:    parse result.json and build the DataformGraph index
+  - catalog: prefetch the current schemas, one INFORMATION_SCHEMA query per dataset
+  - build:   run_dag over every table with process_table (SQL rewrite, test table
+             creation, schema comparison); with --pack-max-actions, cheap actions
+             are packed into script jobs (see action_packing.py)
+  - cleanup: drop the test tables, one script per dataset
+It reports wall time per stage, peak Python memory (tracemalloc, measured in a separate
+run so it doesn't slow the timed one) and the scaling exponent of the total time between
+consecutive sizes (1.0 is linear). With --baseline, results are compared with a previous
+--output file and the run fails if any size got slower by more than --threshold.
+
+Usage:
+    python src/benchmarks/bench_pipeline.py [--sizes 100 1000 10000] [--latency 0]
+        [--pack-max-actions 20] [--output bench.json] [--baseline bench.json] [--threshold 0.25] [--min-delta 0.05]
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+_SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_SRC, "common"))
+sys.path.insert(0, os.path.join(_SRC, "tests"))
+
+import schema_test  # noqa: E402
+from action_packing import select_packable  # noqa: E402
+from dataform_graph import DataformGraph  # noqa: E402
+from fake_bigquery import FakeBigQueryClient  # noqa: E402
+from scheduler import run_dag  # noqa: E402
+from schema_catalog import SchemaCatalog  # noqa: E402
+from synthetic_graph import fake_tables, generate_graph, graph_stats  # noqa: E402
+from table_cleanup import drop_tables  # noqa: E402
+
+STAGES = ("load", "catalog", "build", "cleanup")
+
+
+def run_pipeline(graph_json: str, tables: dict, schemas: dict, latency: float, max_concurrency: int,
+                 pack_max_actions: int = 0, pack_max_bytes: int = 100 * 1024 ** 2) -> dict:
+    """Run the schema test stages once and return the seconds spent in each."""
+    schema_test.warning_messages.clear()
+    schema_test.error_messages.clear()
+    timings = {}
+
+    start = time.perf_counter()
+    graph = DataformGraph(json.loads(graph_json))
+    timings["load"] = time.perf_counter() - start
+
+    # Test tables get the schema of the graph, the current tables (partly drifted) that of fake_tables
+    client = FakeBigQueryClient(tables=tables, schemas=schemas, latency=latency)
+    keys = graph.keys_of_type("tables")
+    start = time.perf_counter()
+    catalog = SchemaCatalog(client)
+    catalog.prefetch(
+        [(graph.get(key)["target"]["database"], graph.get(key)["target"]["schema"]) for key in keys],
+        max_concurrency=max_concurrency,
+    )
+    timings["catalog"] = time.perf_counter() - start
+
+    created_tables, test_table_map, state_lock = [], {}, threading.Lock()
+    start = time.perf_counter()
+    packable = select_packable(client, graph, keys, pack_max_bytes) if pack_max_actions > 1 else set()
+    status = run_dag(
+        graph,
+        lambda table: schema_test.process_table(client, table, created_tables, test_table_map, state_lock, catalog),
+        max_concurrency=max_concurrency,
+        keys=keys,
+        packable=packable,
+        run_pack=lambda tables: schema_test.process_pack(client, tables, created_tables, test_table_map, state_lock, catalog),
+        max_pack_size=pack_max_actions,
+    )
+    timings["build"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    drop_tables(client, created_tables, max_concurrency=max_concurrency)
+    timings["cleanup"] = time.perf_counter() - start
+
+    timings["total"] = sum(timings[stage] for stage in STAGES)
+    # Dry runs (packing candidates) are free and take no slot, only jobs that run are counted
+    timings["jobs"] = sum(1 for job in list(client.jobs.values()) if not job.dry_run and job.parent_job_id is None)
+    timings["packable"] = len(packable)
+    timings["failed"] = sum(1 for value in status.values() if value != "success")
+    return timings
+
+
+def bench_size(num_actions: int, latency: float, max_concurrency: int, repeat: int, pack_max_actions: int = 0) -> dict:
+    graph = generate_graph(num_actions)
+    tables = fake_tables(graph)
+    graph_json = json.dumps(graph)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        runs = [run_pipeline(graph_json, tables, graph["schemas"], latency, max_concurrency, pack_max_actions)
+                for _ in range(repeat)]
+        tracemalloc.start()
+        run_pipeline(graph_json, tables, graph["schemas"], latency, max_concurrency, pack_max_actions)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    best = min(runs, key=lambda run: run["total"])
+    result = {"actions": num_actions, "peak_mib": peak / 1024 ** 2, **graph_stats(graph), **best}
+    result["ms_per_action"] = best["total"] * 1000 / num_actions
+    return result
+
+
+def scaling_exponent(smaller: dict, larger: dict) -> float:
+    """Slope of log(time) over log(size): 1.0 is linear, 2.0 quadratic."""
+    return math.log(larger["total"] / smaller["total"]) / math.log(larger["actions"] / smaller["actions"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every fake job takes.")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--pack-max-actions", type=int, default=0,
+                        help="Pack up to this many cheap actions per script job (default 0: no packing).")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per size, the best one is reported.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare with the results of a previous --output.")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Relative slowdown against the baseline that fails the run (default 0.25).")
+    parser.add_argument("--min-delta", type=float, default=0.05,
+                        help="Slowdowns of fewer seconds than this are noise and never fail the run (default 0.05).")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'actions':>8}  {'load':>8}  {'catalog':>8}  {'build':>8}  {'cleanup':>8}  {'total':>8}  "
+          f"{'ms/action':>9}  {'peak':>9}  {'jobs':>6}  scaling")
+    for num_actions in sorted(args.sizes):
+        result = bench_size(num_actions, args.latency, args.max_concurrency, args.repeat, args.pack_max_actions)
+        scaling = f"{scaling_exponent(results[-1], result):.2f}" if results else "-"
+        results.append(result)
+        print(f"{num_actions:>8}  " + "  ".join(f"{result[stage]:>7.3f}s" for stage in STAGES + ("total",)) +
+              f"  {result['ms_per_action']:>9.3f}  {result['peak_mib']:>6.1f}MiB  {result['jobs']:>6}  {scaling}")
+        if result["failed"]:
+            print(f"  {result['failed']} actions failed or were skipped")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"latency": args.latency, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = {entry["actions"]: entry for entry in json.load(f)["results"]}
+        regressions = []
+        for result in results:
+            before = baseline.get(result["actions"])
+            if not before:
+                continue
+            change = result["total"] / before["total"] - 1
+            print(f"  {result['actions']} actions: {before['total']:.3f}s -> {result['total']:.3f}s ({change:+.0%})")
+            if change > args.threshold and result["total"] - before["total"] > args.min_delta:
+                regressions.append(result["actions"])
+        if regressions:
+            print(f"::error::Benchmark regression above {args.threshold:.0%} for {', '.join(map(str, regressions))} actions")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark for the offline SQL pre-flight check (src/tests/sql_preflight.py).
+
+Times the check of synthetic compiled graphs (see synthetic_graph.py) in a single
+process and with worker processes, and fails if checking 1k actions takes longer than
+--budget seconds. A few broken queries are planted to make sure they are all found, and a
+few valid ones that look suspicious to make sure they pass.
+
+Usage:
+    python src/benchmarks/bench_preflight.py [--sizes 1000 10000] [--workers 4] [--budget 1.0]
+"""
+import argparse
+import os
+import sys
+import time
+
+_SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_SRC, "tests"))
+
+from dataform_graph import DataformGraph  # noqa: E402
+from sql_preflight import preflight_graph  # noqa: E402
+from synthetic_graph import generate_graph  # noqa: E402
+
+# Broken queries planted in the graph, one per kind of problem
+BROKEN_QUERIES = (
+    "SELCT id FROM `prod-project.raw_source_0.source_0`",
+    "SELECT (id FROM `prod-project.raw_source_0.source_0`",
+    "SELECT id FROM `prod-project.raw_source_0.missing_table`",
+    "SELECT id FROM `prod-project.raw_source_0.source_0` WHERE\nGROUP BY id",
+)
+# Valid queries planted in the graph, which must not be reported
+OK_QUERIES = (
+    "SELECT x.end AS e, x.case AS c FROM `prod-project.raw_source_0.source_0` x",
+    "SELECT `end`, `if` FROM `prod-project.raw_source_0.source_0`",
+    "SELECT CASE WHEN id > 0 THEN 1 ELSE 0 END AS positive FROM `prod-project.raw_source_0.source_0`",
+)
+
+
+def timed_preflight(graph: DataformGraph, workers: int):
+    start = time.perf_counter()
+    findings = preflight_graph(graph, workers=workers)
+    return findings, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes of the parallel run.")
+    parser.add_argument("--budget", type=float, default=1.0, help="Seconds allowed for 1k actions (default 1.0).")
+    args = parser.parse_args()
+
+    over_budget = False
+    print(f"{'actions':>8}  {'statements':>10}  {'1 process':>10}  {f'{args.workers} workers':>10}  found")
+    for num_actions in args.sizes:
+        data = generate_graph(num_actions)
+        for table, query in zip(data["tables"], BROKEN_QUERIES + OK_QUERIES):
+            table["query"] = query
+        graph = DataformGraph(data)
+        statements = sum(len(action.get("queries", [])) + sum(1 for field in ("query", "incrementalQuery") if action.get(field))
+                         + len(action.get("preOps", [])) for action in graph.actions.values())
+
+        findings, serial_time = timed_preflight(graph, 1)
+        parallel_findings, parallel_time = timed_preflight(graph, args.workers)
+        found = {finding["action"] for finding in findings}
+        print(f"{num_actions:>8}  {statements:>10}  {serial_time:>9.3f}s  {parallel_time:>9.3f}s  "
+              f"{len(found)}/{len(BROKEN_QUERIES)}")
+        if len(found) != len(BROKEN_QUERIES) or parallel_findings != findings:
+            print("  Planted problems were missed, or the parallel run found something else")
+            over_budget = True
+        ok_keys = {"{database}.{schema}.{name}".format(**table["target"])
+                   for table in data["tables"][len(BROKEN_QUERIES):len(BROKEN_QUERIES) + len(OK_QUERIES)]}
+        if found & ok_keys:
+            print(f"  Valid queries were reported: {', '.join(sorted(found & ok_keys))}")
+            over_budget = True
+        if min(serial_time, parallel_time) > args.budget * num_actions / 1000:
+            print(f"  Over budget: {args.budget:.2f}s per 1k actions")
+            over_budget = True
+
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
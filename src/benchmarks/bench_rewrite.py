@@ -0,0 +1,73 @@
+"""
+Micro-benchmark for the reference rewriting done by build_sql_query.
+
+Compares the single-pass `sql_rewrite.rewrite_references` with the previous
+implementation, which called `str.replace` once per entry of `test_table_map`.
+
+Usage:
+    python src/benchmarks/bench_rewrite.py [--tables 1000] [--references 50] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+from sql_rewrite import rewrite_references  # noqa: E402
+
+
+def legacy_rewrite(query, test_table_map):
+    """Reference rewriting as done by the old build_sql_query."""
+    for original_table, test_versions in test_table_map.items():
+        original_query_table = f"`{original_table}`"
+        test_query_table = f"`{test_versions['test_table']}`"
+        query = query.replace(original_query_table, test_query_table)
+    return query
+
+
+def generate_case(num_tables: int, num_references: int, seed: int = 42):
+    rng = random.Random(seed)
+    test_table_map = {
+        f"prod-project.dataset_{i % 10}.table_{i}": {"test_table": f"prod-project.dataset_{i % 10}.table_{i}_test_abcd1234"}
+        for i in range(num_tables)
+    }
+    keys = list(test_table_map)
+    selects = []
+    for i in range(num_references):
+        key = rng.choice(keys)
+        selects.append(
+            f"SELECT t{i}.order_id, t{i}.customer_id, SUM(t{i}.total_amount) AS total_{i}\n"
+            f"FROM `{key}` t{i}\nWHERE t{i}.order_date >= DATE_SUB(CURRENT_DATE(), INTERVAL 5 DAY)\n"
+            f"GROUP BY 1, 2"
+        )
+    return "\nUNION ALL\n".join(selects), test_table_map
+
+
+def timed(function, query, test_table_map, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(query, test_table_map)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tables", type=int, default=1000, help="Entries in test_table_map.")
+    parser.add_argument("--references", type=int, default=50, help="Table references in the query.")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    query, test_table_map = generate_case(args.tables, args.references)
+    legacy_result, legacy_time = timed(legacy_rewrite, query, test_table_map, args.repeat)
+    result, single_pass_time = timed(rewrite_references, query, test_table_map, args.repeat)
+
+    print(f"Query: {len(query)} chars, {args.references} references, test_table_map: {args.tables} entries")
+    print(f"  str.replace per table:  {legacy_time * 1000:8.3f} ms")
+    print(f"  single-pass rewrite:    {single_pass_time * 1000:8.3f} ms")
+    print(f"  identical output:       {legacy_result == result}")
+
+
+if __name__ == "__main__":
+    main()
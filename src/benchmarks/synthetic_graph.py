@@ -0,0 +1,195 @@
+"""
+Generator of synthetic compiled Dataform graphs (result.json) for benchmarks.
+
+The graph is shaped like a real warehouse project:
+  - ~8% declarations (raw sources), spread over a few source datasets
+  - tables, incremental tables and views in layers (staging, intermediate, marts),
+    each reading 1-6 upstream actions; the fan-in follows a power law, so most
+    models join one or two inputs and a few join many
+  - upstream actions are picked with preferential attachment, so a handful of
+    popular models (e.g. a customers dimension) fan out to many consumers
+  - assertions on ~10% of the tables, and a few operations
+Queries reference their inputs with backtick-quoted paths, like compiled SQLX.
+
+Usage:
+    python src/benchmarks/synthetic_graph.py --actions 1000 [--seed 42] [--output result.json]
+"""
+import argparse
+import json
+import random
+from typing import Dict, List
+
+PROJECT = "prod-project"
+LAYERS = ("staging", "intermediate", "marts")
+COLUMN_TYPES = ("INTEGER", "STRING", "TIMESTAMP", "NUMERIC", "BOOLEAN", "DATE")
+
+
+def _fan_in(rng: random.Random) -> int:
+    """Number of inputs of a model, power-law distributed between 1 and 6."""
+    return min(6, int(rng.paretovariate(1.6)))
+
+
+def _columns(rng: random.Random, index: int) -> Dict[str, str]:
+    columns = {"id": "INTEGER", "updated_at": "TIMESTAMP"}
+    for column in range(rng.randint(2, 12)):
+        columns[f"col_{index % 50}_{column}"] = rng.choice(COLUMN_TYPES)
+    return columns
+
+
+def _select(alias: str, target: Dict, columns: List[str]) -> str:
+    path = f"{target['database']}.{target['schema']}.{target['name']}"
+    selected = ", ".join(f"{alias}.{column}" for column in columns)
+    return f"SELECT {selected}\nFROM `{path}` {alias}"
+
+
+def generate_graph(num_actions: int, seed: int = 42) -> Dict:
+    """
+    Generate a compiled graph of about `num_actions` actions.
+
+    Returns:
+        Dict: The compiled graph, with the column schema of every declaration and table
+        under a "schemas" key ({"project.dataset.table": {column: type}}), which Dataform
+        doesn't emit and the schema tests ignore, for seeding a fake client.
+    """
+    rng = random.Random(seed)
+    num_declarations = max(1, num_actions * 8 // 100)
+    num_operations = max(0, num_actions // 100)
+    num_models = max(1, (num_actions - num_declarations - num_operations) * 10 // 11)
+    num_assertions = max(0, num_actions - num_declarations - num_operations - num_models)
+
+    graph = {"tables": [], "declarations": [], "assertions": [], "operations": [], "schemas": {}}
+    targets = []  # Readable targets, in creation order
+    weights = []  # Preferential attachment: actions read often are more likely to be read again
+    schemas = graph["schemas"]
+
+    for i in range(num_declarations):
+        target = {"database": PROJECT, "schema": f"raw_source_{i % 5}", "name": f"source_{i}"}
+        graph["declarations"].append({"target": target, "canonicalTarget": dict(target), "fileName": "definitions/sources.js"})
+        schemas[f"{PROJECT}.{target['schema']}.{target['name']}"] = _columns(rng, i)
+        targets.append(target)
+        weights.append(1.0)
+
+    for i in range(num_models):
+        layer = LAYERS[min(len(LAYERS) - 1, i * len(LAYERS) // num_models)]
+        target = {"database": PROJECT, "schema": f"{layer}_{i % 8}", "name": f"{layer}_model_{i}"}
+        # Staging models read sources, later layers mostly read recent models, which gives depth
+        if layer == "staging":
+            candidates = list(range(num_declarations))
+        else:
+            candidates = list(range(max(0, len(targets) - 400), len(targets)))
+        inputs = []
+        for _ in range(min(_fan_in(rng), len(candidates))):
+            choice = rng.choices(candidates, weights=[weights[c] for c in candidates])[0]
+            if choice not in inputs:
+                inputs.append(choice)
+        for choice in inputs:
+            weights[choice] += 1.0
+
+        dependencies = [dict(targets[choice]) for choice in inputs]
+        columns = _columns(rng, i)
+        upstream_columns = [list(schemas[f"{PROJECT}.{dep['schema']}.{dep['name']}"])[:3] for dep in dependencies]
+        query = "\nUNION ALL\n".join(
+            _select(f"t{n}", dep, dep_columns) for n, (dep, dep_columns) in enumerate(zip(dependencies, upstream_columns))
+        )
+        action_type = rng.choices(["table", "incremental", "view"], weights=[6, 3, 1])[0]
+        action = {
+            "target": target,
+            "canonicalTarget": dict(target),
+            "type": action_type,
+            "fileName": f"definitions/{layer}/{target['name']}.sqlx",
+            "query": query,
+            "dependencyTargets": dependencies,
+            "disabled": False,
+        }
+        if action_type == "incremental":
+            action["incrementalQuery"] = f"{query}\nWHERE t0.updated_at > TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 1 DAY)"
+            action["uniqueKey"] = ["id"]
+        if rng.random() < 0.2:
+            action["bigquery"] = {"partitionBy": "DATE(updated_at)"}
+        if rng.random() < 0.05:
+            action["preOps"] = [f"DECLARE max_ts TIMESTAMP DEFAULT (SELECT MAX(updated_at) FROM `{PROJECT}.{dependencies[0]['schema']}.{dependencies[0]['name']}`)"]
+        graph["tables"].append(action)
+        schemas[f"{PROJECT}.{target['schema']}.{target['name']}"] = columns
+        targets.append(target)
+        weights.append(1.0)
+
+    models = graph["tables"]
+    for i in range(num_assertions):
+        table = rng.choice(models)
+        target = {"database": PROJECT, "schema": "dataform_assertions", "name": f"assert_{table['target']['name']}_{i}"}
+        path = f"{PROJECT}.{table['target']['schema']}.{table['target']['name']}"
+        graph["assertions"].append({
+            "target": target,
+            "canonicalTarget": dict(target),
+            "fileName": table["fileName"],
+            "query": f"SELECT id FROM `{path}` GROUP BY id HAVING COUNT(*) > 1",
+            "dependencyTargets": [dict(table["target"])],
+        })
+
+    for i in range(num_operations):
+        table = rng.choice(models)
+        target = {"database": PROJECT, "schema": "operations", "name": f"operation_{i}"}
+        path = f"{PROJECT}.{table['target']['schema']}.{table['target']['name']}"
+        graph["operations"].append({
+            "target": target,
+            "canonicalTarget": dict(target),
+            "fileName": f"definitions/operations/operation_{i}.sqlx",
+            "queries": [f"DELETE FROM `{path}` WHERE updated_at < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 365 DAY)"],
+            "dependencyTargets": [dict(table["target"])],
+        })
+    return graph
+
+
+def fake_tables(graph: Dict, existing_fraction: float = 0.8, seed: int = 42) -> Dict:
+    """
+    Tables to seed a FakeBigQueryClient with: every declaration, plus the current
+    version of `existing_fraction` of the tables, some with a drifted schema so the
+    schema comparison has changes to report.
+    """
+    rng = random.Random(seed)
+    tables = {}
+    declarations = {f"{PROJECT}.{d['target']['schema']}.{d['target']['name']}" for d in graph["declarations"]}
+    for table_ref, columns in graph["schemas"].items():
+        if table_ref in declarations:
+            tables[table_ref] = {"schema": columns, "rows": rng.randint(1000, 10 ** 7)}
+        elif rng.random() < existing_fraction:
+            current = dict(columns)
+            if rng.random() < 0.1:
+                current.pop(next(reversed(current)))
+                current["dropped_column"] = "STRING"
+            tables[table_ref] = {"schema": current, "rows": rng.randint(1000, 10 ** 6)}
+    return tables
+
+
+def graph_stats(graph: Dict) -> Dict:
+    """Number of actions per type and the fan-in/fan-out distribution of the models."""
+    fan_in = [len(action.get("dependencyTargets", [])) for action in graph["tables"]]
+    fan_out = {}
+    for action_type in ("tables", "assertions", "operations"):
+        for action in graph[action_type]:
+            for dependency in action.get("dependencyTargets", []):
+                key = f"{dependency['database']}.{dependency['schema']}.{dependency['name']}"
+                fan_out[key] = fan_out.get(key, 0) + 1
+    return {
+        "action_counts": {action_type: len(graph[action_type]) for action_type in ("declarations", "tables", "assertions", "operations")},
+        "max_fan_in": max(fan_in, default=0),
+        "mean_fan_in": sum(fan_in) / len(fan_in) if fan_in else 0,
+        "max_fan_out": max(fan_out.values(), default=0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--actions", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="result.json")
+    args = parser.parse_args()
+
+    graph = generate_graph(args.actions, args.seed)
+    with open(args.output, "w") as f:
+        json.dump(graph, f)
+    print(f"Synthetic graph written to {args.output}: {json.dumps(graph_stats(graph))}")
+
+
+if __name__ == "__main__":
+    main()
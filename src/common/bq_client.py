@@ -0,0 +1,67 @@
+import importlib
+import json
+import os
+from typing import Any, Optional, Protocol
+
+# Environment variable selecting the client implementation, see create_client
+CLIENT_ENV_VAR = "BQ_CLIENT"
+# Environment variable with the path of a JSON file of FakeBigQueryClient options
+FAKE_CONFIG_ENV_VAR = "FAKE_BIGQUERY_CONFIG"
+
+CLIENT_CHOICES = ("bigquery", "fake")
+
+
+class BigQueryClient(Protocol):
+    """
+    The subset of google.cloud.bigquery.Client used by the schema tests and export_and_load.py.
+
+    Anything implementing these methods with the same semantics can be plugged in with
+    create_client, e.g. the in-process FakeBigQueryClient for offline benchmarks.
+    """
+
+    def query(self, query: str, job_config: Any = None, location: Optional[str] = None,
+              job_id: Optional[str] = None) -> Any: ...
+
+    def get_table(self, table: Any) -> Any: ...
+
+    def update_table(self, table: Any, fields: Any) -> Any: ...
+
+    def copy_table(self, sources: Any, destination: Any, location: Optional[str] = None, job_config: Any = None) -> Any: ...
+
+    def delete_table(self, table: Any, not_found_ok: bool = False) -> None: ...
+
+    def get_job(self, job_id: str, location: Optional[str] = None) -> Any: ...
+
+    def get_dataset(self, dataset_ref: Any) -> Any: ...
+
+    def create_dataset(self, dataset: Any, exists_ok: bool = False) -> Any: ...
+
+
+def create_client(name: Optional[str] = None) -> BigQueryClient:
+    """
+    Create the BigQuery client used by a script.
+
+    Args:
+        name (str): "bigquery" (default) for the real client, "fake" for the in-process
+            FakeBigQueryClient (options from the JSON file in $FAKE_BIGQUERY_CONFIG), or
+            "package.module:factory" for a custom implementation. Defaults to $BQ_CLIENT.
+    """
+    name = name or os.environ.get(CLIENT_ENV_VAR) or "bigquery"
+    if name == "bigquery":
+        from google.cloud import bigquery
+        return bigquery.Client()
+
+    if name == "fake":
+        from fake_bigquery import FakeBigQueryClient
+        options = {}
+        config_path = os.environ.get(FAKE_CONFIG_ENV_VAR)
+        if config_path:
+            with open(config_path, "r") as f:
+                options = json.load(f)
+        print(f"Using the in-process fake BigQuery client{f' ({config_path})' if config_path else ''}")
+        return FakeBigQueryClient(**options)
+
+    module_name, _, factory_name = name.partition(":")
+    if not factory_name:
+        raise ValueError(f"Unknown client '{name}', expected one of {', '.join(CLIENT_CHOICES)} or 'module:factory'")
+    return getattr(importlib.import_module(module_name), factory_name)()
@@ -0,0 +1,478 @@
+"""
+In-process fake of the BigQuery client, for running the scripts offline.
+
+It keeps tables in memory and interprets the statements the scripts submit just
+enough to keep their state consistent: CREATE TABLE (AS SELECT / CLONE), DROP TABLE,
+INSERT, INFORMATION_SCHEMA.COLUMNS/TABLES/PARTITIONS and __TABLES__ reads, dry runs,
+partition copies and deletes through `$partition` decorators, and the per-action error
+handlers of pack scripts (see action_packing.py), with a child job per created table.
+Everything else succeeds without effect. Job latency, table schemas and failures are
+configurable, so the overhead of the harness itself can be measured without BigQuery.
+"""
+import itertools
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Union
+
+from google.api_core.exceptions import BadRequest, Conflict, NotFound
+from google.cloud.bigquery import SchemaField, TableReference, TimePartitioning
+
+DEFAULT_SCHEMA = {"id": "INTEGER", "name": "STRING", "updated_at": "TIMESTAMP"}
+
+# Legacy type names of the tables API mapped to the GoogleSQL names of INFORMATION_SCHEMA
+_SQL_TYPES = {"INTEGER": "INT64", "FLOAT": "FLOAT64", "BOOLEAN": "BOOL", "RECORD": "STRUCT"}
+
+_TABLE = r"`([^`]+)`"
+_CREATE_PATTERN = re.compile(r"CREATE\s+(?:OR\s+REPLACE\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?" + _TABLE, re.IGNORECASE)
+_DROP_PATTERN = re.compile(r"DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?" + _TABLE, re.IGNORECASE)
+_INSERT_PATTERN = re.compile(r"INSERT\s+INTO\s+" + _TABLE, re.IGNORECASE)
+_FROM_PATTERN = re.compile(r"(?:FROM|JOIN|CLONE|LIKE)\s+" + _TABLE, re.IGNORECASE)
+_LIMIT_PATTERN = re.compile(r"\bLIMIT\s+(\d+)", re.IGNORECASE)
+_COLUMNS_PATTERN = re.compile(_TABLE + r"\.INFORMATION_SCHEMA\.COLUMNS", re.IGNORECASE)
+_TABLE_NAMES_PATTERN = re.compile(r"\btable_name\s+(?:IN\s*\(([^)]*)\)|=\s*('[^']*'))", re.IGNORECASE)
+_UNION_PATTERN = re.compile(r"\bUNION\s+ALL\b", re.IGNORECASE)
+_TABLES_PATTERN = re.compile(r"`([^`]+)\.__TABLES__`", re.IGNORECASE)
+_TABLES_VIEW_PATTERN = re.compile(_TABLE + r"\.INFORMATION_SCHEMA\.TABLES\b", re.IGNORECASE)
+_PARTITIONS_PATTERN = re.compile(_TABLE + r"\.INFORMATION_SCHEMA\.PARTITIONS\b", re.IGNORECASE)
+_TEST_SUFFIX_PATTERN = re.compile(r"_(?:test|sample)_[a-z0-9]+$")
+# A single SELECT statement; metadata views read by scripts (e.g. in pre-operations) don't make them metadata reads
+_SELECT_PATTERN = re.compile(r"^\s*(?:SELECT|WITH)\b[^;]*;?\s*$", re.IGNORECASE)
+# A block of a pack script: the action script, then an error handler collecting (action, message)
+_HANDLED_BLOCK_PATTERN = re.compile(
+    r"BEGIN\n(.*?)\nEXCEPTION WHEN ERROR THEN\n[^\n]*STRUCT\('((?:[^'\\]|\\.)*)' AS action", re.DOTALL)
+
+
+class FakeTable:
+    """Table metadata with the attributes of google.cloud.bigquery.Table used by the scripts."""
+
+    def __init__(self, table_ref: str, schema: List[SchemaField], num_rows: int = 0, table_type: str = "TABLE"):
+        self.project, self.dataset_id, self.table_id = table_ref.split(".")
+        self.schema = schema
+        self.num_rows = num_rows if table_type == "TABLE" else None
+        self.num_bytes = num_rows * 100 * len(schema) if table_type == "TABLE" else None
+        self.table_type = table_type
+        self.time_partitioning = None
+        self.range_partitioning = None
+        self.clustering_fields = None
+        self.created = datetime.now(timezone.utc)
+        self.modified = self.created
+        self.expires = None
+        self.partitions: Optional[Dict[str, Dict]] = None  # {partition id: {"rows", "modified"}} if partitioned
+
+    @property
+    def full_table_id(self) -> str:
+        return f"{self.project}:{self.dataset_id}.{self.table_id}"
+
+
+class FakeDataset:
+    def __init__(self, dataset_ref: str, location: str):
+        self.project, self.dataset_id = dataset_ref.split(".")
+        self.location = location
+
+
+class FakeJob:
+    """A finished-on-result() job with the statistics of a QueryJob."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, client: "FakeBigQueryClient", query: str, job_id: Optional[str], dry_run: bool,
+                 rows: List, schema: List[SchemaField], total_bytes: int, error: Optional[str], latency: float,
+                 statement_type: str):
+        self._client = client
+        self.query = query
+        self.job_id = job_id or f"fake_job_{next(self._ids)}"
+        self.dry_run = dry_run
+        self.statement_type = statement_type
+        self.schema = schema
+        self.total_bytes_processed = total_bytes
+        self.total_bytes_billed = 0 if dry_run else max(total_bytes, 10 * 1024 ** 2 if total_bytes else 0)
+        self.slot_millis = None if dry_run else int(latency * 1000)
+        self.cache_hit = False
+        self.created = datetime.now(timezone.utc)
+        self.started = self.created + timedelta(seconds=latency * client.queue_fraction)
+        self.ended = None
+        self.state = "DONE" if dry_run else "RUNNING"
+        self.error_result = None
+        self.parent_job_id = None
+        self.ddl_target_table = None
+        self._rows = rows
+        self._error = error
+        self._latency = latency
+        self._lock = threading.Lock()
+
+    def done(self) -> bool:
+        return self.state == "DONE"
+
+    def result(self, *args, **kwargs):
+        with self._lock:
+            if self.state != "DONE":
+                if self._latency:
+                    time.sleep(self._latency)
+                self.ended = datetime.now(timezone.utc)
+                self.state = "DONE"
+                if self._error:
+                    self.error_result = {"reason": "invalidQuery", "message": self._error}
+        if self._error:
+            raise BadRequest(self._error)
+        return iter(self._rows)
+
+
+class _Row(dict):
+    """Query result row with attribute access, like google.cloud.bigquery.Row."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class FakeBigQueryClient:
+    """
+    Fake BigQuery client keeping tables in memory.
+
+    Args:
+        tables (dict): Initial tables, {"project.dataset.table": {"schema": {column: type},
+            "rows": n, "type": "TABLE" or "VIEW", "age_hours": hours since creation,
+            "last_modified": ISO timestamp (default: the creation time),
+            "partition_column": column of daily partitioning, "clustering": [columns],
+            "partitions": {partition id: {"rows": n, "last_modified": ISO timestamp}}}}.
+        schemas (dict): Output schema per table id, {"project.dataset.table": {column: type}},
+            used for tables created by queries (test tables get the schema of their base
+            table, "orders_test_1a2b3c4d" -> "orders"). Default: the schema of the first
+            table read by the query, else DEFAULT_SCHEMA.
+        latency (float or [min, max]): Seconds every job takes, or a uniform range.
+        queue_fraction (float): Part of the latency reported as queue time.
+        failures (dict): {regex: error message}; jobs whose SQL matches fail with BadRequest.
+        results (dict): {regex: [row dicts]}; rows returned by queries whose SQL matches.
+        location (str): Location of every dataset.
+        seed (int): Seed of the latency randomness.
+    """
+
+    def __init__(self, tables: Dict = None, schemas: Dict = None, latency: Union[float, List[float]] = 0.0,
+                 queue_fraction: float = 0.1, failures: Dict[str, str] = None, results: Dict[str, List[Dict]] = None,
+                 location: str = "EU", seed: int = 0):
+        self.schemas = {table_ref: self._to_schema(schema) for table_ref, schema in (schemas or {}).items()}
+        self.latency = latency
+        self.queue_fraction = queue_fraction
+        self.failures = [(re.compile(pattern, re.IGNORECASE | re.DOTALL), message)
+                         for pattern, message in (failures or {}).items()]
+        self.results = [(re.compile(pattern, re.IGNORECASE | re.DOTALL), rows) for pattern, rows in (results or {}).items()]
+        self.location = location
+        self.tables: Dict[str, FakeTable] = {}
+        self.datasets: Dict[str, FakeDataset] = {}
+        self.jobs: Dict[str, FakeJob] = {}
+        self.job_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        for table_ref, spec in (tables or {}).items():
+            table = self.add_table(table_ref, spec.get("schema", DEFAULT_SCHEMA), spec.get("rows", 1000), spec.get("type", "TABLE"))
+            table.created -= timedelta(hours=spec.get("age_hours", 0))
+            if spec.get("partition_column"):
+                table.time_partitioning = TimePartitioning(field=spec["partition_column"])
+            table.clustering_fields = spec.get("clustering")
+            table.modified = datetime.fromisoformat(spec["last_modified"]) if spec.get("last_modified") else table.created
+            if "partitions" in spec:
+                table.partitions = {
+                    partition_id: {"rows": partition.get("rows", 0),
+                                   "modified": datetime.fromisoformat(partition["last_modified"]) if partition.get("last_modified") else table.modified}
+                    for partition_id, partition in spec["partitions"].items()
+                }
+                table.num_rows = sum(partition["rows"] for partition in table.partitions.values())
+                table.num_bytes = table.num_rows * 100 * len(table.schema)
+
+    @staticmethod
+    def _to_schema(schema) -> List[SchemaField]:
+        if isinstance(schema, dict):
+            return [SchemaField(name, field_type) for name, field_type in schema.items()]
+        return list(schema)
+
+    def add_table(self, table_ref: str, schema=None, num_rows: int = 1000, table_type: str = "TABLE") -> FakeTable:
+        table = FakeTable(table_ref, self._to_schema(schema or DEFAULT_SCHEMA), num_rows, table_type)
+        with self._lock:
+            self.tables[table_ref] = table
+            dataset_ref = table_ref.rsplit(".", 1)[0]
+            self.datasets.setdefault(dataset_ref, FakeDataset(dataset_ref, self.location))
+        return table
+
+    def _latency(self) -> float:
+        if isinstance(self.latency, (list, tuple)):
+            return self._random.uniform(*self.latency)
+        return self.latency
+
+    @staticmethod
+    def _ref(table) -> str:
+        if isinstance(table, str):
+            return table.replace(":", ".")
+        return f"{table.project}.{table.dataset_id}.{table.table_id}"
+
+    # Tables and datasets
+
+    def get_table(self, table) -> FakeTable:
+        table_ref = self._ref(table)
+        with self._lock:
+            if table_ref not in self.tables:
+                raise NotFound(f"Not found: Table {table_ref}")
+            return self.tables[table_ref]
+
+    def update_table(self, table, fields) -> FakeTable:
+        return table
+
+    def delete_table(self, table, not_found_ok: bool = False):
+        table_ref = self._ref(table)
+        if "$" in table_ref:
+            table_ref, partition_id = table_ref.split("$", 1)
+            with self._lock:
+                table = self.tables.get(table_ref)
+                if table is None or table.partitions is None:
+                    raise NotFound(f"Not found: Table {table_ref}")
+                table.partitions.pop(partition_id, None)
+                table.num_rows = sum(partition["rows"] for partition in table.partitions.values())
+                table.num_bytes = table.num_rows * 100 * len(table.schema)
+            return
+        with self._lock:
+            if self.tables.pop(table_ref, None) is None and not not_found_ok:
+                raise NotFound(f"Not found: Table {table_ref}")
+
+    def list_tables(self, dataset) -> List[FakeTable]:
+        dataset_ref = dataset if isinstance(dataset, str) else f"{dataset.project}.{dataset.dataset_id}"
+        with self._lock:
+            return [table for table_ref, table in self.tables.items() if table_ref.rsplit(".", 1)[0] == dataset_ref]
+
+    def get_dataset(self, dataset_ref) -> FakeDataset:
+        dataset_ref = dataset_ref if isinstance(dataset_ref, str) else f"{dataset_ref.project}.{dataset_ref.dataset_id}"
+        with self._lock:
+            if dataset_ref not in self.datasets:
+                raise NotFound(f"Not found: Dataset {dataset_ref}")
+            return self.datasets[dataset_ref]
+
+    def create_dataset(self, dataset, exists_ok: bool = False) -> FakeDataset:
+        dataset_ref = f"{dataset.project}.{dataset.dataset_id}"
+        with self._lock:
+            if dataset_ref in self.datasets and not exists_ok:
+                raise Conflict(f"Already Exists: Dataset {dataset_ref}")
+            return self.datasets.setdefault(dataset_ref, FakeDataset(dataset_ref, getattr(dataset, "location", None) or self.location))
+
+    # Jobs
+
+    def get_job(self, job_id: str, location: Optional[str] = None) -> FakeJob:
+        with self._lock:
+            if job_id not in self.jobs:
+                raise NotFound(f"Not found: Job {job_id}")
+            return self.jobs[job_id]
+
+    def copy_table(self, sources, destination, location: Optional[str] = None, job_config=None) -> FakeJob:
+        source_ref, destination_ref = self._ref(sources), self._ref(destination)
+        if "$" in source_ref:
+            self._copy_partition(source_ref, destination_ref)
+            return self._new_job(f"COPY {source_ref}", None, False, [], [], 0, None, "COPY")
+        source = self.get_table(sources)
+        self.add_table(destination_ref, source.schema, source.num_rows or 0)
+        return self._new_job(f"COPY {self._ref(sources)}", None, False, [], [], 0, None, "COPY")
+
+    def _copy_partition(self, source_ref: str, destination_ref: str):
+        """Copy one partition (`table$partition_id`) into the same partition of the destination."""
+        source_ref, partition_id = source_ref.split("$", 1)
+        destination_ref = destination_ref.split("$", 1)[0]
+        source = self.get_table(source_ref)
+        if source.partitions is None or partition_id not in source.partitions:
+            raise NotFound(f"Not found: Partition {partition_id} of {source_ref}")
+        with self._lock:
+            destination = self.tables.get(destination_ref)
+        if destination is None:
+            destination = self.add_table(destination_ref, source.schema, 0)
+            destination.time_partitioning = source.time_partitioning
+        with self._lock:
+            destination.partitions = dict(destination.partitions or {})
+            destination.partitions[partition_id] = dict(source.partitions[partition_id], modified=datetime.now(timezone.utc))
+            destination.num_rows = sum(partition["rows"] for partition in destination.partitions.values())
+            destination.num_bytes = destination.num_rows * 100 * len(destination.schema)
+            destination.modified = datetime.now(timezone.utc)
+
+    def query(self, query: str, job_config=None, location: Optional[str] = None, job_id: Optional[str] = None) -> FakeJob:
+        dry_run = bool(getattr(job_config, "dry_run", False))
+        error = next((message for pattern, message in self.failures if pattern.search(query)), None)
+        sources = [table_ref for table_ref in _FROM_PATTERN.findall(query) if table_ref in self.tables]
+        total_bytes = sum(self._scanned_bytes(query, table_ref) for table_ref in sources)
+        rows, schema, statement_type = [], [], "SELECT"
+
+        metadata_read = bool(_SELECT_PATTERN.match(query))
+        columns_match = metadata_read and _COLUMNS_PATTERN.search(query)
+        tables_match = metadata_read and _TABLES_PATTERN.search(query)
+        tables_view_match = metadata_read and _TABLES_VIEW_PATTERN.search(query)
+        partitions_match = metadata_read and _PARTITIONS_PATTERN.search(query)
+        if columns_match:
+            rows = [row for part in _UNION_PATTERN.split(query) for row in self._columns_rows(part)]
+        elif tables_match:
+            rows = self._tables_rows(tables_match.group(1))
+        elif tables_view_match:
+            rows = [_Row(table_name=table.table_id, creation_time=table.created, table_type="VIEW" if table.table_type == "VIEW" else "BASE TABLE")
+                    for table in self.list_tables(tables_view_match.group(1))]
+        elif partitions_match:
+            rows = [row for part in _UNION_PATTERN.split(query) for row in self._partitions_rows(part)]
+        elif metadata_read and "INFORMATION_SCHEMA" in query.upper():
+            rows = []
+        elif dry_run:
+            schema = self._output_schema(None, sources)
+        elif _HANDLED_BLOCK_PATTERN.search(query):
+            # Failures are matched per block, a failing action doesn't fail the script
+            return self._run_handled_blocks(query, job_id)
+        elif error is None:
+            statement_type = self._apply(query, sources)
+            rows = next(([_Row(row) for row in result_rows] for pattern, result_rows in self.results if pattern.search(query)), [])
+
+        job = self._new_job(query, job_id, dry_run, rows, schema, total_bytes, error, statement_type)
+        if statement_type == "SCRIPT":
+            self._add_child_jobs(job, query, sources)
+        return job
+
+    def _run_handled_blocks(self, query: str, job_id: Optional[str]) -> FakeJob:
+        """Run a script of blocks with error handlers: failing blocks are skipped and return (action, message)."""
+        rows, total_bytes, applied = [], 0, []
+        for block, action in _HANDLED_BLOCK_PATTERN.findall(query):
+            error = next((message for pattern, message in self.failures if pattern.search(block)), None)
+            if error:
+                rows.append(_Row(action=action.replace("\\'", "'"), message=error))
+                continue
+            sources = [table_ref for table_ref in _FROM_PATTERN.findall(block) if table_ref in self.tables]
+            total_bytes += sum(self._scanned_bytes(block, table_ref) for table_ref in sources)
+            self._apply(block, sources)
+            applied.append((block, sources))
+        job = self._new_job(query, job_id, False, rows, [], total_bytes, None, "SCRIPT")
+        for block, sources in applied:
+            self._add_child_jobs(job, block, sources)
+        return job
+
+    def _add_child_jobs(self, parent: FakeJob, query: str, sources: List[str]):
+        """Add a child job to a script for every table it creates, with the bytes of its sources."""
+        for table_ref in _CREATE_PATTERN.findall(query):
+            read = [source for source in sources if source != table_ref]
+            child = FakeJob(self, query, None, False, [], [], sum(self._scanned_bytes(query, source) for source in read),
+                            None, 0.0, "CREATE_TABLE_AS_SELECT")
+            child.parent_job_id = parent.job_id
+            child.ddl_target_table = TableReference.from_string(table_ref)
+            child.slot_millis = (parent.slot_millis or 0) // max(1, len(_CREATE_PATTERN.findall(parent.query)))
+            child.result()
+            with self._lock:
+                self.jobs[child.job_id] = child
+
+    def list_jobs(self, parent_job=None, **kwargs) -> List[FakeJob]:
+        parent_id = getattr(parent_job, "job_id", parent_job)
+        with self._lock:
+            return [job for job in self.jobs.values() if parent_id is None or job.parent_job_id == parent_id]
+
+    def _scanned_bytes(self, query: str, table_ref: str) -> int:
+        """Bytes read from a table; a filter on its partition column right after it reads a tenth."""
+        table = self.tables[table_ref]
+        partitioning = table.time_partitioning
+        if partitioning and partitioning.field and re.search(
+                rf"`{re.escape(table_ref)}`\s+WHERE\s+`?{re.escape(partitioning.field)}`?\s*>=", query, re.IGNORECASE):
+            return (table.num_bytes or 0) // 10
+        return table.num_bytes or 0
+
+    def _new_job(self, query, job_id, dry_run, rows, schema, total_bytes, error, statement_type) -> FakeJob:
+        with self._lock:
+            if job_id and job_id in self.jobs:
+                raise Conflict(f"Already Exists: Job {job_id}")
+            self.job_count += 1
+            job = FakeJob(self, query, job_id, dry_run, rows, schema, total_bytes, error,
+                          0.0 if dry_run else self._latency(), statement_type)
+            self.jobs[job.job_id] = job
+            return job
+
+    def _output_schema(self, table_ref: Optional[str], sources: List[str]) -> List[SchemaField]:
+        """Schema of a table created by a query: configured, else that of its base or first source table."""
+        if table_ref:
+            base_ref = _TEST_SUFFIX_PATTERN.sub("", table_ref)
+            for candidate in (table_ref, base_ref):
+                if candidate in self.schemas:
+                    return list(self.schemas[candidate])
+            if base_ref in self.tables and base_ref != table_ref:
+                return list(self.tables[base_ref].schema)
+        if sources:
+            return list(self.tables[sources[0]].schema)
+        return self._to_schema(DEFAULT_SCHEMA)
+
+    def _apply(self, query: str, sources: List[str]) -> str:
+        """Apply the table changes of a statement (or script) and return its statement type."""
+        statement_type = "SCRIPT" if query.lstrip().upper().startswith("BEGIN") else "SELECT"
+        for table_ref in _DROP_PATTERN.findall(query):
+            with self._lock:
+                self.tables.pop(table_ref, None)
+            statement_type = statement_type if statement_type == "SCRIPT" else "DROP_TABLE"
+        for table_ref in _CREATE_PATTERN.findall(query):
+            read = [source for source in sources if source != table_ref]
+            num_rows = self.tables[read[0]].num_rows or 1000 if read else 1000
+            limit = _LIMIT_PATTERN.search(query)
+            if limit:
+                num_rows = min(num_rows, int(limit.group(1)))
+            like = re.search(rf"`{re.escape(table_ref)}`\s+LIKE\s+" + _TABLE, query, re.IGNORECASE)
+            if re.search(r"\bWHERE\s+FALSE\b", query, re.IGNORECASE) or like:
+                num_rows = 0
+            schema = self._output_schema(table_ref, read)
+            if re.search(r"\bAS\s+partition_id\b", query, re.IGNORECASE):
+                schema = schema + [SchemaField("partition_id", "INTEGER")]
+            elif re.search(r"except\s*\(\s*partition_id\s*\)", query, re.IGNORECASE):
+                schema = [field for field in schema if field.name != "partition_id"]
+            table = self.add_table(table_ref, schema, num_rows)
+            if like and like.group(1) in self.tables:
+                table.time_partitioning = self.tables[like.group(1)].time_partitioning
+                table.partitions = {} if self.tables[like.group(1)].partitions is not None else None
+            statement_type = statement_type if statement_type == "SCRIPT" else "CREATE_TABLE_AS_SELECT"
+        if _INSERT_PATTERN.search(query) and statement_type != "SCRIPT":
+            statement_type = "INSERT"
+        return statement_type
+
+    def _columns_rows(self, query: str) -> List[_Row]:
+        """Rows of a COLUMNS view read, restricted to `table_name IN (...)` if the query filters on it."""
+        columns_match = _COLUMNS_PATTERN.search(query)
+        if not columns_match:
+            return []
+        tables = self._filtered_tables(query, columns_match.group(1))
+        return [
+            _Row(table_catalog=table.project, table_schema=table.dataset_id, table_name=table.table_id, column_name=field.name,
+                 is_nullable="NO" if field.mode == "REQUIRED" else "YES",
+                 data_type=_SQL_TYPES.get(field.field_type, field.field_type))
+            for _, table in tables for field in table.schema
+        ]
+
+    def _filtered_tables(self, query: str, dataset_ref: str) -> List:
+        """(table ref, table) of a dataset, restricted to `table_name IN (...)` or `= '...'` if the query filters on it."""
+        names_match = _TABLE_NAMES_PATTERN.search(query)
+        names = set(re.findall(r"'([^']*)'", names_match.group(1) or names_match.group(2))) if names_match else None
+        with self._lock:
+            return [(table_ref, table) for table_ref, table in self.tables.items()
+                    if table_ref.rsplit(".", 1)[0] == dataset_ref and (names is None or table.table_id in names)]
+
+    def _partitions_rows(self, query: str) -> List[_Row]:
+        """Rows of a PARTITIONS view read; unpartitioned tables have a single row with a NULL partition_id."""
+        partitions_match = _PARTITIONS_PATTERN.search(query)
+        if not partitions_match:
+            return []
+        rows = []
+        for _, table in self._filtered_tables(query, partitions_match.group(1)):
+            if table.table_type != "TABLE":
+                continue
+            if table.partitions is None and table.time_partitioning is not None:
+                continue  # Partitioned, with no partitions configured
+            if table.partitions is None:
+                rows.append(_Row(table_name=table.table_id, partition_id=None, total_rows=table.num_rows,
+                                 last_modified_time=table.modified))
+                continue
+            rows.extend(_Row(table_name=table.table_id, partition_id=partition_id, total_rows=partition["rows"],
+                             last_modified_time=partition["modified"])
+                        for partition_id, partition in sorted(table.partitions.items()))
+        return rows
+
+    def _tables_rows(self, dataset_ref: str) -> List[_Row]:
+        with self._lock:
+            tables = [table for table_ref, table in self.tables.items() if table_ref.rsplit(".", 1)[0] == dataset_ref]
+        return [
+            _Row(table_id=table.table_id, type=2 if table.table_type == "VIEW" else 1,
+                 row_count=table.num_rows or 0, size_bytes=table.num_bytes or 0,
+                 creation_time=int(table.created.timestamp() * 1000), last_modified_time=int(table.modified.timestamp() * 1000))
+            for table in tables
+        ]
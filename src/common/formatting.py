@@ -0,0 +1,7 @@
+def format_bytes(num_bytes: int) -> str:
+    """Format a number of bytes for the reports, e.g. 1536 -> "1.5 KB"."""
+    size = float(num_bytes or 0)
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if size < 1024 or unit == "TB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
@@ -0,0 +1,192 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Action (table, transfer...) the jobs submitted by the current thread are attributed to
+_current_action = contextvars.ContextVar("current_action", default="other")
+
+
+@contextmanager
+def job_action(action: str):
+    """Attribute every job submitted inside this block, in this thread, to `action`."""
+    token = _current_action.set(action)
+    try:
+        yield
+    finally:
+        _current_action.reset(token)
+
+
+def _millis(start, end) -> Optional[float]:
+    if start is None or end is None:
+        return None
+    return (end - start).total_seconds() * 1000
+
+
+class JobRecorder:
+    """
+    Thread-safe record of the BigQuery jobs submitted during a run.
+
+    Each record has the job id, the action it belongs to, wall time and queue time (from
+    the job's created/started/ended timestamps), slot-ms, bytes processed and billed, and
+    whether the result came from the query cache. Child jobs of a script are recorded with
+    the id of their parent job.
+    """
+
+    def __init__(self):
+        self.records: List[Dict] = []
+        self._lock = threading.Lock()
+        self._origin = time.time()
+
+    def record(self, job, action: str, kind: str, submitted: float, finished: float, error: Exception = None) -> Dict:
+        created, started, ended = getattr(job, "created", None), getattr(job, "started", None), getattr(job, "ended", None)
+        wall_ms = _millis(created, ended)
+        entry = {
+            "job_id": getattr(job, "job_id", None),
+            "parent_job_id": getattr(job, "parent_job_id", None),
+            "action": action,
+            "kind": kind,
+            "statement_type": getattr(job, "statement_type", None),
+            # Server-side timestamps when available, client-side otherwise
+            "start_s": (created.timestamp() if created else submitted) - self._origin,
+            "wall_ms": wall_ms if wall_ms is not None else (finished - submitted) * 1000,
+            "queue_ms": _millis(created, started),
+            "slot_ms": getattr(job, "slot_millis", None),
+            "bytes_processed": getattr(job, "total_bytes_processed", None),
+            "bytes_billed": getattr(job, "total_bytes_billed", None),
+            "cache_hit": getattr(job, "cache_hit", None),
+            "error": str(error).split("\n")[0] if error else None,
+        }
+        with self._lock:
+            self.records.append(entry)
+        return entry
+
+    def action_totals(self) -> List[Dict]:
+        """
+        Per action: number of jobs, summed wall time, queue time, slot-ms and bytes billed, slowest first.
+
+        Scripts whose child jobs were recorded are left out, their children already account for them.
+        """
+        totals = {}
+        with self._lock:
+            records = list(self.records)
+        parents = {entry["parent_job_id"] for entry in records if entry["parent_job_id"]}
+        for entry in records:
+            if entry["job_id"] in parents:
+                continue
+            total = totals.setdefault(entry["action"], {
+                "action": entry["action"], "jobs": 0, "wall_ms": 0.0, "queue_ms": 0.0, "slot_ms": 0, "bytes_billed": 0,
+            })
+            total["jobs"] += 1
+            total["wall_ms"] += entry["wall_ms"] or 0
+            total["queue_ms"] += entry["queue_ms"] or 0
+            total["slot_ms"] += entry["slot_ms"] or 0
+            total["bytes_billed"] += entry["bytes_billed"] or 0
+        return sorted(totals.values(), key=lambda total: total["wall_ms"], reverse=True)
+
+    def print_report(self, top_n: int = 10):
+        totals = self.action_totals()
+        if not totals:
+            return
+        print(f"\nSlowest actions (top {min(top_n, len(totals))} of {len(totals)}, {len(self.records)} jobs):")
+        print(f"  {'wall':>9}  {'queued':>9}  {'slot-ms':>12}  {'billed':>10}  {'jobs':>4}  action")
+        for total in totals[:top_n]:
+            print(f"  {total['wall_ms'] / 1000:>8.1f}s  {total['queue_ms'] / 1000:>8.1f}s  {total['slot_ms']:>12}  "
+                  f"{total['bytes_billed'] / 1024 ** 2:>7.1f}MiB  {total['jobs']:>4}  {total['action']}")
+        slot_ms = sum(total["slot_ms"] for total in totals)
+        billed = sum(total["bytes_billed"] for total in totals)
+        print(f"  Total: {slot_ms} slot-ms, {billed / 1024 ** 3:.2f} GiB billed")
+
+    def trace_events(self) -> List[Dict]:
+        """
+        Build Chrome trace events (viewable in Perfetto or chrome://tracing).
+
+        Every action gets its own track, with one slice per job and a nested "queued" slice
+        for the time the job waited for slots, so the critical path of the DAG is visible.
+        """
+        with self._lock:
+            records = sorted(self.records, key=lambda entry: entry["start_s"])
+        origin = records[0]["start_s"] if records else 0
+        tracks = {}
+        events = []
+        for entry in records:
+            if entry["action"] not in tracks:
+                tracks[entry["action"]] = len(tracks) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tracks[entry["action"]],
+                               "args": {"name": entry["action"]}})
+            tid = tracks[entry["action"]]
+            start_us = (entry["start_s"] - origin) * 1e6
+            events.append({
+                "name": entry["statement_type"] or entry["kind"], "cat": entry["kind"], "ph": "X",
+                "pid": 1, "tid": tid, "ts": start_us, "dur": entry["wall_ms"] * 1000,
+                "args": {key: value for key, value in entry.items() if key not in ("start_s",)},
+            })
+            if entry["queue_ms"]:
+                events.append({"name": "queued", "cat": "queue", "ph": "X", "pid": 1, "tid": tid,
+                               "ts": start_us, "dur": entry["queue_ms"] * 1000})
+        return events
+
+    def write_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, f)
+        print(f"Job trace written to {path} (open it in https://ui.perfetto.dev)")
+
+
+class RecordedJob:
+    """A BigQuery job that is recorded once its result has been awaited."""
+
+    def __init__(self, job, recorder: JobRecorder, action: str, kind: str):
+        self._job = job
+        self._recorder = recorder
+        self._action = action
+        self._kind = kind
+        self._submitted = time.time()
+        self._recorded = False
+
+    def __getattr__(self, name):
+        return getattr(self._job, name)
+
+    def _record(self, error: Exception = None):
+        if not self._recorded:
+            self._recorded = True
+            self._recorder.record(self._job, self._action, self._kind, self._submitted, time.time(), error)
+
+    def result(self, *args, **kwargs):
+        try:
+            result = self._job.result(*args, **kwargs)
+        except Exception as e:
+            self._record(e)
+            raise
+        self._record()
+        return result
+
+
+class RecordingClient:
+    """
+    Wrapper of a bigquery.Client recording every query and copy job it submits.
+
+    Jobs are attributed to the action set with `job_action` in the submitting thread.
+    Dry-run jobs are not recorded, they don't run. Everything else is passed through.
+    """
+
+    def __init__(self, client, recorder: JobRecorder):
+        self._client = client
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def query(self, *args, **kwargs):
+        job = self._client.query(*args, **kwargs)
+        if getattr(job, "dry_run", False):
+            return job
+        return RecordedJob(job, self.recorder, _current_action.get(), "query")
+
+    def copy_table(self, *args, **kwargs):
+        return RecordedJob(self._client.copy_table(*args, **kwargs), self.recorder, _current_action.get(), "copy")
+
+    def get_job(self, *args, **kwargs):
+        # Jobs of earlier runs (see transfer_jobs.run_query_with_retry) are recorded as well
+        return RecordedJob(self._client.get_job(*args, **kwargs), self.recorder, _current_action.get(), "existing")
@@ -0,0 +1,203 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+# Ways to split the source into the buckets of the temporary partitioned table
+#   - hash: MOD of FARM_FINGERPRINT over bucket_key (or the serialized row), no global sort
+#   - native: one bucket per partition of a time or integer-range partitioned source
+#   - row_number: the original ROW_NUMBER() numbering, a global sort on a single worker
+BUCKETING_STRATEGIES = ("hash", "native", "row_number")
+
+# Range partitioned tables can't have more partitions than this
+MAX_BUCKETS = 10000
+
+# INFORMATION_SCHEMA.PARTITIONS partition_id formats per time partitioning type
+_PARTITION_ID_FORMATS = {"HOUR": "%Y%m%d%H", "DAY": "%Y%m%d", "MONTH": "%Y%m", "YEAR": "%Y"}
+
+
+def bucket_count(num_rows: Optional[int], max_rows: int, partition_size: int) -> int:
+    """Number of buckets of about partition_size rows for the rows that will be transferred."""
+    rows = min(num_rows, max_rows) if num_rows is not None else max_rows
+    return max(1, min(MAX_BUCKETS - 1, (rows + partition_size - 1) // partition_size))
+
+
+def build_row_number_query(source_table_ref: str, partitioned_table_ref: str, partition_size: int,
+                           max_rows: int) -> Tuple[str, int]:
+    """The original bucketing: number every row, then RANGE_BUCKET the row numbers."""
+    query = f"""
+    CREATE OR REPLACE TABLE `{partitioned_table_ref}`
+    PARTITION BY RANGE_BUCKET(partition_id, GENERATE_ARRAY(0, {max_rows // partition_size}, 1))
+    AS
+    SELECT
+        * except(row_num),
+        RANGE_BUCKET(row_num, GENERATE_ARRAY({partition_size}, {max_rows}, {partition_size})) AS partition_id
+    FROM (
+        SELECT
+            *,
+            ROW_NUMBER() OVER (ORDER BY (SELECT NULL)) AS row_num
+        FROM
+            `{source_table_ref}`
+    )
+    WHERE
+        row_num <= {max_rows};
+    """
+    return query, max(1, (max_rows + partition_size - 1) // partition_size)
+
+
+def _capped_bucket_query(partitioned_table_ref: str, num_buckets: int, bucketed_select: str,
+                         cap_per_bucket: Optional[int]) -> str:
+    """
+    Wrap a SELECT producing `partition_id` into the CREATE TABLE of the partitioned table.
+
+    When `cap_per_bucket` is set, rows are numbered within their bucket only, so the
+    window is computed in parallel per bucket instead of as one global sort.
+    """
+    if cap_per_bucket is None:
+        select = bucketed_select
+    else:
+        select = f"""
+        SELECT * except(bucket_row_num)
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY partition_id) AS bucket_row_num
+            FROM ({bucketed_select})
+        )
+        WHERE bucket_row_num <= {cap_per_bucket}
+        """
+    return f"""
+    CREATE OR REPLACE TABLE `{partitioned_table_ref}`
+    PARTITION BY RANGE_BUCKET(partition_id, GENERATE_ARRAY(0, {num_buckets}, 1))
+    AS
+    {select};
+    """
+
+
+def _cap_per_bucket(num_rows: Optional[int], max_rows: int, num_buckets: int) -> Optional[int]:
+    """Rows kept per bucket so at most max_rows are transferred, None if the whole source fits."""
+    if num_rows is not None and num_rows <= max_rows:
+        return None
+    return max(1, (max_rows + num_buckets - 1) // num_buckets)
+
+
+def build_hash_query(source_table_ref: str, partitioned_table_ref: str, num_buckets: int, max_rows: int,
+                     num_rows: Optional[int] = None, bucket_key: Optional[List[str]] = None) -> Tuple[str, int]:
+    """
+    Bucket rows with MOD(FARM_FINGERPRINT(...), num_buckets) on bucket_key columns, or on
+    the serialized row when no key is configured.
+    """
+    if bucket_key:
+        columns = ", ".join(f"src.`{column}`" for column in bucket_key)
+        hash_input = f"TO_JSON_STRING(STRUCT({columns}))"
+    else:
+        hash_input = "TO_JSON_STRING(src)"
+    # ABS after MOD, so the INT64 minimum returned by FARM_FINGERPRINT can't overflow
+    bucketed_select = f"""
+        SELECT src.*, ABS(MOD(FARM_FINGERPRINT({hash_input}), {num_buckets})) AS partition_id
+        FROM `{source_table_ref}` AS src
+    """
+    cap = _cap_per_bucket(num_rows, max_rows, num_buckets)
+    return _capped_bucket_query(partitioned_table_ref, num_buckets, bucketed_select, cap), num_buckets
+
+
+def get_native_buckets(client, source_table) -> Tuple[str, int]:
+    """
+    Map the native partitions of a source table to bucket numbers 0..span.
+
+    Returns:
+        Tuple of (SQL expression computing the bucket of a row, number of buckets).
+        Rows in the NULL or unpartitioned partition go to the last bucket.
+
+    Raises:
+        ValueError: If the source isn't partitioned or has too many partitions.
+    """
+    range_partitioning = getattr(source_table, "range_partitioning", None)
+    if range_partitioning is not None:
+        field = range_partitioning.field
+        start, end, interval = range_partitioning.range_.start, range_partitioning.range_.end, range_partitioning.range_.interval
+        span = (end - start + interval - 1) // interval
+        expression = f"IFNULL(IF(`{field}` >= {start} AND `{field}` < {end}, DIV(`{field}` - {start}, {interval}), NULL), {span})"
+        return _check_span(expression, span)
+
+    time_partitioning = getattr(source_table, "time_partitioning", None)
+    if time_partitioning is None:
+        raise ValueError("source table is not partitioned")
+
+    partitioning_type = (time_partitioning.type_ or "DAY").upper()
+    column = f"`{time_partitioning.field}`" if time_partitioning.field else "_PARTITIONTIME"
+    partitions_query = f"""
+    SELECT partition_id
+    FROM `{source_table.project}.{source_table.dataset_id}`.INFORMATION_SCHEMA.PARTITIONS
+    WHERE table_name = '{source_table.table_id}'
+      AND partition_id NOT IN ('__NULL__', '__UNPARTITIONED__')
+      AND total_rows > 0
+    """
+    partition_ids = [row.partition_id for row in client.query(partitions_query).result()]
+    if not partition_ids:
+        raise ValueError("source table has no partitions with rows")
+
+    first = datetime.strptime(min(partition_ids), _PARTITION_ID_FORMATS[partitioning_type])
+    last = datetime.strptime(max(partition_ids), _PARTITION_ID_FORMATS[partitioning_type])
+    if partitioning_type == "HOUR":
+        span = int((last - first).total_seconds() // 3600) + 1
+        bucket = f"DATETIME_DIFF(DATETIME_TRUNC(DATETIME({column}), HOUR), DATETIME '{first:%Y-%m-%d %H:00:00}', HOUR)"
+    else:
+        if partitioning_type == "DAY":
+            span = (last - first).days + 1
+        elif partitioning_type == "MONTH":
+            span = (last.year - first.year) * 12 + last.month - first.month + 1
+        else:
+            span = last.year - first.year + 1
+        bucket = f"DATE_DIFF(DATE({column}), DATE '{first:%Y-%m-%d}', {partitioning_type})"
+    expression = f"IFNULL(IF({bucket} BETWEEN 0 AND {span - 1}, {bucket}, NULL), {span})"
+    return _check_span(expression, span)
+
+
+def _check_span(expression: str, span: int) -> Tuple[str, int]:
+    num_buckets = span + 1  # One extra bucket for NULL and out of range rows
+    if num_buckets >= MAX_BUCKETS:
+        raise ValueError(f"source table has {num_buckets} partitions, more than the {MAX_BUCKETS - 1} supported")
+    return expression, num_buckets
+
+
+def build_native_query(client, source_table, source_table_ref: str, partitioned_table_ref: str, max_rows: int,
+                       num_rows: Optional[int] = None) -> Tuple[str, int]:
+    """Bucket rows by the native partition of the source, capped per bucket."""
+    expression, num_buckets = get_native_buckets(client, source_table)
+    bucketed_select = f"""
+        SELECT *, {expression} AS partition_id
+        FROM `{source_table_ref}`
+    """
+    cap = _cap_per_bucket(num_rows, max_rows, num_buckets)
+    return _capped_bucket_query(partitioned_table_ref, num_buckets, bucketed_select, cap), num_buckets
+
+
+def build_partition_query(client, strategy: str, source_table, source_table_ref: str, partitioned_table_ref: str,
+                          partition_size: int, max_rows: int, bucket_key: Optional[List[str]] = None,
+                          num_rows: Optional[int] = None) -> Tuple[str, int]:
+    """
+    Build the CREATE TABLE statement of the temporary partitioned table for a bucketing strategy.
+
+    Args:
+        strategy (str): One of BUCKETING_STRATEGIES.
+        source_table: Table metadata of the source, or None if it couldn't be read.
+        num_rows (int): Row count of the source from the transfer plan, default: from source_table.
+
+    Returns:
+        Tuple of (query, number of buckets). Buckets are numbered 0..n-1 in `partition_id`.
+    """
+    if strategy not in BUCKETING_STRATEGIES:
+        raise ValueError(f"Unknown bucketing strategy '{strategy}', expected one of {', '.join(BUCKETING_STRATEGIES)}")
+    if num_rows is None:
+        num_rows = getattr(source_table, "num_rows", None)
+    if strategy == "row_number":
+        # Don't create buckets beyond the rows the source actually has
+        rows_to_transfer = min(max_rows, num_rows) if num_rows is not None else max_rows
+        return build_row_number_query(source_table_ref, partitioned_table_ref, partition_size, max(1, rows_to_transfer))
+
+    if strategy == "native":
+        try:
+            return build_native_query(client, source_table, source_table_ref, partitioned_table_ref, max_rows, num_rows)
+        except Exception as e:
+            reason = str(e).split("\n")[0]
+            print(f"Native bucketing not possible for {source_table_ref} ({reason}), using hash bucketing...")
+
+    num_buckets = bucket_count(num_rows, max_rows, partition_size)
+    return build_hash_query(source_table_ref, partitioned_table_ref, num_buckets, max_rows, num_rows, bucket_key)
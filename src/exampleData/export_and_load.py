@@ -1,15 +1,545 @@
+import argparse
+import contextvars
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
 from google.cloud import bigquery
 import sys, os
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from bq_client import CLIENT_CHOICES, create_client
+from job_telemetry import JobRecorder, RecordingClient, job_action
+from bucketing import build_partition_query
+from transfer_jobs import coalesce_partitions, partitions_per_job_for, run_copy_with_retry, run_jobs, run_query_with_retry
+from transfer_journal import TransferJournal, config_signature, range_label
+from transfer_plan import load_table_stats, plan_transfer, print_plan
+from transfer_sync import WHOLE_TABLE, SyncState, changed_units, load_partitions, load_shards, newest_shards, partition_window
 
-def prepare_partitioned_data(config_path: str):
+# Overwrite policies for destination tables that already exist
+OVERWRITE_POLICIES = ("ask", "always", "never")
+
+
+def can_clone(client: bigquery.Client, source_table_ref: str, location: str):
+    """
+    Check if the source table can be cloned/copied server-side into the target location.
+
+    Clones and copy jobs only work for real tables (not views, materialized views or
+    external tables) within the same location.
+
+    Returns:
+        Tuple of (clone_possible, reason, source_table).
+    """
+    source_table = client.get_table(source_table_ref)
+    if source_table.table_type != "TABLE":
+        return False, f"source is a {source_table.table_type}", source_table
+    source_dataset = client.get_dataset(f"{source_table.project}.{source_table.dataset_id}")
+    if (source_dataset.location or "").upper() != (location or "").upper():
+        return False, f"source location {source_dataset.location} differs from target location {location}", source_table
+    return True, "", source_table
+
+
+def transfer_fast_path(client: bigquery.Client, source_table, source_table_ref: str, target_table_ref: str,
+                       location: str, max_rows: int, job_budget: threading.Semaphore = None):
+    """
+    Transfer a table server-side in a single job, without the temporary partitioned table.
+
+    - clone: zero-copy `CREATE OR REPLACE TABLE ... CLONE`, when the whole table fits in max_rows
+    - copy: a copy job, used when the clone statement is rejected
+    - capped_copy: one `CREATE OR REPLACE TABLE ... AS SELECT ... LIMIT max_rows` for bigger tables
+
+    Returns:
+        Tuple of (path taken, seconds spent).
+    """
+    start = time.time()
+    if source_table.num_rows is not None and source_table.num_rows > max_rows:
+        print(f"Source has {source_table.num_rows} rows, copying the first {max_rows} rows server-side...")
+        run_query_with_retry(
+            client,
+            f"CREATE OR REPLACE TABLE `{target_table_ref}` AS SELECT * FROM `{source_table_ref}` LIMIT {max_rows}",
+            location, job_budget=job_budget,
+        )
+        return "capped_copy", time.time() - start
+
+    try:
+        print(f"Cloning {source_table_ref} into {target_table_ref}...")
+        run_query_with_retry(
+            client, f"CREATE OR REPLACE TABLE `{target_table_ref}` CLONE `{source_table_ref}`", location,
+            job_budget=job_budget,
+        )
+        return "clone", time.time() - start
+    except Exception as e:
+        lines = str(e).split("\n")
+        print(f"Clone not possible ({lines[0] if lines else e}), using a copy job...")
+
+    start = time.time()
+    job_config = bigquery.CopyJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+    with job_budget or nullcontext():
+        client.copy_table(source_table_ref, target_table_ref, location=location, job_config=job_config).result()
+    return "copy", time.time() - start
+
+
+def table_exists(client: bigquery.Client, table_ref: str) -> bool:
+    try:
+        client.get_table(table_ref)
+        return True
+    except Exception:
+        return False
+
+
+def validate_table_config(table_config: dict):
+    """Exit with an error if mandatory parameters of a table configuration are missing."""
+    missing_params = []
+    for param in ("source_project", "source_dataset", "source_table", "target_project"):
+        if not table_config.get(param):
+            missing_params.append(param)
+
+    if missing_params:
+        print(f"ERROR: Missing mandatory parameters in table configuration: {', '.join(missing_params)}")
+        print(f"Configuration details: {table_config}")
+        sys.exit(1)
+
+
+def get_source_table_ref(table_config: dict) -> str:
+    return f"{table_config['source_project']}.{table_config['source_dataset']}.{table_config['source_table']}"
+
+
+def get_target_dataset(table_config: dict) -> str:
+    return f"{table_config['source_project'].replace('-', '_')}__{table_config['source_dataset']}"
+
+
+def get_target_table_ref(table_config: dict) -> str:
+    return f"{table_config['target_project']}.{get_target_dataset(table_config)}.{table_config['source_table']}"
+
+
+def shard_prefix(table_config: dict):
+    """The prefix of a family of date-sharded tables (`"source_table": "event_*"`), None for a single table."""
+    source_table = table_config["source_table"]
+    return source_table[:-1] if source_table.endswith("*") else None
+
+
+def confirm_overwrite(target_table_ref: str, overwrite: str, prompt_lock: threading.Lock = None) -> bool:
+    """Apply the overwrite policy to an existing destination table."""
+    if overwrite == "ask":
+        with prompt_lock or nullcontext():
+            response = input(
+                f"Destination table {target_table_ref} already exists. Do you want to overwrite it? (y/n): "
+            ).strip().lower()
+    else:
+        response = "y" if overwrite == "always" else "n"
+    if response != 'y':
+        print(f"Skipping further actions for {target_table_ref}...")
+        return False
+    return True
+
+
+def ensure_dataset(client: bigquery.Client, target_project: str, target_dataset: str, location: str):
+    print(f"Ensuring destination dataset {target_dataset} exists in project {target_project}...")
+    dataset_ref = bigquery.Dataset(f"{target_project}.{target_dataset}")
+    dataset_ref.location = location  # Use location from config
+    try:
+        client.get_dataset(dataset_ref)
+    except Exception as e:
+        lines = str(e).split("\n")
+        first_line = lines[0] if lines else "Error message unavailable"
+        print(f"Error: {first_line}")
+        print(f"Creating destination dataset {target_dataset} in location {location}...")
+        client.create_dataset(dataset_ref, exists_ok=True)
+
+
+def transfer_table(client: bigquery.Client, table_config: dict, plan: dict, overwrite: str,
+                   job_budget: threading.Semaphore, journal: TransferJournal = None, prompt_lock: threading.Lock = None):
+    """
+    Transfer one configured table to its destination.
+
+    Args:
+        plan (dict): Transfer plan of the table, see transfer_plan.plan_transfer.
+        overwrite (str): One of OVERWRITE_POLICIES, applied when the destination table exists.
+        job_budget (threading.Semaphore): Budget of running BigQuery jobs shared by all tables.
+        journal (TransferJournal): Journal of partitioned transfers; None disables resuming.
+        prompt_lock (threading.Lock): Serializes overwrite prompts of concurrent tables.
+
+    Returns:
+        Dict with the source table, the path taken, seconds, rows and bytes, or None if skipped.
+    """
+    # Extract mandatory configuration parameters
+    source_project = table_config.get("source_project")
+    source_dataset = table_config.get("source_dataset")
+    source_table = table_config.get("source_table")
+    target_project = table_config.get("target_project")
+    location = table_config.get("location", "EU")  # Default to "US" if not specified
+
+    # Extract optional parameters
+    partition_size = table_config.get("partition_size", 10000)
+    max_rows = table_config.get("max_rows", 39990000)  # Default to 39,990,000
+    fast_path = table_config.get("fast_path", True)  # Allow clone/copy when source and target share a location
+    max_in_flight_jobs = table_config.get("max_in_flight_jobs", 4)  # Concurrent INSERT jobs per table
+    target_bytes_per_job = table_config.get("target_bytes_per_job", 1073741824)  # Coalesce partitions up to ~1 GiB per job
+    max_retries = table_config.get("max_retries", 5)  # Retries per job on rate limit errors
+    bucketing = table_config.get("bucketing", "hash")  # "hash", "native" or "row_number", see bucketing.py
+    bucket_key = table_config.get("bucket_key")  # Columns hashed by the "hash" strategy, default: the whole row
+    temp_table_expiration_hours = table_config.get("temp_table_expiration_hours", 168)  # Kept for resuming up to a week
+
+    # Generate the destination dataset and table names
+    target_dataset = get_target_dataset(table_config)  # Auto-generate destination dataset name
+    target_table_ref = get_target_table_ref(table_config)  # Use the source table name as the target table name
+
+    # Construct source and partitioned table references
+    source_table_ref = f"{source_project}.{source_dataset}.{source_table}"
+    partitioned_table_ref = f"{source_project}.{source_dataset}.{source_table}_partitioned"
+
+    def run_query(query: str):
+        return run_query_with_retry(client, query, location, max_retries, job_budget=job_budget)
+
+    # Step 1: Check if the destination table exists
+    print(f"Checking if destination table {target_table_ref} exists...")
+    destination_table_exists = False
+    try:
+        client.get_table(target_table_ref)
+        destination_table_exists = True
+    except Exception as e:
+        lines = str(e).split("\n")
+        first_line = lines[0] if lines else "Error message unavailable"
+        print(f"Error: {first_line}")
+        pass
+
+    # An interrupted partitioned transfer of this table is resumed instead of started over
+    signature = config_signature(table_config)
+    journal_entry = journal.get(target_table_ref, signature) if journal else None
+    if journal_entry and not (destination_table_exists and table_exists(client, journal_entry["partitioned_table"])):
+        print(f"Journal entry for {target_table_ref} can't be resumed, its tables are gone. Starting over...")
+        journal_entry = None
+
+    if destination_table_exists and not journal_entry and not confirm_overwrite(target_table_ref, overwrite, prompt_lock):
+        return None
+
+    # Step 2: Ensure the destination dataset exists
+    ensure_dataset(client, target_project, target_dataset, location)
+
+    # Step 3: Use a server-side clone/copy when source and target share a location
+    clone_possible, reason, source_table_meta = False, "disabled in config", None
+    if journal_entry:
+        reason = "resuming an interrupted partitioned transfer"
+    elif fast_path:
+        try:
+            clone_possible, reason, source_table_meta = can_clone(client, source_table_ref, location)
+        except Exception as e:
+            clone_possible, reason = False, str(e).split("\n")[0]
+    if clone_possible:
+        try:
+            path, seconds = transfer_fast_path(
+                client, source_table_meta, source_table_ref, target_table_ref, location, max_rows, job_budget
+            )
+            print(f"Data transfer for {source_table} complete using {path} in {seconds:.1f}s!")
+            return transfer_result(client, source_table_ref, target_table_ref, path, seconds)
+        except Exception as e:
+            reason = str(e).split("\n")[0]
+
+    # Small sources are copied with a single job, without the temporary partitioned table
+    if plan["method"] == "ctas" and not journal_entry:
+        print(f"Fast path not possible for {source_table_ref} ({reason}), "
+              f"copying its {plan['rows']} rows with a single CREATE TABLE AS SELECT...")
+        start = time.time()
+        limit = f" LIMIT {max_rows}" if plan["rows"] is None or plan["rows"] >= max_rows else ""
+        run_query(f"CREATE OR REPLACE TABLE `{target_table_ref}` AS SELECT * FROM `{source_table_ref}`{limit}")
+        print(f"Data transfer for {source_table} complete!")
+        return transfer_result(client, source_table_ref, target_table_ref, "ctas", time.time() - start)
+    print(f"Fast path not possible for {source_table_ref} ({reason}), using partitioned transfer...")
+
+    partitioned_start = time.time()
+    keep_partitioned_table = False
+    try:
+        if journal_entry:
+            print(f"Resuming transfer of {source_table}: {len(journal_entry['completed'])}/"
+                  f"{len(journal_entry['ranges'])} partition ranges already loaded")
+        else:
+            # Step 4: Create a temporary partitioned table
+            if source_table_meta is None:
+                try:
+                    source_table_meta = client.get_table(source_table_ref)
+                except Exception as e:
+                    lines = str(e).split("\n")
+                    print(f"Could not read metadata of {source_table_ref}: {lines[0] if lines else e}")
+            partition_query, num_partitions = build_partition_query(
+                client, bucketing, source_table_meta, source_table_ref, partitioned_table_ref,
+                partition_size, max_rows, bucket_key, num_rows=plan["rows"],
+            )
+            print(f"Creating temporary partitioned table for {source_table} using {bucketing} bucketing...")
+            run_query(partition_query)
+            print(f"Temporary partitioned table created: {partitioned_table_ref}")
+
+            # Let the temporary table expire by itself if a failed run is never resumed
+            partitioned_table = client.get_table(partitioned_table_ref)
+            partitioned_table.expires = datetime.now(timezone.utc) + timedelta(hours=temp_table_expiration_hours)
+            client.update_table(partitioned_table, ["expires"])
+
+            if bucketing == "row_number" and partitioned_table.num_rows is not None:
+                # Row numbers are consecutive, so buckets beyond the loaded rows are empty
+                max_rows = min(max_rows, partitioned_table.num_rows)
+                print(f"Using max_rows: {max_rows}")
+                num_partitions = max(1, (max_rows + partition_size - 1) // partition_size)  # Always at least one partition
+
+            # Step 5: Create or overwrite the destination table schema
+            print(f"Creating destination table {target_table_ref} with the correct schema...")
+            destination_table_schema_query = f"""
+            CREATE OR REPLACE TABLE `{target_table_ref}`
+            AS SELECT * except(partition_id) FROM `{partitioned_table_ref}` WHERE FALSE;  -- Create table with the same schema
+            """
+            run_query(destination_table_schema_query)
+
+            # Coalesce partitions into ranges of about target_bytes_per_job
+            print("num_partitions:", str(num_partitions))
+            partitioned_bytes = partitioned_table.num_bytes if partitioned_table.num_bytes is not None else plan["bytes"]
+            partitions_per_job = partitions_per_job_for(partitioned_bytes, num_partitions, target_bytes_per_job)
+            partition_ranges = coalesce_partitions(num_partitions, partitions_per_job)
+            if journal:
+                journal_entry = journal.start(target_table_ref, signature, partitioned_table_ref, partition_ranges)
+            else:
+                journal_entry = {"ranges": partition_ranges, "completed": [], "run_id": None}
+
+        # Step 6: Export the remaining partition ranges with a bounded number of jobs in flight
+        completed = set(journal_entry["completed"])
+        transfer_queries = [
+            (
+                range_label(first, last),
+                f"""
+                INSERT INTO `{target_table_ref}`
+                SELECT * except(partition_id) FROM `{partitioned_table_ref}`
+                WHERE partition_id BETWEEN {first} AND {last};
+                """,
+            )
+            for first, last in journal_entry["ranges"]
+            if range_label(first, last) not in completed
+        ]
+        print(
+            f"Loading {len(transfer_queries)} partition ranges of {source_table} into {target_table_ref}, "
+            f"at most {max_in_flight_jobs} jobs in flight..."
+        )
+
+        def report_progress(label: str, finished: int, total: int):
+            if journal:
+                journal.complete(target_table_ref, label)
+            elapsed = time.time() - partitioned_start
+            print(f"Loaded partitions {label} of {source_table} ({finished}/{total} jobs, "
+                  f"{finished * 100 // total}%, {elapsed:.1f}s)")
+
+        # Deterministic job ids let a resumed run pick up jobs that finished after a crash
+        job_id_prefix = f"export_and_load_{journal_entry['run_id']}" if journal_entry.get("run_id") else None
+        keep_partitioned_table = journal is not None
+        run_jobs(client, transfer_queries, location, max_in_flight_jobs, on_done=report_progress,
+                 max_retries=max_retries, job_budget=job_budget, job_id_prefix=job_id_prefix)
+        keep_partitioned_table = False
+        if journal:
+            journal.finish(target_table_ref)
+
+        print(f"Data transfer for {source_table} complete!")
+        return transfer_result(client, source_table_ref, target_table_ref, "partitioned", time.time() - partitioned_start)
+
+    finally:
+        if keep_partitioned_table:
+            print(f"Keeping temporary table {partitioned_table_ref} to resume the transfer in the next run.")
+        else:
+            # Step 7: Drop the temporary partitioned table if it was created
+            try:
+                print(f"Ensuring temporary table {partitioned_table_ref} is dropped...")
+                run_query(f"DROP TABLE IF EXISTS `{partitioned_table_ref}`")
+                print(f"Temporary table {partitioned_table_ref} dropped.")
+            except Exception as e:
+                print(f"ERROR: Failed to drop temporary table {partitioned_table_ref}: {e}")
+
+
+def transfer_result(client: bigquery.Client, source_table_ref: str, target_table_ref: str, path: str, seconds: float):
+    """Build the summary entry of a transferred table, with the size of the destination table."""
+    rows = num_bytes = None
+    try:
+        target = client.get_table(target_table_ref)
+        rows, num_bytes = target.num_rows, target.num_bytes
+    except Exception as e:
+        lines = str(e).split("\n")
+        print(f"Could not read size of {target_table_ref}: {lines[0] if lines else e}")
+    return {"source": source_table_ref, "path": path, "seconds": seconds, "rows": rows, "bytes": num_bytes}
+
+
+def shard_table_config(table_config: dict, table_id: str) -> dict:
+    """Configuration of one shard of a family of shards, transferred like a single table."""
+    shard_config = {key: value for key, value in table_config.items() if key != "max_shards"}
+    shard_config["source_table"] = table_id
+    return shard_config
+
+
+def expand_shards(client: bigquery.Client, tables: list) -> list:
+    """Replace every family of shards by its newest `max_shards` shard tables (default: all of them)."""
+    expanded = []
+    for table_config in tables:
+        prefix = shard_prefix(table_config)
+        if prefix is None:
+            expanded.append(table_config)
+            continue
+        shards = load_shards(client, table_config["source_project"], table_config["source_dataset"], prefix)
+        table_ids = newest_shards(shards, table_config.get("max_shards"))
+        print(f"{get_source_table_ref(table_config)}: {len(table_ids)} of {len(shards)} shards selected")
+        expanded.extend(shard_table_config(table_config, table_id) for table_id in table_ids)
+    return expanded
+
+
+def plan_sync(client: bigquery.Client, tables: list, sync_state: SyncState, overwrite: str):
+    """
+    Work out what changed in the sources since the last sync, from metadata only.
+
+    - families of shards (`event_*`): new shard tables, and shards modified since they were
+      copied, are transferred like single tables; shards that left the newest `max_shards`
+      (or were deleted at the source) are dropped from the destination
+    - partitioned tables: the destination keeps the newest whole partitions that fit in
+      `max_rows`; new or modified partitions are copied one by one, partitions that left
+      that window are deleted
+    - unpartitioned tables: transferred as usual if modified since the last sync, else skipped
+    - sources without partition metadata (views, external tables): always transferred
+
+    Changes come from `last_modified_time` in `INFORMATION_SCHEMA.PARTITIONS` and `__TABLES__`,
+    compared with the watermarks of the last sync (see transfer_sync.SyncState). Tables
+    synced before with the same configuration are overwritten without asking.
+
+    Returns:
+        Tuple of (work items, shard tables to drop as (state key, shard, table ref)).
+    """
+    plain_refs = [get_source_table_ref(table_config) for table_config in tables if shard_prefix(table_config) is None]
+    partitions = load_partitions(client, plain_refs)
+    items, drops = [], []
+    print("\nSync plan:")
+    for table_config in tables:
+        source_table_ref = get_source_table_ref(table_config)
+        target_table_ref = get_target_table_ref(table_config)
+        signature = config_signature(table_config)
+        synced = sync_state.get(target_table_ref, signature)
+        table_overwrite = "always" if synced is not None else overwrite
+
+        prefix = shard_prefix(table_config)
+        if prefix is not None:
+            shards = load_shards(client, table_config["source_project"], table_config["source_dataset"], prefix)
+            current = {table_id: shards[table_id]["modified"] for table_id in newest_shards(shards, table_config.get("max_shards"))}
+            changed, removed = changed_units(current, synced)
+            print(f"  {source_table_ref}: {len(changed)} of {len(current)} shards changed, {len(removed)} to drop")
+            for table_id in changed:
+                items.append({"table_config": shard_table_config(table_config, table_id), "overwrite": table_overwrite,
+                              "sync": (target_table_ref, signature, table_id, current[table_id])})
+            drops.extend((target_table_ref, table_id, target_table_ref[:-len(prefix) - 1] + table_id) for table_id in removed)
+            continue
+
+        table_partitions = partitions.get(source_table_ref)
+        if not table_partitions:
+            print(f"  {source_table_ref}: no partition metadata, copied in full")
+            items.append({"table_config": table_config, "overwrite": overwrite, "sync": None})
+        elif WHOLE_TABLE in table_partitions:
+            current = {WHOLE_TABLE: table_partitions[WHOLE_TABLE]["modified"]}
+            changed, _ = changed_units(current, synced)
+            print(f"  {source_table_ref}: {'modified' if changed else 'unchanged'} since the last sync")
+            if changed:
+                items.append({"table_config": table_config, "overwrite": table_overwrite,
+                              "sync": (target_table_ref, signature, WHOLE_TABLE, current[WHOLE_TABLE])})
+        else:
+            window = partition_window(table_partitions, table_config.get("max_rows", 39990000))
+            current = {partition_id: table_partitions[partition_id]["modified"] for partition_id in window}
+            changed, removed = changed_units(current, synced)
+            print(f"  {source_table_ref}: {len(changed)} of {len(current)} partitions changed, {len(removed)} to drop")
+            if changed or removed:
+                items.append({"table_config": table_config, "overwrite": table_overwrite, "partitions": {
+                    "signature": signature,
+                    "first_sync": synced is None,
+                    "copy": [(partition_id, current[partition_id]) for partition_id in changed],
+                    "drop": removed,
+                }})
+    print()
+    return items, drops
+
+
+def sync_partitions(client: bigquery.Client, table_config: dict, partitions: dict, overwrite: str,
+                    job_budget: threading.Semaphore, sync_state: SyncState, prompt_lock: threading.Lock = None):
+    """
+    Copy the changed partitions of a partitioned table into its destination, see plan_sync.
+
+    Partitions are copied with copy jobs on `table$partition_id` (server-side and free,
+    source and target must share a location), up to `max_in_flight_jobs` at a time, and
+    recorded in the sync state one by one. On the first sync the destination is
+    recreated empty, with the partitioning of the source (`CREATE TABLE ... LIKE`).
+
+    Returns:
+        Dict with the source table, the path taken, seconds, rows and bytes, or None if skipped.
+    """
+    source_table_ref = get_source_table_ref(table_config)
+    target_table_ref = get_target_table_ref(table_config)
+    location = table_config.get("location", "EU")
+    max_in_flight_jobs = table_config.get("max_in_flight_jobs", 4)
+    max_retries = table_config.get("max_retries", 5)
+    start = time.time()
+
+    if partitions["first_sync"]:
+        if table_exists(client, target_table_ref) and not confirm_overwrite(target_table_ref, overwrite, prompt_lock):
+            return None
+        ensure_dataset(client, table_config["target_project"], get_target_dataset(table_config), location)
+        print(f"Creating destination table {target_table_ref} with the partitioning of {source_table_ref}...")
+        run_query_with_retry(client, f"CREATE OR REPLACE TABLE `{target_table_ref}` LIKE `{source_table_ref}`", location,
+                             max_retries, job_budget=job_budget)
+
+    for partition_id in partitions["drop"]:
+        print(f"Dropping partition {partition_id} of {target_table_ref}, it left the synced window...")
+        client.delete_table(f"{target_table_ref}${partition_id}", not_found_ok=True)
+        sync_state.forget(target_table_ref, partition_id)
+
+    job_config = bigquery.CopyJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+    total = len(partitions["copy"])
+    finished = []
+
+    def copy_partition(partition: tuple):
+        partition_id, modified = partition
+        run_copy_with_retry(client, f"{source_table_ref}${partition_id}", f"{target_table_ref}${partition_id}", location,
+                            job_config, max_retries, job_budget)
+        sync_state.record(target_table_ref, partitions["signature"], partition_id, modified)
+        finished.append(partition_id)
+        print(f"Copied partition {partition_id} of {source_table_ref} ({len(finished)}/{total}, {time.time() - start:.1f}s)")
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_in_flight_jobs, total or 1))) as executor:
+        # Jobs run in the caller's context, so they stay attributed to its action (see job_telemetry)
+        futures = [executor.submit(contextvars.copy_context().run, copy_partition, partition) for partition in partitions["copy"]]
+        for future in futures:
+            future.result()
+
+    print(f"Sync of {source_table_ref} complete: {total} partitions copied, {len(partitions['drop'])} dropped!")
+    return transfer_result(client, source_table_ref, target_table_ref, "partitions", time.time() - start)
+
+
+def format_rate(amount, seconds: float, unit: str) -> str:
+    if amount is None:
+        return f"? {unit}/s"
+    rate = amount / seconds if seconds > 0 else float(amount)
+    for prefix in ("", "K", "M", "G", "T"):
+        if rate < 1000 or prefix == "T":
+            return f"{rate:.1f} {prefix}{unit}/s"
+        rate /= 1000
+
+
+def prepare_partitioned_data(config_path: str, overwrite: str = None, resume: bool = True, client_name: str = None,
+                             sync: bool = False):
     """
     Prepares partitioned data in BigQuery, transfers each partition to a single destination table,
     and ensures no temporary partitioned table is left in the source project.
 
+    All tables are planned first from their metadata (see transfer_plan.py). They are then
+    transferred concurrently (`max_concurrent_tables`) while the number of running
+    BigQuery jobs across all tables is capped by `max_concurrent_jobs`. Partitioned transfers
+    are journaled, so a failed run is resumed from its last loaded partition range.
+
+    Families of date-sharded tables (`"source_table": "event_*"`) are transferred as
+    their newest `max_shards` shard tables. In sync mode only what changed since the last
+    sync is copied, see plan_sync.
+
     Args:
         config_path (str): Path to the configuration JSON file.
+        overwrite (str): Overwrite policy for existing destination tables, overrides the config.
+        resume (bool): Resume interrupted transfers from the journal.
+        client_name (str): BigQuery client implementation, see bq_client.create_client.
+        sync (bool): Copy only new or changed partitions and shards, with watermarks in `sync_state_path`.
     """
     # Load configuration
     try:
@@ -22,159 +552,134 @@ def prepare_partitioned_data(config_path: str):
         print(f"ERROR: Configuration file '{config_path}' is not a valid JSON file.")
         sys.exit(1)
 
-    client = bigquery.Client()
-
     for table_config in config["tables"]:
-        # Extract mandatory configuration parameters
-        source_project = table_config.get("source_project")
-        source_dataset = table_config.get("source_dataset")
-        source_table = table_config.get("source_table")
-        target_project = table_config.get("target_project")
-        location = table_config.get("location", "EU")  # Default to "US" if not specified
-
-        # Validate mandatory parameters
-        missing_params = []
-        if not source_project:
-            missing_params.append("source_project")
-        if not source_dataset:
-            missing_params.append("source_dataset")
-        if not source_table:
-            missing_params.append("source_table")
-        if not target_project:
-            missing_params.append("target_project")
-
-        if missing_params:
-            print(f"ERROR: Missing mandatory parameters in table configuration: {', '.join(missing_params)}")
-            print(f"Configuration details: {table_config}")
-            sys.exit(1)
-
-        # Extract optional parameters
-        partition_size = table_config.get("partition_size", 10000)
-        max_rows = table_config.get("max_rows", 39990000)  # Default to 39,990,000
-
-        # Generate the destination dataset and table names
-        target_dataset = f"{source_project.replace('-', '_')}__{source_dataset}"  # Auto-generate destination dataset name
-        target_table = source_table  # Use the source table name as the target table name
-        target_table_ref = f"{target_project}.{target_dataset}.{target_table}"
-
-        # Construct source and partitioned table references
-        source_table_ref = f"{source_project}.{source_dataset}.{source_table}"
-        partitioned_table_ref = f"{source_project}.{source_dataset}.{source_table}_partitioned"
-
-        # Step 1: Check if the destination table exists
-        print(f"Checking if destination table {target_table_ref} exists...")
-        destination_table_exists = False
-        try:
-            client.get_table(target_table_ref)
-            destination_table_exists = True
-        except Exception as e:
-            lines = str(e).split("\n")
-            first_line = lines[0] if lines else "Error message unavailable"
-            print(f"Error: {first_line}")
-            pass
+        validate_table_config(table_config)
 
-        if destination_table_exists:
-            response = input(
-                f"Destination table {target_table_ref} already exists. Do you want to overwrite it? (y/n): "
-            ).strip().lower()
-            if response != 'y':
-                print(f"Skipping further actions for {target_table_ref}...")
-                continue  # Skip to the next table configuration
-
-        # Step 2: Ensure the destination dataset exists
-        print(f"Ensuring destination dataset {target_dataset} exists in project {target_project}...")
-        dataset_ref = bigquery.Dataset(f"{target_project}.{target_dataset}")
-        dataset_ref.location = location  # Use location from config
+    overwrite = overwrite or config.get("overwrite", "ask")
+    if overwrite not in OVERWRITE_POLICIES:
+        print(f"ERROR: Unknown overwrite policy '{overwrite}', expected one of {', '.join(OVERWRITE_POLICIES)}.")
+        sys.exit(1)
+    max_concurrent_tables = config.get("max_concurrent_tables", 2)
+    job_budget = threading.BoundedSemaphore(max(1, config.get("max_concurrent_jobs", 8)))
+    journal = None
+    if resume:
+        journal = TransferJournal(config.get("journal_path", ".export_and_load_journal.json")).load()
+    prompt_lock = threading.Lock()
+
+    recorder = JobRecorder()  # Records every BigQuery job of the run
+    client = RecordingClient(create_client(client_name), recorder)
+    transfer_report = []  # Summary entry (see transfer_result) per transferred table
+    failures = []
+
+    # Work out what to transfer: everything, or what changed since the last sync
+    sync_state = None
+    drops = []
+    with job_action("plan"):
+        if sync:
+            sync_state = SyncState(config.get("sync_state_path", ".export_and_load_sync.json")).load()
+            items, drops = plan_sync(client, config["tables"], sync_state, overwrite)
+        else:
+            items = [{"table_config": table_config, "overwrite": overwrite, "sync": None}
+                     for table_config in expand_shards(client, config["tables"])]
+
+    # Plan every table from metadata before any data moves
+    table_configs = [item["table_config"] for item in items if "partitions" not in item]
+    source_table_refs = [get_source_table_ref(table_config) for table_config in table_configs]
+    with job_action("plan"):
+        table_stats = load_table_stats(client, source_table_refs)
+    plans = {}
+    for source_table_ref, table_config in zip(source_table_refs, table_configs):
+        target_bytes_per_job = table_config.get("target_bytes_per_job", 1073741824)
+        plans[source_table_ref] = plan_transfer(
+            table_stats.get(source_table_ref, {}),
+            table_config.get("max_rows", 39990000),
+            table_config.get("partition_size", 10000),
+            target_bytes_per_job,
+            table_config.get("single_job_max_bytes", target_bytes_per_job),
+        )
+    if plans:
+        print_plan(plans)
+
+    for state_key, table_id, shard_table_ref in drops:
+        print(f"Dropping {shard_table_ref}, the shard left the synced window...")
         try:
-            client.get_dataset(dataset_ref)
+            client.delete_table(shard_table_ref, not_found_ok=True)
+            sync_state.forget(state_key, table_id)
         except Exception as e:
-            lines = str(e).split("\n")
-            first_line = lines[0] if lines else "Error message unavailable"
-            print(f"Error: {first_line}")
-            print(f"Creating destination dataset {target_dataset} in location {location}...")
-            client.create_dataset(dataset_ref)
+            print(f"ERROR: Could not drop {shard_table_ref}: {e}")
+            failures.append(shard_table_ref)
 
+    def run_table(item: dict):
+        table_config = item["table_config"]
+        source_table_ref = get_source_table_ref(table_config)
         try:
-            # Step 3: Create a temporary partitioned table only if necessary
-            if not destination_table_exists or response == 'y':
-                partition_query = f"""
-                CREATE OR REPLACE TABLE `{partitioned_table_ref}`
-                PARTITION BY RANGE_BUCKET(partition_id, GENERATE_ARRAY(0, {max_rows // partition_size}, 1))
-                AS
-                SELECT
-                    * except(row_num),
-                    RANGE_BUCKET(row_num, GENERATE_ARRAY({partition_size}, {max_rows}, {partition_size})) AS partition_id
-                FROM (
-                    SELECT
-                        *,
-                        ROW_NUMBER() OVER (ORDER BY (SELECT NULL)) AS row_num
-                    FROM
-                        `{source_table_ref}`
-                )
-                WHERE
-                    row_num <= {max_rows};
-                """
-                print(f"Creating temporary partitioned table for {source_table} using RANGE_BUCKET...")
-                client.query(partition_query, location=location).result()
-                print(f"Temporary partitioned table created: {partitioned_table_ref}")
-
-                # Dynamically calculate the current row count from the table
-                try:
-                    print(f"Fetching row count for table: {partitioned_table_ref}...")
-                    query = f"SELECT COUNT(*) AS row_count FROM {partitioned_table_ref}"
-                    row_count_result = client.query(query, location="EU").result()
-                    row_count = next(row_count_result).row_count
-                    print(f"Current row count: {row_count}")
-                except Exception as e:
-                    print(f"ERROR: Failed to fetch row count: {str(e)}")
-                    sys.exit(1)
+            with job_action(source_table_ref):
+                if "partitions" in item:
+                    result = sync_partitions(
+                        client, table_config, item["partitions"], item["overwrite"], job_budget, sync_state, prompt_lock
+                    )
+                else:
+                    result = transfer_table(
+                        client, table_config, plans[source_table_ref], item["overwrite"], job_budget, journal, prompt_lock
+                    )
+            if result:
+                transfer_report.append(result)
+                if item.get("sync"):
+                    sync_state.record(*item["sync"])
+        except Exception as e:
+            print(f"ERROR: An unexpected error occurred while processing {source_table_ref}: {e}")
+            failures.append(source_table_ref)
 
-                # Use the lesser value between the configured max_rows and the actual row count
-                max_rows = min(max_rows, row_count)
-                print(f"Using max_rows: {max_rows}")
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrent_tables)) as executor:
+        list(executor.map(run_table, items))
 
-                # Step 4: Create or overwrite the destination table schema
-                print(f"Creating destination table {target_table_ref} with the correct schema...")
-                destination_table_schema_query = f"""
-                CREATE OR REPLACE TABLE `{target_table_ref}`
-                AS SELECT * except(partition_id) FROM `{partitioned_table_ref}` WHERE FALSE;  -- Create table with the same schema
-                """
-                client.query(destination_table_schema_query, location=location).result()
+    print("\nTransfer summary:")
+    for result in transfer_report:
+        print(
+            f"  {result['source']}: {result['path']} in {result['seconds']:.1f}s, "
+            f"{result['rows'] if result['rows'] is not None else '?'} rows "
+            f"({format_rate(result['rows'], result['seconds'], 'rows')}, "
+            f"{format_rate(result['bytes'], result['seconds'], 'B')})"
+        )
+    for source_table_ref in failures:
+        print(f"  {source_table_ref}: FAILED")
 
-                # Step 5: Export each partition to the destination table
-                num_partitions = max(1, (max_rows + partition_size - 1) // partition_size)  # Always at least one partition
-                print("num_partitions:", str(num_partitions))
-                for partition_id in range(num_partitions):
-                    transfer_query = f"""
-                    INSERT INTO `{target_table_ref}`
-                    SELECT * except(partition_id) FROM `{partitioned_table_ref}`
-                    WHERE partition_id = {partition_id};
-                    """
-                    print(f"Loading partition {partition_id} of {source_table} into {target_table_ref}...")
-                    client.query(transfer_query, location=location).result()
-
-                print(f"Data transfer for {source_table} complete!")
+    # Every BigQuery job of the run, per table and as a trace
+    recorder.print_report(config.get("slowest_actions", 10))
+    try:
+        recorder.write_trace(config.get("trace_path", "/tmp/export_and_load_trace.json"))
+        with open(config.get("job_log_path", "/tmp/export_and_load_jobs.json"), "w") as job_log:
+            json.dump({"jobs": recorder.records}, job_log)
+    except OSError as e:
+        print(f"Could not write the job log: {e}")
 
-        except Exception as e:
-            print(f"ERROR: An unexpected error occurred during processing: {e}")
-            sys.exit(1)
+    if failures:
+        if journal:
+            print("Rerun the script to resume the failed transfers.")
+        sys.exit(1)
+    print("All tables processed successfully!")
 
-        finally:
-            # Step 6: Drop the temporary partitioned table if it was created
-            try:
-                print(f"Ensuring temporary table {partitioned_table_ref} is dropped...")
-                drop_table_query = f"DROP TABLE IF EXISTS `{partitioned_table_ref}`"
-                client.query(drop_table_query, location=location).result()
-                print(f"Temporary table {partitioned_table_ref} dropped.")
-            except Exception as e:
-                print(f"ERROR: Failed to drop temporary table {partitioned_table_ref}: {e}")
 
-    print("All tables processed successfully!")
+def parse_args():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Transfer sample data from source tables to the development project.")
+    parser.add_argument("--config", default=os.path.join(script_dir, "config.json"),
+                        help="Path to the configuration file")
+    parser.add_argument("--overwrite", choices=OVERWRITE_POLICIES,
+                        help="What to do with existing destination tables (default: \"overwrite\" in config, else ask)")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Don't use the journal: start interrupted transfers over and don't record progress")
+    parser.add_argument("--client", default=None,
+                        help=f"BigQuery client: {' or '.join(CLIENT_CHOICES)} (in-process fake, no BigQuery access), "
+                             "or module:factory for a custom one (default: $BQ_CLIENT, else bigquery)")
+    parser.add_argument("--sync", action="store_true",
+                        help="Copy only the partitions and shards that changed since the last sync (watermarks in "
+                             "\"sync_state_path\" of the config)")
+    return parser.parse_args()
 
 
 # Example usage
 if __name__ == "__main__":
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    config_file_name = "config.json"  # Path to your configuration file
-    config_file_path = os.path.join(script_dir, config_file_name)
-    prepare_partitioned_data(config_file_path)
\ No newline at end of file
+    args = parse_args()
+    prepare_partitioned_data(args.config, overwrite=args.overwrite, resume=not args.no_resume, client_name=args.client,
+                             sync=args.sync)
@@ -0,0 +1,149 @@
+import contextvars
+import random
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, Tuple
+
+from google.api_core.exceptions import Conflict, GoogleAPICallError, ServiceUnavailable, TooManyRequests
+
+# Error reasons returned by BigQuery that are worth retrying with a backoff
+RETRYABLE_REASONS = {"rateLimitExceeded", "jobRateLimitExceeded", "backendError", "internalError"}
+
+
+def is_retryable_error(exception: Exception) -> bool:
+    """Check if a BigQuery error is a rate limit or transient backend error."""
+    if isinstance(exception, (TooManyRequests, ServiceUnavailable)):
+        return True
+    if isinstance(exception, GoogleAPICallError) and getattr(exception, "errors", None):
+        return any(error.get("reason") in RETRYABLE_REASONS for error in exception.errors)
+    return any(reason in str(exception) for reason in RETRYABLE_REASONS)
+
+
+def backoff_delay(retries: int, base_delay: float = 1.0, max_delay: float = 60.0) -> float:
+    """Exponential backoff with jitter before retry number retries + 1."""
+    return min(max_delay, base_delay * (2 ** retries)) * (0.5 + random.random() / 2)
+
+
+def run_query_with_retry(client, query: str, location: str, max_retries: int = 5,
+                         base_delay: float = 1.0, max_delay: float = 60.0,
+                         job_budget: Optional[threading.Semaphore] = None, job_id_prefix: Optional[str] = None):
+    """
+    Run a query job and wait for it, retrying rate limit errors with exponential backoff.
+
+    Args:
+        job_budget (threading.Semaphore): Shared budget of running jobs, held while the job runs.
+        job_id_prefix (str): Run the job under the deterministic id "<prefix>_<attempt>". If a
+            job with that id already exists (e.g. started by an interrupted run), its outcome
+            is used instead of running the query again.
+
+    Returns:
+        The finished QueryJob.
+    """
+    attempt = 0  # Suffix of the job id
+    retries = 0
+    while True:
+        job_id = f"{job_id_prefix}_{attempt}" if job_id_prefix else None
+        try:
+            with job_budget or nullcontext():
+                try:
+                    job = client.query(query, location=location, job_id=job_id)
+                except Conflict:
+                    if not job_id:
+                        raise
+                    job = client.get_job(job_id, location=location)
+                    if job.state == "DONE" and job.error_result:
+                        attempt += 1  # Failed in an earlier run, run it again under the next id
+                        continue
+                    print(f"Job {job_id} already exists, using its result...")
+                job.result()
+            return job
+        except Exception as e:
+            if retries >= max_retries or not is_retryable_error(e):
+                raise
+            delay = backoff_delay(retries, base_delay, max_delay)
+            first_line = str(e).split("\n")[0]
+            print(f"Rate limited ({first_line}), retrying in {delay:.1f}s (attempt {retries + 1}/{max_retries})...")
+            time.sleep(delay)
+            attempt += 1
+            retries += 1
+
+
+def run_copy_with_retry(client, source: str, destination: str, location: str, job_config=None, max_retries: int = 5,
+                        job_budget: Optional[threading.Semaphore] = None):
+    """Run a copy job (e.g. of one `table$partition`) and wait for it, retrying rate limit errors like run_query_with_retry."""
+    retries = 0
+    while True:
+        try:
+            with job_budget or nullcontext():
+                job = client.copy_table(source, destination, location=location, job_config=job_config)
+                job.result()
+            return job
+        except Exception as e:
+            if retries >= max_retries or not is_retryable_error(e):
+                raise
+            delay = backoff_delay(retries)
+            first_line = str(e).split("\n")[0]
+            print(f"Rate limited ({first_line}), retrying in {delay:.1f}s (attempt {retries + 1}/{max_retries})...")
+            time.sleep(delay)
+            retries += 1
+
+
+def coalesce_partitions(num_partitions: int, partitions_per_job: int) -> List[Tuple[int, int]]:
+    """Group partition ids 0..num_partitions-1 into inclusive (first, last) ranges of at most partitions_per_job."""
+    partitions_per_job = max(1, partitions_per_job)
+    return [
+        (first, min(first + partitions_per_job, num_partitions) - 1)
+        for first in range(0, num_partitions, partitions_per_job)
+    ]
+
+
+def partitions_per_job_for(num_bytes: Optional[int], num_partitions: int, target_bytes_per_job: int) -> int:
+    """Size partition ranges so each job moves about target_bytes_per_job."""
+    if not num_bytes or not num_partitions or not target_bytes_per_job:
+        return 1
+    bytes_per_partition = max(1, num_bytes // num_partitions)
+    return max(1, min(num_partitions, target_bytes_per_job // bytes_per_partition))
+
+
+def run_jobs(client, queries: List[Tuple[str, str]], location: str, max_in_flight: int = 4,
+             on_done: Optional[Callable[[str, int, int], None]] = None, max_retries: int = 5,
+             job_budget: Optional[threading.Semaphore] = None, job_id_prefix: Optional[str] = None):
+    """
+    Run query jobs as a pipeline with at most max_in_flight jobs running at the same time.
+
+    Each query is retried with backoff on rate limit errors. The first job that still fails
+    stops the pipeline: no new jobs are submitted and its error is raised.
+
+    Args:
+        queries (List[Tuple[str, str]]): (label, SQL) per job.
+        on_done (Callable): Called with (label, finished jobs, total jobs) after each job.
+        job_budget (threading.Semaphore): Budget of running jobs shared with other pipelines.
+        job_id_prefix (str): Jobs get the ids "<prefix>_<label>_<attempt>", labels must be valid in job ids.
+    """
+    total = len(queries)
+    finished = 0
+    pending = list(reversed(queries))
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as executor:
+        running = {}
+        while pending or running:
+            while pending and len(running) < max(1, max_in_flight):
+                label, query = pending.pop()
+                job_prefix = f"{job_id_prefix}_{label}" if job_id_prefix else None
+                # Copy the caller's context, so the job stays attributed to its action (see job_telemetry)
+                future = executor.submit(
+                    contextvars.copy_context().run, run_query_with_retry, client, query, location, max_retries,
+                    job_budget=job_budget, job_id_prefix=job_prefix,
+                )
+                running[future] = label
+            future = next(as_completed(running))
+            label = running.pop(future)
+            try:
+                future.result()
+            except Exception:
+                pending.clear()
+                raise
+            finished += 1
+            if on_done:
+                on_done(label, finished, total)
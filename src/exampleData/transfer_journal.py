@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+JOURNAL_VERSION = 1
+
+
+def config_signature(table_config: Dict) -> str:
+    """Hash of a table configuration; a journal entry is only resumed with the same configuration."""
+    return hashlib.sha256(json.dumps(table_config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class TransferJournal:
+    """
+    Local JSON journal of partitioned transfers, used to resume an interrupted run.
+
+    Each entry is keyed by the destination table and records the temporary partitioned
+    table, the partition ranges planned for it and the ranges already loaded. The entry
+    is removed once the transfer of the table is complete. The file is rewritten after
+    every change, so the journal survives a crash at any point.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> "TransferJournal":
+        try:
+            with open(self.path, "r") as f:
+                content = json.load(f)
+            if content.get("version") == JOURNAL_VERSION:
+                self.entries = content.get("entries", {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+        return self
+
+    def _save(self):
+        # Called with the lock held
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": JOURNAL_VERSION, "entries": self.entries}, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    def get(self, target_table_ref: str, signature: str) -> Optional[Dict]:
+        """Return the unfinished entry of a table if it was started with the same configuration."""
+        with self._lock:
+            entry = self.entries.get(target_table_ref)
+            if entry is None or entry.get("signature") != signature:
+                return None
+            return dict(entry)
+
+    def start(self, target_table_ref: str, signature: str, partitioned_table_ref: str,
+              ranges: List[Tuple[int, int]]) -> Dict:
+        """Record a new transfer, replacing any previous entry of the table."""
+        with self._lock:
+            entry = {
+                "signature": signature,
+                "run_id": uuid.uuid4().hex[:12],
+                "partitioned_table": partitioned_table_ref,
+                "ranges": [list(partition_range) for partition_range in ranges],
+                "completed": [],
+            }
+            self.entries[target_table_ref] = entry
+            self._save()
+            return dict(entry)
+
+    def complete(self, target_table_ref: str, label: str):
+        """Mark the partition range with this label (see `range_label`) as loaded."""
+        with self._lock:
+            entry = self.entries.get(target_table_ref)
+            if entry is not None and label not in entry["completed"]:
+                entry["completed"].append(label)
+                self._save()
+
+    def finish(self, target_table_ref: str):
+        with self._lock:
+            if self.entries.pop(target_table_ref, None) is not None:
+                self._save()
+
+
+def range_label(first: int, last: int) -> str:
+    return f"{first}-{last}"
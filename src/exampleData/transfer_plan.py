@@ -0,0 +1,129 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+from bucketing import MAX_BUCKETS
+from transfer_jobs import partitions_per_job_for
+
+# Table types reported by the legacy __TABLES__ meta-table
+TABLES_TYPES = {1: "TABLE", 2: "VIEW", 3: "EXTERNAL"}
+
+
+def load_table_stats(client, table_refs: Iterable[str], max_concurrency: int = 8) -> Dict[str, Dict]:
+    """
+    Read row counts and sizes of source tables without scanning them.
+
+    Tables are grouped per dataset and each dataset is read with a single query on its
+    `__TABLES__` meta-table. Tables missing there (or in datasets that can't be read that
+    way) fall back to a `get_table` call. Views and external tables have unknown sizes.
+
+    Returns:
+        {table ref: {"type": ..., "rows": int or None, "bytes": int or None}}
+    """
+    datasets = {}
+    for table_ref in set(table_refs):
+        project_id, dataset_id, table_id = table_ref.split(".")
+        datasets.setdefault((project_id, dataset_id), set()).add(table_id)
+
+    def load_dataset(key):
+        (project_id, dataset_id), table_ids = key, datasets[key]
+        stats = {}
+        try:
+            names = ", ".join(f"'{table_id}'" for table_id in sorted(table_ids))
+            query = f"""
+            SELECT table_id, type, row_count, size_bytes
+            FROM `{project_id}.{dataset_id}.__TABLES__`
+            WHERE table_id IN ({names})
+            """
+            for row in client.query(query).result():
+                table_type = TABLES_TYPES.get(row.type, "TABLE")
+                known = table_type == "TABLE"
+                stats[f"{project_id}.{dataset_id}.{row.table_id}"] = {
+                    "type": table_type,
+                    "rows": row.row_count if known else None,
+                    "bytes": row.size_bytes if known else None,
+                }
+        except Exception as e:
+            lines = str(e).split("\n")
+            print(f"Could not read {project_id}.{dataset_id}.__TABLES__ ({lines[0] if lines else e}), "
+                  f"reading table metadata instead...")
+
+        for table_id in table_ids:
+            table_ref = f"{project_id}.{dataset_id}.{table_id}"
+            if table_ref in stats:
+                continue
+            try:
+                table = client.get_table(table_ref)
+                known = table.table_type == "TABLE"
+                stats[table_ref] = {
+                    "type": table.table_type,
+                    "rows": table.num_rows if known else None,
+                    "bytes": table.num_bytes if known else None,
+                }
+            except Exception:
+                stats[table_ref] = {"type": None, "rows": None, "bytes": None}
+        return stats
+
+    table_stats = {}
+    if not datasets:
+        return table_stats
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(datasets)))) as executor:
+        # Jobs run in the caller's context, so they stay attributed to its action (see job_telemetry)
+        futures = [executor.submit(contextvars.copy_context().run, load_dataset, key) for key in datasets]
+        for future in futures:
+            table_stats.update(future.result())
+    return table_stats
+
+
+def plan_transfer(stats: Dict, max_rows: int, partition_size: int, target_bytes_per_job: int,
+                  single_job_max_bytes: Optional[int] = None) -> Dict:
+    """
+    Plan the transfer of one table from its metadata.
+
+    - method "ctas": the rows to transfer fit in one job (at most single_job_max_bytes,
+      default target_bytes_per_job, or at most partition_size rows), so they are copied
+      with one CREATE TABLE AS SELECT and no temporary table
+    - method "partitioned": the temporary table is bucketed into num_partitions buckets
+      of about partition_size rows, loaded partitions_per_job buckets per INSERT job
+
+    Sizes are unknown for views and external tables; those are always partitioned with
+    num_partitions based on max_rows.
+    """
+    if single_job_max_bytes is None:
+        single_job_max_bytes = target_bytes_per_job
+    rows, num_bytes = stats.get("rows"), stats.get("bytes")
+    rows_to_transfer = min(rows, max_rows) if rows is not None else None
+    estimated_bytes = None
+    if num_bytes is not None and rows:
+        estimated_bytes = num_bytes * rows_to_transfer // rows
+    elif num_bytes is not None:
+        estimated_bytes = num_bytes
+
+    plan = {"rows": rows_to_transfer, "bytes": estimated_bytes}
+    if rows_to_transfer is not None and (
+        rows_to_transfer <= partition_size or (estimated_bytes is not None and estimated_bytes <= single_job_max_bytes)
+    ):
+        plan.update({"method": "ctas", "num_partitions": 1, "partitions_per_job": 1})
+        return plan
+
+    rows_to_bucket = rows_to_transfer if rows_to_transfer is not None else max_rows
+    num_partitions = max(1, min(MAX_BUCKETS - 1, (rows_to_bucket + partition_size - 1) // partition_size))
+    plan.update({
+        "method": "partitioned",
+        "num_partitions": num_partitions,
+        "partitions_per_job": partitions_per_job_for(estimated_bytes, num_partitions, target_bytes_per_job),
+    })
+    return plan
+
+
+def print_plan(plans: Dict[str, Dict]):
+    print("\nTransfer plan:")
+    for table_ref, plan in plans.items():
+        rows = plan["rows"] if plan["rows"] is not None else "?"
+        size = f"{plan['bytes'] / 1024 ** 2:.1f} MiB" if plan["bytes"] is not None else "? MiB"
+        if plan["method"] == "ctas":
+            print(f"  {table_ref}: {rows} rows, {size}, single CREATE TABLE AS SELECT")
+        else:
+            jobs = (plan["num_partitions"] + plan["partitions_per_job"] - 1) // plan["partitions_per_job"]
+            print(f"  {table_ref}: {rows} rows, {size}, {plan['num_partitions']} partitions in {jobs} jobs")
+    print()
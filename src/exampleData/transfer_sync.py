@@ -0,0 +1,198 @@
+import contextvars
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+SYNC_STATE_VERSION = 1
+
+# Unit of unpartitioned tables, which are synced as a whole
+WHOLE_TABLE = "__TABLE__"
+# Rows still in the streaming buffer; they are synced once they land in their partition
+STREAMING_PARTITION = "__UNPARTITIONED__"
+# Suffix of date-sharded tables, e.g. event_20240201
+_SHARD_SUFFIX_PATTERN = re.compile(r"^\d+$")
+
+
+def to_millis(value) -> Optional[int]:
+    """Epoch milliseconds of a last_modified_time: a TIMESTAMP (datetime) or __TABLES__ milliseconds."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(value.timestamp() * 1000)
+
+
+class SyncState:
+    """
+    Local JSON watermarks of synced tables, used to copy only what changed since the last sync.
+
+    Each entry is keyed by the destination table (`...event_*` for a family of shards) and
+    maps every synced unit (a partition id, a shard table or WHOLE_TABLE) to the
+    last_modified_time of the source, in epoch milliseconds, when it was copied. An entry
+    is only used with the table configuration it was written with. The file is rewritten
+    after every copied unit, so an interrupted sync keeps what it already copied.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> "SyncState":
+        try:
+            with open(self.path, "r") as f:
+                content = json.load(f)
+            if content.get("version") == SYNC_STATE_VERSION:
+                self.entries = content.get("entries", {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+        return self
+
+    def _save(self):
+        # Called with the lock held
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": SYNC_STATE_VERSION, "entries": self.entries}, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    def get(self, target_table_ref: str, signature: str) -> Optional[Dict[str, int]]:
+        """Watermarks of a table ({unit: last modified}), None if it was never synced with this configuration."""
+        with self._lock:
+            entry = self.entries.get(target_table_ref)
+            if entry is None or entry.get("signature") != signature:
+                return None
+            return dict(entry["units"])
+
+    def record(self, target_table_ref: str, signature: str, unit: str, modified: int):
+        """Record a copied unit; an entry of another configuration is replaced."""
+        with self._lock:
+            entry = self.entries.get(target_table_ref)
+            if entry is None or entry.get("signature") != signature:
+                entry = self.entries[target_table_ref] = {"signature": signature, "units": {}}
+            entry["units"][unit] = modified
+            self._save()
+
+    def forget(self, target_table_ref: str, unit: str):
+        """Remove a unit that was dropped from the destination."""
+        with self._lock:
+            entry = self.entries.get(target_table_ref)
+            if entry is not None and entry["units"].pop(unit, None) is not None:
+                self._save()
+
+
+def changed_units(current: Dict[str, int], synced: Optional[Dict[str, int]]) -> Tuple[List[str], List[str]]:
+    """
+    Compare the units of a source ({unit: last modified}) with the watermarks of the last sync.
+
+    Returns:
+        Tuple of (units that are new or modified since, synced units the source no longer has).
+    """
+    synced = synced or {}
+    changed = [unit for unit, modified in current.items() if unit not in synced or modified > synced[unit]]
+    removed = [unit for unit in synced if unit not in current]
+    return changed, removed
+
+
+def _newest_first(unit: str):
+    # Time and integer-range partition ids and shard suffixes all sort by their number
+    number = unit.rsplit("_", 1)[-1]
+    return (1, int(number), unit) if number.isdigit() else (0, 0, unit)
+
+
+def partition_window(partitions: Dict[str, Dict], max_rows: int) -> List[str]:
+    """
+    The newest partitions that fit in max_rows together, newest first.
+
+    The newest partition is always included. Partitions whose rows are still in the
+    streaming buffer are left out, `__NULL__` counts as the oldest partition.
+    """
+    window, rows = [], 0
+    for partition_id in sorted(partitions, key=_newest_first, reverse=True):
+        if partition_id == STREAMING_PARTITION:
+            continue
+        partition_rows = partitions[partition_id]["rows"] or 0
+        if window and rows + partition_rows > max_rows:
+            break
+        window.append(partition_id)
+        rows += partition_rows
+    return window
+
+
+def newest_shards(shards: Dict[str, Dict], max_shards: Optional[int] = None) -> List[str]:
+    """Shard tables newest first (by suffix), at most max_shards of them."""
+    ordered = sorted(shards, key=_newest_first, reverse=True)
+    return ordered[:max_shards] if max_shards else ordered
+
+
+def load_partitions(client, table_refs: Iterable[str], max_concurrency: int = 8) -> Dict[str, Dict[str, Dict]]:
+    """
+    Read the partitions of source tables and when they last changed, without scanning them.
+
+    Tables are grouped per dataset and each dataset is read with a single query on its
+    `INFORMATION_SCHEMA.PARTITIONS` view. Unpartitioned tables have a single WHOLE_TABLE
+    unit. Tables missing from the result (views, external tables, datasets that can't be
+    read that way) have no partition metadata.
+
+    Returns:
+        {table ref: {partition id or WHOLE_TABLE: {"rows": int, "modified": epoch ms}}}
+    """
+    datasets = {}
+    for table_ref in set(table_refs):
+        project_id, dataset_id, table_id = table_ref.split(".")
+        datasets.setdefault((project_id, dataset_id), set()).add(table_id)
+
+    def load_dataset(key):
+        (project_id, dataset_id), table_ids = key, datasets[key]
+        partitions = {}
+        names = ", ".join(f"'{table_id}'" for table_id in sorted(table_ids))
+        query = f"""
+        SELECT table_name, partition_id, total_rows, last_modified_time
+        FROM `{project_id}.{dataset_id}`.INFORMATION_SCHEMA.PARTITIONS
+        WHERE table_name IN ({names})
+        """
+        try:
+            for row in client.query(query).result():
+                partitions.setdefault(f"{project_id}.{dataset_id}.{row.table_name}", {})[row.partition_id or WHOLE_TABLE] = {
+                    "rows": row.total_rows,
+                    "modified": to_millis(row.last_modified_time),
+                }
+        except Exception as e:
+            lines = str(e).split("\n")
+            print(f"Could not read partitions of {project_id}.{dataset_id} ({lines[0] if lines else e}), "
+                  f"its tables are copied in full...")
+        return partitions
+
+    table_partitions = {}
+    if not datasets:
+        return table_partitions
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(datasets)))) as executor:
+        # Jobs run in the caller's context, so they stay attributed to its action (see job_telemetry)
+        futures = [executor.submit(contextvars.copy_context().run, load_dataset, key) for key in datasets]
+        for future in futures:
+            table_partitions.update(future.result())
+    return table_partitions
+
+
+def load_shards(client, project_id: str, dataset_id: str, prefix: str) -> Dict[str, Dict]:
+    """
+    The shard tables `<prefix><number>` of a dataset and when they last changed, from its `__TABLES__` meta-table.
+
+    Returns:
+        {table id: {"rows": int, "modified": epoch ms}}
+    """
+    query = f"""
+    SELECT table_id, row_count, last_modified_time
+    FROM `{project_id}.{dataset_id}.__TABLES__`
+    WHERE STARTS_WITH(table_id, '{prefix}')
+    """
+    return {
+        row.table_id: {"rows": row.row_count, "modified": to_millis(row.last_modified_time)}
+        for row in client.query(query).result()
+        if row.table_id.startswith(prefix) and _SHARD_SUFFIX_PATTERN.match(row.table_id[len(prefix):])
+    }
@@ -0,0 +1,140 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Set, Tuple
+
+from google.cloud import bigquery
+
+from dataform_graph import DataformGraph
+from incremental_merge import builds_both_paths
+from schema_catalog import flatten_sql_type
+from table_cleanup import group_by_dataset
+
+# Variables can only be declared at the start of a script, so actions declaring their own can't be nested
+_DECLARE_PATTERN = re.compile(r"\bDECLARE\b", re.IGNORECASE)
+
+
+def _action_sql(table: Dict, incremental_mode: str) -> str:
+    """The query process_table builds the action from: the incremental one when available."""
+    if table.get("incrementalQuery") and not builds_both_paths(table, incremental_mode):
+        return table["incrementalQuery"]
+    return table.get("query", "")
+
+
+def _declares_variables(table: Dict) -> bool:
+    operations = [*table.get("preOps", []), *table.get("postOps", []),
+                  *table.get("incrementalPreOps", []), *table.get("incrementalPostOps", [])]
+    return any(_DECLARE_PATTERN.search(operation) for operation in operations)
+
+
+def select_packable(client, graph: DataformGraph, keys: Iterable[str], max_bytes: int,
+                    incremental_mode: str = "incremental", max_concurrency: int = 32) -> Set[str]:
+    """
+    Actions cheap enough to share a script job with other actions.
+
+    Views are always cheap. Tables are dry-run against the real upstream tables, and are
+    cheap if they'd process at most `max_bytes`; a table whose dry run fails (e.g. an
+    input that doesn't exist yet) runs on its own, where its error is reported as usual.
+    Actions building both incremental paths, or declaring script variables, never pack.
+    """
+    candidates = []
+    packable = set()
+    for key in keys:
+        table = graph.get(key)
+        if not _action_sql(table, incremental_mode) or builds_both_paths(table, incremental_mode) or _declares_variables(table):
+            continue
+        if table.get("type") == "view":
+            packable.add(key)
+        else:
+            candidates.append(key)
+
+    def is_cheap(key: str) -> bool:
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        try:
+            job = client.query(_action_sql(graph.get(key), incremental_mode), job_config=job_config)
+        except Exception:
+            return False
+        return (job.total_bytes_processed or 0) <= max_bytes
+
+    if candidates:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(candidates)))) as executor:
+            packable.update(key for key, cheap in zip(candidates, executor.map(is_cheap, candidates)) if cheap)
+    return packable
+
+
+def build_pack_script(actions: List[Tuple[str, str]]) -> str:
+    """
+    Build one script running several action scripts, given as (action, script) pairs.
+
+    Every action runs in its own block with an error handler, so a failing action doesn't
+    stop the others: its error is collected instead, and the script returns one
+    (action, message) row per failed action.
+    """
+    blocks = []
+    for action, script in actions:
+        name = action.replace("\\", "\\\\").replace("'", "\\'")
+        blocks.append(
+            f"BEGIN\n{script.rstrip()}\n"
+            f"EXCEPTION WHEN ERROR THEN\n"
+            f"  SET pack_errors = ARRAY_CONCAT(pack_errors, [STRUCT('{name}' AS action, @@error.message AS message)]);\n"
+            f"END;"
+        )
+    return (
+        "DECLARE pack_errors ARRAY<STRUCT<action STRING, message STRING>> DEFAULT [];\n"
+        + "\n".join(blocks)
+        + "\nSELECT action, message FROM UNNEST(pack_errors);"
+    )
+
+
+def record_child_jobs(client, script_job, test_tables: Dict[str, str]) -> int:
+    """
+    Record the child jobs of a pack script under the action whose test table they create.
+
+    Child jobs carry the bytes and slot-ms of every statement; they are matched to an
+    action by their DDL target, in `test_tables` ({test table: action}). Nothing is
+    recorded if the client doesn't record jobs (see job_telemetry.RecordingClient).
+
+    Returns:
+        int: The number of child jobs recorded.
+    """
+    recorder = getattr(client, "recorder", None)
+    if recorder is None:
+        return 0
+    recorded = 0
+    now = time.time()
+    for child in client.list_jobs(parent_job=script_job.job_id):
+        target = getattr(child, "ddl_target_table", None)
+        action = test_tables.get(f"{target.project}.{target.dataset_id}.{target.table_id}") if target else None
+        if action is None:
+            continue
+        recorder.record(child, action, "child", now, now)
+        recorded += 1
+    return recorded
+
+
+def load_output_schemas(client, test_tables: Iterable[str]) -> Dict[str, Dict[str, str]]:
+    """
+    Flattened schemas of freshly built test tables, read with a single INFORMATION_SCHEMA query.
+
+    DDL child jobs don't report the schema of the table they create, so the schemas are
+    read back in bulk (the COLUMNS views of every dataset, UNION ALL) rather than with one
+    tables API call per action. Tables that don't exist are missing from the result.
+    """
+    datasets = group_by_dataset(test_tables)
+    if not datasets:
+        return {}
+    selects = []
+    for (project_id, dataset_id), tables in datasets.items():
+        names = ", ".join(f"'{table.split('.', 2)[2]}'" for table in tables)
+        selects.append(f"""
+        SELECT '{project_id}' AS table_catalog, table_schema, table_name, column_name, is_nullable, data_type, ordinal_position
+        FROM `{project_id}.{dataset_id}`.INFORMATION_SCHEMA.COLUMNS
+        WHERE table_name IN ({names})""")
+    query = "\n        UNION ALL".join(selects) + "\n        ORDER BY table_schema, table_name, ordinal_position"
+
+    schemas = {}
+    for row in client.query(query).result():
+        schemas.setdefault(f"{row.table_catalog}.{row.table_schema}.{row.table_name}", {}).update(
+            flatten_sql_type(row.column_name, row.data_type, row.is_nullable != "NO")
+        )
+    return schemas
@@ -0,0 +1,158 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set
+
+from dataform_graph import DataformGraph, target_key
+from job_telemetry import job_action
+from sql_rewrite import rewrite_references
+
+
+def unique_key_assertions(graph: DataformGraph, keys: Iterable[str]) -> List[Dict]:
+    """
+    Uniqueness assertions implied by the `uniqueKey` of the selected tables, in the format
+    of compiled assertions. Incremental merges on a key that isn't unique fail or
+    duplicate rows, so the key is checked like `assertions: {uniqueKey: [...]}` would.
+    """
+    assertions = []
+    for key in keys:
+        table = graph.get(key)
+        unique_key = table.get("uniqueKey") if table else None
+        if not unique_key:
+            continue
+        target = table["target"]
+        columns = ", ".join(f"`{column}`" for column in unique_key)
+        assertions.append({
+            "target": {"database": target["database"], "schema": target["schema"], "name": f"{target['name']}_assertions_uniqueKey"},
+            "query": f"SELECT {columns}, COUNT(*) AS rows_per_key FROM `{key}` GROUP BY {columns} HAVING COUNT(*) > 1",
+            "dependencyTargets": [dict(target)],
+        })
+    return assertions
+
+
+def build_batch_query(assertions: List[Dict], test_table_map: Dict[str, Dict[str, str]]) -> str:
+    """
+    Build one query running several assertions: each counts the rows its query returns,
+    and only the assertions with failing rows come back, as (assertion, failing_rows).
+    """
+    checks = []
+    for assertion in assertions:
+        query = rewrite_references(assertion.get("query", ""), test_table_map).rstrip().rstrip(";")
+        name = target_key(assertion.get("target", {}))
+        checks.append(f"SELECT '{name}' AS assertion, (SELECT COUNT(*) FROM (\n{query}\n)) AS failing_rows")
+    union = "\nUNION ALL\n".join(checks)
+    return f"SELECT assertion, failing_rows FROM (\n{union}\n)\nWHERE failing_rows > 0"
+
+
+class AssertionBatcher:
+    """
+    Run assertions in batches, one query per dataset, while the tables they check are built.
+
+    The scheduler reports every finished table (see scheduler.run_dag `on_done`). An
+    assertion is ready once all of its upstream tables built in this run succeeded, and is
+    skipped if one of them failed; upstream tables outside the run are read as they are.
+    The ready assertions of a dataset are submitted as one batch when the dataset has no
+    assertion left waiting, or `batch_size` of them are ready. A batch that fails as a
+    whole (e.g. one invalid query) is retried one assertion at a time.
+    """
+
+    def __init__(self, client, assertions: List[Dict], built_keys: Iterable[str],
+                 test_table_map: Dict[str, Dict[str, str]], state_lock: threading.Lock,
+                 batch_size: int = 50, max_concurrency: int = 4):
+        self.client = client
+        self.test_table_map = test_table_map
+        self.state_lock = state_lock
+        self.batch_size = max(1, batch_size)
+        self.results: List[Dict] = []
+        self._results_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+        self._futures = []
+
+        built_keys = set(built_keys)
+        self._assertions = {target_key(assertion["target"]): assertion for assertion in assertions}
+        self._pending: Dict[str, Set[str]] = {}  # Assertion -> upstream tables not built yet
+        self._waiting: Dict[str, List[str]] = {}  # Table -> assertions waiting for it
+        self._ready: Dict[str, List[str]] = {}  # Dataset -> ready assertions not submitted yet
+        self._unready: Dict[str, int] = {}  # Dataset -> assertions still waiting
+        for name, assertion in self._assertions.items():
+            upstream = {target_key(dep) for dep in assertion.get("dependencyTargets", [])} & built_keys
+            self._pending[name] = upstream
+            for dep in upstream:
+                self._waiting.setdefault(dep, []).append(name)
+            dataset = self._dataset(assertion)
+            self._ready.setdefault(dataset, [])
+            self._unready[dataset] = self._unready.get(dataset, 0) + (1 if upstream else 0)
+            if not upstream:
+                self._ready[dataset].append(name)
+
+    @staticmethod
+    def _dataset(assertion: Dict) -> str:
+        return f"{assertion['target'].get('database', '')}.{assertion['target'].get('schema', '')}"
+
+    def __len__(self) -> int:
+        return len(self._assertions)
+
+    def start(self):
+        """Submit the assertions that don't wait for any table of the run."""
+        self._flush(force=False)
+
+    def on_table_done(self, key: str, status: str):
+        for name in self._waiting.pop(key, []):
+            if name not in self._pending:
+                continue  # Already skipped
+            dataset = self._dataset(self._assertions[name])
+            if status == "success":
+                self._pending[name].discard(key)
+                if self._pending[name]:
+                    continue
+                self._ready[dataset].append(name)
+            else:
+                self._add_result(name, "skipped", error=f"upstream table {key} {status}")
+            del self._pending[name]
+            self._unready[dataset] -= 1
+        self._flush(force=False)
+
+    def finish(self) -> List[Dict]:
+        """Submit what is left, wait for every batch and return the results."""
+        for name in list(self._pending):
+            if self._pending[name]:
+                self._add_result(name, "skipped", error="upstream tables were not built")
+                del self._pending[name]
+        self._flush(force=True)
+        for future in self._futures:
+            future.result()
+        self._executor.shutdown()
+        return self.results
+
+    def _flush(self, force: bool):
+        for dataset, ready in self._ready.items():
+            while ready and (force or self._unready[dataset] == 0 or len(ready) >= self.batch_size):
+                batch, self._ready[dataset] = ready[:self.batch_size], ready[self.batch_size:]
+                ready = self._ready[dataset]
+                for name in batch:
+                    self._pending.pop(name, None)
+                self._futures.append(self._executor.submit(self._run_batch, dataset, batch))
+
+    def _add_result(self, name: str, status: str, failing_rows: int = 0, error: Optional[str] = None):
+        with self._results_lock:
+            self.results.append({"assertion": name, "status": status, "failing_rows": failing_rows, "error": error})
+
+    def _run_batch(self, dataset: str, batch: List[str]):
+        with job_action(f"assertions {dataset}"):
+            with self.state_lock:
+                query = build_batch_query([self._assertions[name] for name in batch], self.test_table_map)
+            print(f"Running {len(batch)} assertions of {dataset}")
+            try:
+                failing = {row.assertion: row.failing_rows for row in self.client.query(query).result()}
+            except Exception as e:
+                if len(batch) > 1:
+                    for name in batch:
+                        self._run_batch(dataset, [name])
+                    return
+                lines = str(e).split("\n")
+                self._add_result(batch[0], "error", error=lines[0] if lines else str(e))
+                return
+        for name in batch:
+            if name in failing:
+                self._add_result(name, "failed", failing_rows=failing[name])
+            else:
+                self._add_result(name, "passed")
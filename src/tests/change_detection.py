@@ -0,0 +1,109 @@
+import os
+import re
+import subprocess
+from typing import Dict, Iterable, List, Set
+
+from dataform_graph import DataformGraph
+
+# Files whose change affects every compiled action
+GLOBAL_FILES = ("workflow_settings.yaml",)
+
+
+# Function to list the files changed between a base ref and the working tree
+def get_changed_files(base_ref: str, repo_root: str = ".") -> List[str]:
+    """
+    Return the paths changed since the merge base of `base_ref` and HEAD, including
+    uncommitted changes, relative to the repository root.
+    """
+    merge_base = subprocess.run(
+        ["git", "merge-base", base_ref, "HEAD"], cwd=repo_root, check=True, capture_output=True, text=True
+    ).stdout.strip()
+    diff = subprocess.run(
+        ["git", "diff", "--name-only", merge_base], cwd=repo_root, check=True, capture_output=True, text=True
+    ).stdout
+    return [line.strip() for line in diff.splitlines() if line.strip()]
+
+
+def _read_file(path: str, cache: Dict[str, str]) -> str:
+    if path not in cache:
+        try:
+            with open(path, "r") as f:
+                cache[path] = f.read()
+        except OSError:
+            cache[path] = ""
+    return cache[path]
+
+
+def _include_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def affected_includes(changed_includes: Iterable[str], repo_root: str = ".") -> Set[str]:
+    """
+    Return the names of the changed include modules plus every include that uses one
+    of them, e.g. {"helpers"} for a change in includes/helpers.js.
+    """
+    includes_dir = os.path.join(repo_root, "includes")
+    all_includes = {}
+    if os.path.isdir(includes_dir):
+        for file_name in os.listdir(includes_dir):
+            if file_name.endswith(".js"):
+                all_includes[_include_name(file_name)] = os.path.join(includes_dir, file_name)
+
+    cache = {}
+    affected = {_include_name(path) for path in changed_includes}
+    changed = True
+    while changed:
+        changed = False
+        for name, path in all_includes.items():
+            if name not in affected and uses_includes(_read_file(path, cache), affected):
+                affected.add(name)
+                changed = True
+    return affected
+
+
+def uses_includes(source: str, include_names: Iterable[str]) -> bool:
+    """Check if a .sqlx/.js source references one of the include modules (helpers.x or require(".../helpers"))."""
+    names = "|".join(re.escape(name) for name in include_names)
+    if not names:
+        return False
+    return re.search(rf"\b(?:{names})\s*\.|require\([^)]*\b(?:{names})(?:\.js)?[\"']\s*\)", source) is not None
+
+
+def map_changed_files_to_actions(graph: DataformGraph, changed_files: Iterable[str], repo_root: str = ".") -> Set[str]:
+    """
+    Map changed files to the keys of the compiled actions they define or influence.
+
+    - definitions/**: every action compiled from the file (matched on its "fileName")
+    - includes/*.js: every action whose source file uses the changed include
+    - workflow_settings.yaml: every action
+    """
+    changed_files = [path.replace("\\", "/") for path in changed_files]
+    if any(path in GLOBAL_FILES for path in changed_files):
+        return set(graph.actions)
+
+    changed_definitions = {path for path in changed_files if path.startswith("definitions/")}
+    changed_includes = [path for path in changed_files if path.startswith("includes/") and path.endswith(".js")]
+    include_names = affected_includes(changed_includes, repo_root) if changed_includes else set()
+
+    cache = {}
+    changed_keys = set()
+    for key, file_name in graph.file_names.items():
+        if not file_name:
+            continue
+        if file_name in changed_definitions:
+            changed_keys.add(key)
+        elif include_names and uses_includes(_read_file(os.path.join(repo_root, file_name), cache), include_names):
+            changed_keys.add(key)
+    return changed_keys
+
+
+def select_actions(graph: DataformGraph, changed_keys: Iterable[str], action_type: str = "tables") -> List[str]:
+    """
+    Return the actions to test for a set of changed actions: the changed ones and all of
+    their downstream dependents, in the order of the compiled JSON. Unchanged upstream
+    actions are not selected, so their references keep pointing at the real tables.
+    """
+    changed_keys = set(changed_keys)
+    selected = changed_keys | graph.descendants(changed_keys)
+    return [key for key in graph.keys_of_type(action_type) if key in selected]
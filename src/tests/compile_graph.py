@@ -0,0 +1,240 @@
+"""
+Cached, content-addressed compilation of the Dataform project.
+
+`dataform compile --json` only runs when the sources changed. The compiled graph is
+cached under a hash of definitions/, includes/, package.json/package-lock.json, the
+workflow settings of the environment and the compile command. A change that touches
+none of them (Python, CI files, docs) reuses the cached graph. Every cached graph is
+written with its lazy store (see dataform_graph.write_graph_store), so the schema tests
+only parse the actions they test.
+
+The environment is "dev" or "prod", like switch_env. Without --env the current
+workflow_settings.yaml is compiled as it is. With an environment whose settings differ
+from the current ones, its settings file replaces workflow_settings.yaml for the
+duration of the compilation only.
+
+Usage:
+    python src/tests/compile_graph.py [--env dev|prod] [--output src/tests/compiled_queries/result.json] [--force]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from dataform_graph import store_paths, write_graph_store
+
+ENVIRONMENTS = ("dev", "prod")
+# Settings compiled by Dataform, and the per-environment files switch_env copies over it
+SETTINGS_FILE = "workflow_settings.yaml"
+ENV_SETTINGS_FILE = "src/local_run_commands/workflow_settings_{environment}.yaml"
+# Sources of the compiled graph, relative to the repository root
+SOURCE_DIRS = ("definitions", "includes")
+SOURCE_FILES = ("package.json", "package-lock.json")
+
+DEFAULT_COMMAND = ["npx", "dataform", "compile", "--json"]
+DEFAULT_GRAPH_PATH = "src/tests/compiled_queries/result.json"
+DEFAULT_CACHE_DIR = ".dataform_compile_cache"
+
+
+class CompileError(Exception):
+    pass
+
+
+def settings_path_for(environment: Optional[str], repo_root: str = ".") -> str:
+    """Workflow settings of an environment, the current workflow_settings.yaml if None."""
+    if environment is None:
+        return os.path.join(repo_root, SETTINGS_FILE)
+    if environment not in ENVIRONMENTS:
+        raise CompileError(f"Unknown environment '{environment}', expected one of {', '.join(ENVIRONMENTS)}")
+    return os.path.join(repo_root, ENV_SETTINGS_FILE.format(environment=environment))
+
+
+def source_files(repo_root: str = ".") -> List[str]:
+    """Every file the compiled graph depends on, except the workflow settings, sorted and relative to repo_root."""
+    paths = [path for path in SOURCE_FILES if os.path.isfile(os.path.join(repo_root, path))]
+    for source_dir in SOURCE_DIRS:
+        for directory, subdirectories, file_names in os.walk(os.path.join(repo_root, source_dir)):
+            subdirectories.sort()
+            paths.extend(os.path.relpath(os.path.join(directory, file_name), repo_root).replace("\\", "/")
+                         for file_name in file_names)
+    return sorted(paths)
+
+
+def source_fingerprint(settings_path: str, command: List[str], repo_root: str = ".") -> str:
+    """Content hash of the sources, the workflow settings and the compile command."""
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps(command).encode("utf-8"))
+    for path in source_files(repo_root) + [SETTINGS_FILE]:
+        file_path = settings_path if path == SETTINGS_FILE else os.path.join(repo_root, path)
+        try:
+            with open(file_path, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            content = b""
+        hasher.update(f"{path}\0{len(content)}\0".encode("utf-8"))
+        hasher.update(content)
+    return hasher.hexdigest()[:24]
+
+
+@contextmanager
+def workflow_settings(settings_path: str, repo_root: str = "."):
+    """Put the settings of an environment in place for the compilation, like switch_env, and restore the current ones."""
+    target = os.path.join(repo_root, SETTINGS_FILE)
+    with open(settings_path, "rb") as f:
+        settings = f.read()
+    try:
+        with open(target, "rb") as f:
+            current = f.read()
+    except FileNotFoundError:
+        current = None
+    if current == settings:
+        yield
+        return
+    with open(target, "wb") as f:
+        f.write(settings)
+    try:
+        yield
+    finally:
+        if current is None:
+            os.remove(target)
+        else:
+            with open(target, "wb") as f:
+                f.write(current)
+
+
+def run_compile(command: List[str], repo_root: str = ".") -> Dict:
+    """Run the compile command and return the compiled graph; compilation errors raise CompileError."""
+    try:
+        completed = subprocess.run(command, cwd=repo_root, capture_output=True, text=True)
+    except OSError as e:
+        raise CompileError(f"Could not run {' '.join(command)}: {e}")
+    try:
+        data = json.loads(completed.stdout)
+    except json.JSONDecodeError:
+        output = (completed.stderr or completed.stdout).strip().splitlines()
+        raise CompileError(f"{' '.join(command)} failed with exit code {completed.returncode}: "
+                           f"{output[-1] if output else 'no output'}")
+    errors = (data.get("graphErrors") or {}).get("compilationErrors") or []
+    if errors or completed.returncode != 0:
+        messages = [f"{error.get('fileName', '?')}: {error.get('message', error)}" for error in errors]
+        raise CompileError(f"Compilation failed: {'; '.join(messages) or f'exit code {completed.returncode}'}")
+    return data
+
+
+def prune_cache(cache_dir: str, max_entries: int):
+    """Remove the least recently used compiled graphs beyond max_entries."""
+    try:
+        entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)]
+    except FileNotFoundError:
+        return
+    entries = sorted((path for path in entries if os.path.isdir(path)), key=os.path.getmtime, reverse=True)
+    for path in entries[max(1, max_entries):]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def compile_graph(environment: Optional[str] = None, repo_root: str = ".", cache_dir: str = DEFAULT_CACHE_DIR,
+                  command: Optional[List[str]] = None, force: bool = False, max_entries: int = 10) -> Tuple[str, bool]:
+    """
+    Return the compiled graph of the sources as they are, compiling them only on a cache miss.
+
+    Args:
+        environment (str): "dev" or "prod" (see switch_env), None for the current workflow_settings.yaml.
+        cache_dir (str): Directory of the cache, one sub-directory per fingerprint.
+        force (bool): Compile even if the graph is cached, and replace the cache entry.
+        max_entries (int): Compiled graphs kept in the cache.
+
+    Returns:
+        Tuple of (path of the cached compiled graph, whether it was a cache hit).
+    """
+    command = command or DEFAULT_COMMAND
+    settings_path = settings_path_for(environment, repo_root)
+    if not os.path.isfile(settings_path):
+        raise CompileError(f"Workflow settings {settings_path} not found")
+    fingerprint = source_fingerprint(settings_path, command, repo_root)
+    entry_dir = os.path.join(cache_dir, fingerprint)
+    graph_path = os.path.join(entry_dir, "result.json")
+
+    if not force and os.path.isfile(store_paths(graph_path)["index"]):
+        os.utime(entry_dir)  # Most recently used
+        return graph_path, True
+
+    with workflow_settings(settings_path, repo_root):
+        data = run_compile(command, repo_root)
+    # Written aside and moved in place, so a concurrent or interrupted run never sees half an entry
+    temp_dir = f"{entry_dir}.tmp{os.getpid()}"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    write_graph_store(data, os.path.join(temp_dir, "result.json"))
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(temp_dir, entry_dir)
+    prune_cache(cache_dir, max_entries)
+    return graph_path, False
+
+
+def publish_graph(graph_path: str, output: str):
+    """Copy a cached graph and its store to output (e.g. result.json for the tools reading it), keeping the store valid."""
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    source_store, output_store = store_paths(graph_path), store_paths(output)
+    # copy2 keeps the modification time the index was written with
+    shutil.copy2(source_store["actions"], output_store["actions"])
+    shutil.copy2(source_store["index"], output_store["index"])
+    shutil.copy2(graph_path, output)
+
+
+def load_compile_config(config_path: str) -> Dict:
+    """Load the "compile" section of the general configuration file, if any."""
+    try:
+        with open(config_path, "r") as f:
+            return json.load(f).get("compile", {})
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def prepare_graph(environment: Optional[str], output: str, compile_config: Dict, force: bool = False) -> str:
+    """Compile (or reuse) the graph of an environment, publish it to output and return output."""
+    start = time.time()
+    graph_path, hit = compile_graph(
+        environment,
+        cache_dir=compile_config.get("cache_dir", DEFAULT_CACHE_DIR),
+        command=compile_config.get("command"),
+        force=force,
+        max_entries=compile_config.get("cache_max_entries", 10),
+    )
+    publish_graph(graph_path, output)
+    label = environment or "current settings"
+    print(f"Compiled graph of {label}: {'cache hit' if hit else 'compiled'} in {time.time() - start:.1f}s, "
+          f"written to {output}")
+    return output
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--env", choices=ENVIRONMENTS, default=None,
+                        help="Environment to compile, as set by switch_env (default: the current workflow_settings.yaml).")
+    parser.add_argument("--output", default=None,
+                        help=f"Where to write the compiled graph (default: compile.graph_path, else {DEFAULT_GRAPH_PATH}).")
+    parser.add_argument("--config", default="src/config.json", help="General configuration file.")
+    parser.add_argument("--force", action="store_true", help="Compile even if the sources didn't change.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    compile_config = load_compile_config(args.config)
+    try:
+        prepare_graph(args.env, args.output or compile_config.get("graph_path", DEFAULT_GRAPH_PATH), compile_config, args.force)
+    except CompileError as e:
+        print(f"::error::{e}")  # GitHub CI error annotation
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import json
+import os
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+# Arrays of the compiled Dataform JSON that hold actions with a target
+ACTION_TYPES = ("tables", "operations", "assertions", "declarations")
+
+STORE_VERSION = 1
+
+
+# Function to build the canonical "project.dataset.table" key of a Dataform target
+def target_key(target: Dict) -> str:
+    return f"{target.get('database', '')}.{target.get('schema', '')}.{target.get('name', '')}"
+
+
+def store_paths(json_path: str) -> Dict[str, str]:
+    """Files of the lazy store kept next to a compiled graph, e.g. result.index.json and result.actions.jsonl."""
+    base = os.path.splitext(json_path)[0]
+    return {"index": f"{base}.index.json", "actions": f"{base}.actions.jsonl"}
+
+
+def write_graph_store(data: Dict, json_path: str):
+    """
+    Write a compiled graph together with its lazy store (see DataformGraph.load).
+
+    Every action is written on its own line of the actions file, and the index holds the
+    skeleton of the graph (key, type, target, file and dependencies of every action) with
+    the byte range of its line. The index also records the size and modification time of
+    the compiled graph, so a graph regenerated without its store is never read through a
+    stale index.
+    """
+    paths = store_paths(json_path)
+    with open(json_path, "w") as f:
+        json.dump(data, f)
+
+    index = []
+    offset = 0
+    with open(paths["actions"], "wb") as f:
+        for action_type in ACTION_TYPES:
+            for action in data.get(action_type, []) or []:
+                line = (json.dumps(action) + "\n").encode("utf-8")
+                f.write(line)
+                index.append({
+                    "key": target_key(action.get("target", {})),
+                    "type": action_type,
+                    "target": action.get("target", {}),
+                    "fileName": action.get("fileName", ""),
+                    "dependencies": [target_key(dep) for dep in action.get("dependencyTargets", []) or []],
+                    "offset": offset,
+                    "length": len(line),
+                })
+                offset += len(line)
+
+    stat = os.stat(json_path)
+    with open(paths["index"], "w") as f:
+        json.dump({"version": STORE_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "actions": index}, f)
+
+
+class LazyActions(Mapping):
+    """Actions of a graph store, {key: action}, each parsed from its line on first access."""
+
+    def __init__(self, actions_path: str, ranges: Dict[str, tuple]):
+        self.actions_path = actions_path
+        self._ranges = ranges
+        self._loaded: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> Dict:
+        action = self._loaded.get(key)
+        if action is None:
+            offset, length = self._ranges[key]
+            with self._lock:
+                with open(self.actions_path, "rb") as f:
+                    f.seek(offset)
+                    action = self._loaded.setdefault(key, json.loads(f.read(length)))
+        return action
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ranges)
+
+    def __len__(self) -> int:
+        return len(self._ranges)
+
+    def __contains__(self, key) -> bool:
+        return key in self._ranges
+
+    @property
+    def loaded(self) -> int:
+        """Number of actions parsed so far."""
+        return len(self._loaded)
+
+
+class DataformGraph:
+    """
+    Indexed model of a compiled Dataform graph (the output of `dataform compile --json`).
+
+    Built once per run: every action of `tables`, `operations`, `assertions` and
+    `declarations` is indexed by its canonical `database.schema.name` key, together
+    with the forward (upstream) and reverse (downstream) adjacency of the graph.
+    Dependency lookups are dict lookups instead of scans over the compiled JSON.
+
+    Graphs written with a lazy store (see write_graph_store) are loaded from its index
+    only; the SQL of an action is parsed when the action is first used, so a selective
+    run only reads the actions it tests. `targets` and `file_names` never load an action.
+    """
+
+    def __init__(self, data: Dict):
+        self.data = data
+        actions, action_types = {}, {}
+        for action_type in ACTION_TYPES:
+            for action in data.get(action_type, []) or []:
+                key = target_key(action.get("target", {}))
+                actions[key] = action
+                action_types[key] = action_type
+        self._build(
+            actions, action_types,
+            {key: [target_key(dep) for dep in action.get("dependencyTargets", []) or []] for key, action in actions.items()},
+            {key: action.get("target", {}) for key, action in actions.items()},
+            {key: action.get("fileName", "") for key, action in actions.items()},
+        )
+
+    def _build(self, actions: Mapping, action_types: Dict[str, str], dependencies: Dict[str, List[str]],
+               targets: Dict[str, Dict], file_names: Dict[str, str]):
+        self.actions = actions
+        self.action_types = action_types
+        self.targets = targets
+        self.file_names = file_names
+        self.upstream: Dict[str, List[str]] = {key: [] for key in actions}
+        self.downstream: Dict[str, List[str]] = {key: [] for key in actions}
+
+        for key in actions:
+            seen = set()
+            for dep_key in dependencies.get(key, []):
+                if dep_key == key or dep_key in seen:
+                    continue
+                seen.add(dep_key)
+                self.upstream[key].append(dep_key)
+                # Dependencies on targets missing from the compiled graph are kept
+                # upstream only, they are checked by `missing_dependencies`
+                if dep_key in self.downstream:
+                    self.downstream[dep_key].append(key)
+
+    @classmethod
+    def from_json_file(cls, json_path: str) -> "DataformGraph":
+        with open(json_path, "r") as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_store(cls, json_path: str) -> Optional["DataformGraph"]:
+        """Load a graph from the lazy store next to json_path, None if there's none or it's stale."""
+        paths = store_paths(json_path)
+        try:
+            with open(paths["index"], "r") as f:
+                index = json.load(f)
+            stat = os.stat(json_path)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if (index.get("version") != STORE_VERSION or index.get("size") != stat.st_size
+                or index.get("mtime_ns") != stat.st_mtime_ns or not os.path.exists(paths["actions"])):
+            return None
+
+        graph = cls.__new__(cls)
+        graph.data = None  # Never parsed as a whole
+        entries = {entry["key"]: entry for entry in index["actions"]}  # Later duplicates win, like in __init__
+        graph._build(
+            LazyActions(paths["actions"], {key: (entry["offset"], entry["length"]) for key, entry in entries.items()}),
+            {key: entry["type"] for key, entry in entries.items()},
+            {key: entry["dependencies"] for key, entry in entries.items()},
+            {key: entry["target"] for key, entry in entries.items()},
+            {key: entry["fileName"] for key, entry in entries.items()},
+        )
+        return graph
+
+    @classmethod
+    def load(cls, json_path: str) -> "DataformGraph":
+        """Load a compiled graph, lazily if it has an up-to-date store, else by parsing it."""
+        return cls.from_store(json_path) or cls.from_json_file(json_path)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.actions
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.actions.get(key)
+
+    def type_of(self, key: str) -> Optional[str]:
+        return self.action_types.get(key)
+
+    def keys_of_type(self, action_type: str) -> List[str]:
+        """Return the keys of one action type, in the order of the compiled JSON."""
+        return [key for key, kind in self.action_types.items() if kind == action_type]
+
+    def missing_dependencies(self) -> Dict[str, List[str]]:
+        """Return, per action, the dependencies that are not part of the compiled graph."""
+        missing = {}
+        for key, deps in self.upstream.items():
+            unknown = [dep for dep in deps if dep not in self.actions]
+            if unknown:
+                missing[key] = unknown
+        return missing
+
+    def descendants(self, keys: Iterable[str]) -> Set[str]:
+        """Return every action that (transitively) depends on one of `keys`."""
+        return self._walk(keys, self.downstream)
+
+    def ancestors(self, keys: Iterable[str]) -> Set[str]:
+        """Return every action that one of `keys` (transitively) depends on."""
+        return self._walk(keys, self.upstream)
+
+    @staticmethod
+    def _walk(keys: Iterable[str], adjacency: Dict[str, List[str]]) -> Set[str]:
+        found = set()
+        stack = [nxt for key in keys for nxt in adjacency.get(key, ())]
+        while stack:
+            current = stack.pop()
+            if current in found:
+                continue
+            found.add(current)
+            stack.extend(adjacency.get(current, ()))
+        return found
+
+    def find_cycles(self) -> List[List[str]]:
+        """
+        Detect dependency cycles with an iterative depth-first search.
+
+        Returns:
+            List[List[str]]: One entry per back edge found, listing the keys of the cycle
+            in dependency order. Empty if the graph is a DAG.
+        """
+        WHITE, GREY, BLACK = 0, 1, 2
+        color = {key: WHITE for key in self.actions}
+        cycles = []
+
+        for root in self.actions:
+            if color[root] != WHITE:
+                continue
+            path = [root]
+            color[root] = GREY
+            iterators = [iter(self.upstream[root])]
+            while iterators:
+                for dep in iterators[-1]:
+                    if dep not in color:
+                        continue
+                    if color[dep] == GREY:
+                        cycles.append(path[path.index(dep):] + [dep])
+                    elif color[dep] == WHITE:
+                        color[dep] = GREY
+                        path.append(dep)
+                        iterators.append(iter(self.upstream[dep]))
+                        break
+                else:
+                    color[path.pop()] = BLACK
+                    iterators.pop()
+
+        return cycles
+
+    def topological_order(self, keys: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Return `keys` (default: all actions) sorted so dependencies come first.
+
+        Only edges between the selected keys are considered. Keys that are part of a
+        cycle are left out of the result.
+        """
+        selected = list(self.actions) if keys is None else [key for key in keys if key in self.actions]
+        selected_set = set(selected)
+        pending = {key: sum(1 for dep in self.upstream[key] if dep in selected_set) for key in selected}
+        order = [key for key in selected if pending[key] == 0]
+        for key in order:
+            for dependent in self.downstream[key]:
+                if dependent in pending:
+                    pending[dependent] -= 1
+                    if pending[dependent] == 0:
+                        order.append(dependent)
+        return order
@@ -0,0 +1,75 @@
+from collections import ChainMap
+from typing import Dict, List, Optional
+
+from sql_rewrite import rewrite_operations, rewrite_references
+
+INCREMENTAL_MODES = ("incremental", "both")
+
+
+def builds_both_paths(table: Dict, incremental_mode: str) -> bool:
+    """True if both the full-refresh and the incremental path of an action are tested."""
+    return incremental_mode == "both" and bool(table.get("query")) and bool(table.get("incrementalQuery"))
+
+
+def _statements(operations: List[str]) -> str:
+    sql = "\n".join(operations)
+    if sql and not sql.rstrip().endswith(";"):
+        sql += ";"
+    return sql
+
+
+def build_incremental_script(table: Dict, test_table: str, columns: List[str],
+                             test_table_map: Dict[str, Dict[str, str]]) -> str:
+    """
+    Build the script applying the incremental query of an action to its seeded test table.
+
+    Like Dataform does for incremental tables, the rows of the incremental query are merged
+    on `uniqueKey` (updated when matched, inserted otherwise, restricted to
+    `bigquery.updatePartitionFilter` if set), or appended when there is no unique key.
+    References to the action itself, in the query and in its incremental pre/post
+    operations, point to the seeded test table, so filters like
+    `WHERE updated_at > (SELECT MAX(updated_at) FROM ${self()})` read the seed.
+
+    Args:
+        table (Dict): The compiled action.
+        test_table (str): The seeded test table, "project.dataset.table".
+        columns (List[str]): Top-level columns of the seeded test table.
+        test_table_map (Dict[str, Dict[str, str]]): Test tables of the upstream actions.
+    """
+    target = table.get("target", {})
+    table_id = f"{target.get('database', '')}.{target.get('schema', '')}.{target.get('name', '')}"
+    self_map = ChainMap({table_id: {"test_table": test_table}}, test_table_map)
+    query = rewrite_references(table.get("incrementalQuery", ""), self_map).rstrip().rstrip(";")
+    pre_ops = _statements(rewrite_operations(table.get("incrementalPreOps", []), self_map))
+    post_ops = _statements(rewrite_operations(table.get("incrementalPostOps", []), self_map))
+
+    column_list = ", ".join(f"`{column}`" for column in columns)
+    unique_key = table.get("uniqueKey") or []
+    if unique_key:
+        conditions = [f"T.`{key}` = S.`{key}`" for key in unique_key]
+        update_partition_filter = table.get("bigquery", {}).get("updatePartitionFilter")
+        if update_partition_filter:
+            conditions.append(f"T.{update_partition_filter}")
+        updates = ", ".join(f"`{column}` = S.`{column}`" for column in columns)
+        statement = (
+            f"MERGE `{test_table}` T\n"
+            f"USING (SELECT * FROM (\n{query}\n) AS insertions) S\n"
+            f"ON {' AND '.join(conditions)}\n"
+            f"WHEN MATCHED THEN UPDATE SET {updates}\n"
+            f"WHEN NOT MATCHED THEN INSERT ({column_list}) VALUES ({column_list});"
+        )
+    else:
+        statement = f"INSERT INTO `{test_table}` ({column_list})\nSELECT {column_list} FROM (\n{query}\n);"
+
+    return f"BEGIN\n{pre_ops}\n{statement}\n{post_ops}\nEND;"
+
+
+def check_pruning(full_bytes: int, incremental_bytes: int, max_ratio: float) -> Optional[float]:
+    """
+    Return the ratio of incremental to full-refresh bytes if the incremental filter doesn't
+    prune: it scans more than `max_ratio` of what a full refresh scans. None otherwise.
+    """
+    if not full_bytes:
+        return None
+    ratio = incremental_bytes / full_bytes
+    return ratio if ratio > max_ratio else None
@@ -0,0 +1,200 @@
+"""
+Partition pruning and clustering analysis of the compiled Dataform graph.
+
+Every action is dry-run against the real upstream tables, once as compiled and once per
+partitioned input with that input replaced by a representative partition filter (the
+last N days, see sampling.build_partition_filter). The difference is what the action
+would save by pruning that input; inputs whose filter saves a large share of the bytes
+are reported as full scans. Clustered inputs whose clustering columns the query never
+filters or joins on are reported as well (dry runs don't account for clustering, so
+those have no byte estimate). Dry runs are free, nothing is created.
+
+Usage:
+    python src/tests/pruning_report.py [--days 7] [--top 20] [--output /tmp/pruning_report.json]
+"""
+import argparse
+import json
+import os, sys
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from google.cloud import bigquery
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from bq_client import CLIENT_CHOICES, create_client
+from dataform_graph import DataformGraph, target_key
+from formatting import format_bytes
+from sampling import build_partition_filter
+from sql_rewrite import rewrite_references
+
+# On-demand price per TiB processed, used to put a price on the savings
+DEFAULT_PRICE_PER_TIB = 6.25
+
+
+def dry_run_bytes(client, query: str) -> int:
+    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+    return client.query(query, job_config=job_config).total_bytes_processed or 0
+
+
+def load_inputs(client, graph: DataformGraph, keys: List[str], max_concurrency: int) -> Dict[str, Optional[object]]:
+    """Table metadata of every input read by the actions, None for inputs that can't be read."""
+    input_keys = sorted({dep for key in keys for dep in graph.upstream.get(key, [])})
+
+    def load(input_key: str):
+        try:
+            return input_key, client.get_table(input_key)
+        except Exception:
+            return input_key, None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(input_keys) or 1))) as executor:
+        return dict(executor.map(load, input_keys))
+
+
+def filters_on(query: str, column: str) -> bool:
+    """Whether a column is used in a WHERE, ON, USING or QUALIFY clause of the query (a heuristic)."""
+    # The condition ends at the next clause, so columns of later SELECT lists don't count
+    pattern = rf"\b(?:WHERE|ON|USING|QUALIFY)\b(?:(?!\b(?:SELECT|FROM|GROUP|ORDER|UNION|LIMIT)\b)[^;])*?\b{re.escape(column)}\b"
+    return re.search(pattern, query, re.IGNORECASE | re.DOTALL) is not None
+
+
+def analyze_action(client, action: Dict, inputs: Dict[str, Optional[object]], upstream: List[str], days: int,
+                   min_savings_ratio: float) -> Dict:
+    """
+    Dry-run one action as compiled and with a partition filter on each partitioned input.
+
+    Returns:
+        Dict: {"action", "bytes", "inputs": [{"input", "filter", "bytes", "savings", "full_scan"}],
+        "unused_clustering": [{"input", "columns"}], "error"}.
+    """
+    key = target_key(action.get("target", {}))
+    query = action.get("query", "")
+    result = {"action": key, "bytes": None, "inputs": [], "unused_clustering": [], "error": None}
+    try:
+        result["bytes"] = dry_run_bytes(client, query)
+    except Exception as e:
+        result["error"] = str(e).split("\n")[0]
+        return result
+
+    for input_key in upstream:
+        table_meta = inputs.get(input_key)
+        if table_meta is None or getattr(table_meta, "table_type", "TABLE") != "TABLE":
+            continue
+
+        clustering_fields = getattr(table_meta, "clustering_fields", None) or []
+        unused = [column for column in clustering_fields if not filters_on(query, column)]
+        if clustering_fields and len(unused) == len(clustering_fields):
+            result["unused_clustering"].append({"input": input_key, "columns": clustering_fields})
+
+        partition_filter = build_partition_filter(table_meta, days)
+        if not partition_filter:
+            continue
+        filtered_query = rewrite_references(query, {
+            input_key: {"test_table": input_key, "sql": f"(SELECT * FROM `{input_key}` WHERE {partition_filter})"}
+        })
+        try:
+            filtered_bytes = dry_run_bytes(client, filtered_query)
+        except Exception as e:
+            print(f"Could not dry-run {key} with a filter on {input_key}: {str(e).splitlines()[0] if str(e) else e}")
+            continue
+        savings = max(0, result["bytes"] - filtered_bytes)
+        result["inputs"].append({
+            "input": input_key,
+            "filter": partition_filter,
+            "bytes": filtered_bytes,
+            "savings": savings,
+            "full_scan": bool(result["bytes"]) and savings / result["bytes"] >= min_savings_ratio,
+        })
+    return result
+
+
+def analyze_graph(client, graph: DataformGraph, days: int = 7, min_savings_ratio: float = 0.2,
+                  max_concurrency: int = 32) -> List[Dict]:
+    """Analyze every table and assertion of the graph concurrently, see analyze_action."""
+    keys = [key for key in graph.keys_of_type("tables") + graph.keys_of_type("assertions") if graph.get(key).get("query")]
+    inputs = load_inputs(client, graph, keys, max_concurrency)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(keys) or 1))) as executor:
+        return list(executor.map(
+            lambda key: analyze_action(client, graph.get(key), inputs, graph.upstream.get(key, []), days, min_savings_ratio),
+            keys,
+        ))
+
+
+def print_report(results: List[Dict], top_n: int, price_per_tib: float) -> List[Dict]:
+    """Print the full scans ranked by estimated savings and return them."""
+    full_scans = sorted(
+        ({"action": result["action"], "action_bytes": result["bytes"], **entry}
+         for result in results for entry in result["inputs"] if entry["full_scan"]),
+        key=lambda entry: entry["savings"], reverse=True,
+    )
+    total_savings = sum(entry["savings"] for entry in full_scans)
+    print(f"\nFull scans of partitioned inputs (top {min(top_n, len(full_scans))} of {len(full_scans)}):")
+    print(f"  {'now':>10}  {'filtered':>10}  {'savings':>10}  {'$/run':>7}  action <- input")
+    for entry in full_scans[:top_n]:
+        price = entry["savings"] / 1024 ** 4 * price_per_tib
+        print(f"  {format_bytes(entry['action_bytes']):>10}  {format_bytes(entry['bytes']):>10}  "
+              f"{format_bytes(entry['savings']):>10}  {price:>7.2f}  {entry['action']} <- {entry['input']}")
+    print(f"  Estimated savings: {format_bytes(total_savings)} (${total_savings / 1024 ** 4 * price_per_tib:.2f}) per run")
+
+    for entry in full_scans[:top_n]:
+        print(f"::warning::{entry['action']} doesn't prune {entry['input']}: a filter like {entry['filter']} "
+              f"would save {format_bytes(entry['savings'])} of {format_bytes(entry['action_bytes'])}")  # GitHub CI warning annotation
+
+    unused_clustering = [(result["action"], entry) for result in results for entry in result["unused_clustering"]]
+    if unused_clustering:
+        print(f"\nClustered inputs never filtered on their clustering columns ({len(unused_clustering)}):")
+        for action_key, entry in unused_clustering[:top_n]:
+            print(f"  {action_key} <- {entry['input']} (clustered by {', '.join(entry['columns'])})")
+
+    failed = [result for result in results if result["error"]]
+    if failed:
+        print(f"\n{len(failed)} actions could not be dry-run (e.g. their inputs don't exist yet):")
+        for result in failed[:top_n]:
+            print(f"  {result['action']}: {result['error']}")
+    return full_scans
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--graph", default="src/tests/compiled_queries/result.json",
+                        help="Compiled Dataform graph to analyze.")
+    parser.add_argument("--config", default="src/config.json", help="General configuration file.")
+    parser.add_argument("--days", type=int, default=None,
+                        help="Partition window of the representative filter (default: schema_test.pruning.days, else 7).")
+    parser.add_argument("--top", type=int, default=None, help="Number of entries in the report (default 20).")
+    parser.add_argument("--output", default=None,
+                        help="JSON report path (default: schema_test.pruning.report_path, else /tmp/pruning_report.json).")
+    parser.add_argument("--client", default=None,
+                        help=f"BigQuery client: {' or '.join(CLIENT_CHOICES)}, or module:factory (default: $BQ_CLIENT, else bigquery).")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        with open(args.config, "r") as f:
+            test_config = json.load(f).get("schema_test", {})
+    except (FileNotFoundError, json.JSONDecodeError):
+        test_config = {}
+    pruning_config = test_config.get("pruning", {})
+    days = args.days if args.days is not None else pruning_config.get("days", 7)
+    top_n = args.top or pruning_config.get("top", 20)
+
+    graph = DataformGraph.load(args.graph)
+    client = create_client(args.client)
+    print(f"Analyzing partition pruning of {len(graph)} actions with a {days} day window...")
+    results = analyze_graph(
+        client, graph, days,
+        min_savings_ratio=pruning_config.get("min_savings_ratio", 0.2),
+        max_concurrency=test_config.get("dry_run_concurrency", 32),
+    )
+    full_scans = print_report(results, top_n, pruning_config.get("price_per_tib", DEFAULT_PRICE_PER_TIB))
+
+    output = args.output or pruning_config.get("report_path", "/tmp/pruning_report.json")
+    with open(output, "w") as f:
+        json.dump({"days": days, "full_scans": full_scans, "actions": results}, f, indent=2)
+    print(f"Pruning report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
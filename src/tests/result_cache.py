@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+# Fields of a compiled action that determine what its test build produces
+ACTION_HASH_FIELDS = (
+    "type", "query", "incrementalQuery", "preOps", "postOps",
+    "incrementalPreOps", "incrementalPostOps", "bigquery", "uniqueKey",
+)
+
+CACHE_VERSION = 1
+
+
+def hash_value(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def compute_action_key(table: Dict, upstream_hashes: Iterable[str], mode: str = "build") -> str:
+    """
+    Content hash of one action: its compiled SQL and settings plus the hashes of its inputs.
+
+    Upstream hashes are the cache keys of upstream actions built in the same run, or a hash
+    of the current schema for upstream tables read as they are. References to test tables
+    are deliberately not part of the key: their names are random per run, the upstream
+    hashes already describe what they contain.
+    """
+    content = {field: table.get(field) for field in ACTION_HASH_FIELDS if table.get(field) is not None}
+    return hash_value({"mode": mode, "action": content, "upstream": sorted(upstream_hashes)})
+
+
+class ResultCache:
+    """
+    Persistent, content-addressed cache of test results, stored as a local JSON file.
+
+    Each entry maps an action key (see `compute_action_key`) to the result of the action:
+    the test table it created (kept alive while the entry is valid), its output schema and,
+    in dry-run mode, the bytes processed. Entries expire after `ttl_seconds`; when there are
+    more than `max_entries`, the least recently used ones are evicted first.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 24 * 3600, max_entries: int = 1000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> "ResultCache":
+        try:
+            with open(self.path, "r") as f:
+                content = json.load(f)
+            if content.get("version") == CACHE_VERSION:
+                self.entries = content.get("entries", {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+        return self
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with self._lock:
+            with open(temp_path, "w") as f:
+                json.dump({"version": CACHE_VERSION, "entries": self.entries}, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    def _expired(self, entry: Dict, now: float) -> bool:
+        return now - entry.get("created_at", 0) > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the entry for `key` if present and not expired, and mark it as used."""
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or self._expired(entry, now):
+                self.misses += 1
+                return None
+            entry["last_used"] = now
+            self.hits += 1
+            return dict(entry)
+
+    def put(self, key: str, action: str, schema: Dict[str, str], test_table: str = None, total_bytes: int = None):
+        now = time.time()
+        with self._lock:
+            self.entries[key] = {
+                "action": action,
+                "test_table": test_table,
+                "schema": schema,
+                "total_bytes": total_bytes,
+                "created_at": now,
+                "last_used": now,
+            }
+
+    def discard(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            return self.entries.pop(key, None)
+
+    def kept_tables(self) -> List[str]:
+        """Test tables referenced by valid entries; these must survive the end-of-run cleanup."""
+        with self._lock:
+            return [entry["test_table"] for entry in self.entries.values() if entry.get("test_table")]
+
+    def evict(self) -> List[Dict]:
+        """Remove expired entries, then the least recently used ones above `max_entries`."""
+        now = time.time()
+        with self._lock:
+            evicted_keys = [key for key, entry in self.entries.items() if self._expired(entry, now)]
+            expired = set(evicted_keys)
+            remaining = sorted(
+                (key for key in self.entries if key not in expired),
+                key=lambda key: self.entries[key].get("last_used", 0),
+            )
+            overflow = len(remaining) - self.max_entries
+            if overflow > 0:
+                evicted_keys.extend(remaining[:overflow])
+            return [self.entries.pop(key) for key in evicted_keys]
@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+from dataform_graph import DataformGraph
+from result_cache import hash_value
+
+# Defaults for the "sampling" section of the schema_test configuration
+DEFAULT_SAMPLING = {
+    "strategy": "inline",  # "inline": sampled subquery, "table": sampled copy created once per source
+    "percent": 1,  # TABLESAMPLE SYSTEM percentage, 100 disables sampling
+    "days": 7,  # Partition window for partitioned sources, 0 disables the filter
+    "sample_dataset": None,  # "project.dataset" for the "table" strategy, default: the source dataset
+    "expiration_hours": 24,  # Expiration of sampled copies created by the "table" strategy
+}
+
+
+def get_source_settings(sampling_config: Dict, source_id: str) -> Dict:
+    """Merge the defaults, the global sampling settings and the overrides for one source."""
+    settings = dict(DEFAULT_SAMPLING)
+    settings.update({key: value for key, value in sampling_config.items() if key != "sources"})
+    settings.update(sampling_config.get("sources", {}).get(source_id, {}))
+    return settings
+
+
+def build_partition_filter(table_meta, days: int, partition_column: Optional[str] = None) -> str:
+    """
+    Build a WHERE condition keeping the last `days` days of a partitioned source.
+
+    The partition column and its type come from the table metadata unless `partition_column`
+    is configured. Returns an empty string for unpartitioned sources or when `days` is 0.
+    """
+    if not days:
+        return ""
+    time_partitioning = getattr(table_meta, "time_partitioning", None)
+    column = partition_column or (time_partitioning.field if time_partitioning else None)
+    if not column:
+        if time_partitioning:
+            # Ingestion-time partitioned table
+            return f"_PARTITIONTIME >= TIMESTAMP(DATE_SUB(CURRENT_DATE(), INTERVAL {int(days)} DAY))"
+        return ""
+
+    column_type = next((field.field_type for field in table_meta.schema if field.name == column), "DATE")
+    if column_type == "TIMESTAMP":
+        return f"`{column}` >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {int(days)} DAY)"
+    if column_type == "DATETIME":
+        return f"`{column}` >= DATETIME_SUB(CURRENT_DATETIME(), INTERVAL {int(days)} DAY)"
+    return f"`{column}` >= DATE_SUB(CURRENT_DATE(), INTERVAL {int(days)} DAY)"
+
+
+def build_sample_query(source_id: str, table_meta, settings: Dict) -> str:
+    """Build the SELECT reading a sample of a source: TABLESAMPLE for tables plus the partition window."""
+    sql = f"SELECT * FROM `{source_id}`"
+    percent = settings.get("percent", 100)
+    # TABLESAMPLE only works on tables, not on views or external tables
+    if percent and percent < 100 and getattr(table_meta, "table_type", "TABLE") == "TABLE":
+        sql += f" TABLESAMPLE SYSTEM ({percent} PERCENT)"
+    partition_filter = build_partition_filter(table_meta, settings.get("days", 0), settings.get("partition_column"))
+    if partition_filter:
+        sql += f" WHERE {partition_filter}"
+    return sql
+
+
+def sampled_sources(graph: DataformGraph, keys: Iterable[str]) -> Dict[str, Dict]:
+    """Return the declaration targets read by the selected actions, keyed by table id."""
+    sources = {}
+    for key in keys:
+        for dep_key in graph.upstream.get(key, []):
+            if graph.type_of(dep_key) == "declarations":
+                sources[dep_key] = graph.targets[dep_key]
+    return sources
+
+
+def prepare_samples(client, graph: DataformGraph, keys: Iterable[str], sampling_config: Dict,
+                    generate_suffix, max_concurrency: int = 8) -> Dict[str, Dict[str, str]]:
+    """
+    Prepare sampled versions of every declaration source read by the selected actions.
+
+    The result has the format of `test_table_map`, so the reference rewriting sends every
+    read of a source to its sample while the DAG itself is unchanged:
+        - "inline" strategy: {"test_table": source, "sql": "(SELECT ... TABLESAMPLE ...)"}
+        - "table" strategy: {"test_table": sampled copy, "created": True}
+    Each entry also has a "hash" of the sample definition for the result cache.
+    """
+    sources = sampled_sources(graph, keys)
+
+    def prepare(source_id: str):
+        settings = get_source_settings(sampling_config, source_id)
+        try:
+            table_meta = client.get_table(source_id)
+        except Exception as e:
+            print(f"Sampling disabled for {source_id}: {e}")
+            return source_id, None
+
+        sample_query = build_sample_query(source_id, table_meta, settings)
+        entry_hash = hash_value({
+            "sample": sample_query,
+            "schema": [(field.name, field.field_type, field.mode) for field in table_meta.schema],
+        })
+        if sample_query == f"SELECT * FROM `{source_id}`":
+            return source_id, None  # Nothing to sample
+
+        if settings["strategy"] == "table":
+            source = sources[source_id]
+            sample_dataset = settings.get("sample_dataset") or f"{source['database']}.{source['schema']}"
+            sample_table = f"{sample_dataset}.{source['name']}_sample_{generate_suffix()}"
+            print(f"Creating sampled copy {sample_table} of {source_id}")
+            try:
+                client.query(
+                    f"CREATE TABLE `{sample_table}`\n"
+                    f"OPTIONS(expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL {int(settings['expiration_hours'])} HOUR))\n"
+                    f"AS {sample_query}"
+                ).result()
+            except Exception as e:
+                print(f"Sampling disabled for {source_id}, could not create {sample_table}: {e}")
+                return source_id, None
+            return source_id, {"test_table": sample_table, "hash": entry_hash, "created": True}
+
+        print(f"Sampling {source_id}: {sample_query}")
+        return source_id, {"test_table": source_id, "sql": f"({sample_query})", "hash": entry_hash}
+
+    samples = {}
+    if not sources:
+        return samples
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(sources)))) as executor:
+        for source_id, entry in executor.map(prepare, list(sources)):
+            if entry:
+                samples[source_id] = entry
+    return samples
@@ -0,0 +1,119 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from dataform_graph import DataformGraph
+
+
+def run_dag(graph: DataformGraph, run_table: Callable[[Dict], bool], max_concurrency: int = 8,
+            keys: Optional[Iterable[str]] = None, on_done: Optional[Callable[[str, str], None]] = None,
+            packable: Optional[Set[str]] = None, run_pack: Optional[Callable[[List[Dict]], Dict[str, bool]]] = None,
+            max_pack_size: int = 20) -> Dict[str, str]:
+    """
+    Run every selected action as soon as all of its upstream actions are done.
+
+    This is a topological sort (Kahn's algorithm) driven by completion events: all actions
+    without pending dependencies are submitted to a thread pool of `max_concurrency`
+    workers, so independent branches of the DAG run at the same time. `run_table` is
+    called from the worker threads and must return True on success. When an action fails,
+    its whole downstream subtree is skipped.
+
+    With `run_pack`, actions of `packable` that are ready at the same time (so independent
+    of each other) are handed over together, up to `max_pack_size` per call, and take a
+    single worker. `run_pack` returns the success of every action it was given.
+
+    Only dependencies between selected actions block; anything outside the selection
+    (declarations, operations) is assumed to already exist in BigQuery.
+
+    Args:
+        graph (DataformGraph): The indexed compiled graph.
+        run_table (Callable[[Dict], bool]): Function testing a single action.
+        max_concurrency (int): Maximum number of actions (or packs) processed at the same time.
+        keys (Iterable[str], optional): Actions to run. Defaults to all compiled tables.
+        on_done (Callable[[str, str], None], optional): Called with the key and final status of
+            every action as soon as it is known, from the scheduling thread.
+        packable (Set[str], optional): Actions that may be run together by `run_pack`.
+        run_pack (Callable[[List[Dict]], Dict[str, bool]], optional): Function testing several actions.
+        max_pack_size (int): Maximum number of actions per `run_pack` call.
+
+    Returns:
+        Dict[str, str]: Final status per key ("success", "failed", "skipped" or "cycle").
+    """
+    selected = graph.keys_of_type("tables") if keys is None else [key for key in keys if key in graph]
+    selected_set = set(selected)
+    pending_dependencies = {
+        key: sum(1 for dep in graph.upstream[key] if dep in selected_set) for key in selected
+    }
+    status = {}
+    max_concurrency = max(1, max_concurrency)
+    packable = packable if run_pack is not None and max_pack_size > 1 else set()
+
+    # Keep the order of the compiled JSON for actions that are ready at the same time
+    ready = deque(key for key in selected if pending_dependencies[key] == 0)
+    running = {}
+
+    def take_pack(first_key: str) -> List[str]:
+        pack = [first_key]
+        for key in list(ready):
+            if len(pack) >= max_pack_size:
+                break
+            if key in packable:
+                ready.remove(key)
+                pack.append(key)
+        return pack
+
+    def complete(key: str, succeeded: bool):
+        status[key] = "success" if succeeded else "failed"
+        if on_done:
+            on_done(key, status[key])
+
+        if not succeeded:
+            # Stop the whole subtree below a failed action
+            for descendant in graph.descendants([key]):
+                if descendant in selected_set and descendant not in status:
+                    status[descendant] = "skipped"
+                    print(f"Skipping table {descendant}: upstream table {key} failed")
+                    if on_done:
+                        on_done(descendant, "skipped")
+            return
+
+        for dependent in graph.downstream[key]:
+            if dependent not in pending_dependencies:
+                continue
+            pending_dependencies[dependent] -= 1
+            if pending_dependencies[dependent] == 0 and dependent not in status:
+                ready.append(dependent)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        while ready or running:
+            while ready and len(running) < max_concurrency:
+                key = ready.popleft()
+                pack = take_pack(key) if key in packable else [key]
+                if len(pack) > 1:
+                    running[executor.submit(run_pack, [graph.get(pack_key) for pack_key in pack])] = pack
+                else:
+                    running[executor.submit(run_table, graph.get(key))] = pack
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                pack = running.pop(future)
+                try:
+                    result = future.result()
+                    results = result if len(pack) > 1 else {pack[0]: result}
+                except Exception as e:
+                    print(f"Error processing {', '.join(pack)}: {e}")
+                    results = {}
+
+                for key in pack:
+                    # A descendant of a failed action of the same pack can't be in it, packs are independent
+                    if key not in status:
+                        complete(key, bool(results.get(key)))
+
+    # Anything left was never ready, which only happens for dependency cycles
+    for key in selected:
+        if key not in status:
+            status[key] = "cycle"
+            if on_done:
+                on_done(key, "cycle")
+
+    return status
@@ -0,0 +1,164 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from google.api_core.exceptions import NotFound
+
+# GoogleSQL type names (INFORMATION_SCHEMA) mapped to the legacy names of the tables API
+SQL_TO_LEGACY_TYPES = {
+    "INT64": "INTEGER",
+    "FLOAT64": "FLOAT",
+    "BOOL": "BOOLEAN",
+    "STRUCT": "RECORD",
+}
+
+_TYPE_TOKEN_PATTERN = re.compile(r"\s*(`[^`]+`|[A-Za-z_][A-Za-z0-9_]*|\d+|[<>(),])")
+
+
+def normalize_type(field_type: str) -> str:
+    """Return the legacy type name for a GoogleSQL or legacy type name."""
+    field_type = (field_type or "").upper()
+    return SQL_TO_LEGACY_TYPES.get(field_type, field_type)
+
+
+def describe_field(field_type: str, mode: Optional[str] = None) -> str:
+    """Build the type description used in schema dicts: the type, plus the mode unless NULLABLE."""
+    mode = (mode or "NULLABLE").upper()
+    return normalize_type(field_type) if mode == "NULLABLE" else f"{normalize_type(field_type)} {mode}"
+
+
+def flatten_schema(schema, prefix: str = "") -> Dict[str, str]:
+    """
+    Flatten a list of BigQuery SchemaFields to {column path: type description}.
+
+    Nested RECORD fields are listed with their dotted path ("address.city") so that
+    schema changes inside records are reported like top-level ones.
+    """
+    columns = {}
+    for field in schema or []:
+        path = f"{prefix}{field.name}"
+        columns[path] = describe_field(field.field_type, field.mode)
+        if field.fields:
+            columns.update(flatten_schema(field.fields, prefix=f"{path}."))
+    return columns
+
+
+def flatten_sql_type(name: str, data_type: str, nullable: bool = True) -> Dict[str, str]:
+    """
+    Flatten a column of INFORMATION_SCHEMA.COLUMNS to {column path: type description}.
+
+    `data_type` is a GoogleSQL type such as "ARRAY<STRUCT<city STRING, zip INT64 NOT NULL>>".
+    Arrays become REPEATED fields and structs RECORD fields, matching `flatten_schema`.
+    """
+    tokens = _TYPE_TOKEN_PATTERN.findall(data_type or "")
+    columns = {}
+    _parse_field(tokens, 0, name, "NULLABLE" if nullable else "REQUIRED", columns)
+    return columns
+
+
+def _parse_field(tokens: List[str], position: int, path: str, mode: str, columns: Dict[str, str]) -> int:
+    """Parse one type starting at `position`, add it (and nested fields) to `columns`, return the next position."""
+    type_name = tokens[position].upper()
+    position += 1
+
+    if type_name == "ARRAY":
+        # ARRAY<element>: the element type becomes a REPEATED field
+        return _expect(tokens, _parse_field(tokens, position + 1, path, "REPEATED", columns), ">")
+
+    if type_name == "STRUCT":
+        columns[path] = describe_field("RECORD", mode)
+        position += 1  # "<"
+        while tokens[position] != ">":
+            field_name = tokens[position].strip("`")
+            position = _parse_field(tokens, position + 1, f"{path}.{field_name}", "NULLABLE", columns)
+            if tokens[position] == ",":
+                position += 1
+        return position + 1
+
+    # Skip type parameters like STRING(10), NUMERIC(10, 2) or RANGE<DATE>
+    if position < len(tokens) and tokens[position] in ("(", "<"):
+        closing = ")" if tokens[position] == "(" else ">"
+        depth = 0
+        while position < len(tokens):
+            if tokens[position] in ("(", "<"):
+                depth += 1
+            elif tokens[position] in (")", ">"):
+                depth -= 1
+                if depth == 0 and tokens[position] == closing:
+                    position += 1
+                    break
+            position += 1
+
+    if position + 1 < len(tokens) and tokens[position].upper() == "NOT" and tokens[position + 1].upper() == "NULL":
+        mode = "REQUIRED" if mode == "NULLABLE" else mode
+        position += 2
+
+    columns[path] = describe_field(type_name, mode)
+    return position
+
+
+def _expect(tokens: List[str], position: int, token: str) -> int:
+    return position + 1 if position < len(tokens) and tokens[position] == token else position
+
+
+class SchemaCatalog:
+    """
+    Run-wide cache of table schemas, loaded per dataset from INFORMATION_SCHEMA.COLUMNS.
+
+    The first lookup in a dataset loads the columns of all its tables and views with a
+    single query; every later lookup in that dataset is answered from memory. Datasets
+    are loaded at most once, also when several worker threads ask at the same time.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._datasets: Dict[Tuple[str, str], Dict[str, Dict[str, str]]] = {}
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def _dataset_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def load_dataset(self, project_id: str, dataset_id: str) -> Dict[str, Dict[str, str]]:
+        """Return {table name: flattened schema} for a dataset, querying it on first use."""
+        key = (project_id, dataset_id)
+        if key in self._datasets:
+            return self._datasets[key]
+
+        with self._dataset_lock(key):
+            if key in self._datasets:
+                return self._datasets[key]
+
+            query = f"""
+            SELECT table_name, column_name, is_nullable, data_type
+            FROM `{project_id}.{dataset_id}`.INFORMATION_SCHEMA.COLUMNS
+            ORDER BY table_name, ordinal_position
+            """
+            tables = {}
+            try:
+                for row in self.client.query(query).result():
+                    tables.setdefault(row.table_name, {}).update(
+                        flatten_sql_type(row.column_name, row.data_type, row.is_nullable != "NO")
+                    )
+            except NotFound:
+                pass  # The dataset doesn't exist yet, so none of its tables do
+
+            self._datasets[key] = tables
+            return tables
+
+    def prefetch(self, datasets: Iterable[Tuple[str, str]], max_concurrency: int = 8):
+        """Load several datasets concurrently, one INFORMATION_SCHEMA query each."""
+        datasets = [key for key in set(datasets) if key not in self._datasets]
+        if not datasets:
+            return
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(datasets)))) as executor:
+            list(executor.map(lambda key: self.load_dataset(*key), datasets))
+
+    def get_schema(self, project_id: str, dataset_id: str, table_id: str) -> Dict[str, str]:
+        """Return the flattened schema of a table, or an empty dict if it doesn't exist."""
+        return dict(self.load_dataset(project_id, dataset_id).get(table_id, {}))
+
+    def table_exists(self, project_id: str, dataset_id: str, table_id: str) -> bool:
+        return table_id in self.load_dataset(project_id, dataset_id)
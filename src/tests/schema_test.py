@@ -1,12 +1,34 @@
+import argparse
 import json
 import os, sys
+import threading
 import time
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from google.cloud import bigquery
-from typing import List, Dict, Set
+from typing import List, Dict
 from google.api_core.exceptions import NotFound
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from bq_client import CLIENT_CHOICES, create_client
+from formatting import format_bytes
+from job_telemetry import JobRecorder, RecordingClient, job_action
+from action_packing import build_pack_script, load_output_schemas, record_child_jobs, select_packable
+from assertion_batches import AssertionBatcher, unique_key_assertions
+from change_detection import get_changed_files, map_changed_files_to_actions, select_actions
+from compile_graph import DEFAULT_GRAPH_PATH, ENVIRONMENTS, CompileError, load_compile_config, prepare_graph
+from dataform_graph import DataformGraph, target_key
+from incremental_merge import INCREMENTAL_MODES, build_incremental_script, check_pruning, builds_both_paths
+from result_cache import ResultCache, compute_action_key, hash_value
+from sampling import prepare_samples
+from schema_catalog import SchemaCatalog, flatten_schema
+from scheduler import run_dag
+from sql_preflight import ERROR, format_finding, preflight_graph
+from sql_rewrite import rewrite_operations, rewrite_references
+from table_cleanup import drop_tables
 
 warning_messages = []
 error_messages = []
+incremental_reports = []  # Bytes of the full-refresh and incremental paths per incremental table
 
 def last_char_not_semicolon(input_string):
     # Remove all trailing whitespace, newlines, and tabs
@@ -44,27 +66,17 @@ def get_project_and_dataset_ids(json_path: str) -> List[Dict[str, str]]:
 def generate_temp_suffix() -> str:
     import random
     import string
-    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
+    # Starts with a letter, so the sweeper never mistakes a date shard (..._test_20240101) for a test table
+    return random.choice(string.ascii_lowercase) + ''.join(random.choices(string.ascii_lowercase + string.digits, k=7))
 
 # Function to build the SQL query for creating tables with partitioning and preOps
-def build_sql_query(table: Dict, test_table_map: Dict[str, Dict[str, str]]) -> str:
+def build_sql_query(table: Dict, test_table_map: Dict[str, Dict[str, str]], expiration_hours: int = None) -> str:
     target = table.get("target", {})
-    query = table.get("query", "")
-    pre_ops = table.get("preOps", [])
-    post_ops = table.get("postOps", [])
-    incremental_query = table.get("incrementalQuery", "")
-    incremental_pre_ops = table.get("incrementalPreOps", [])
-    incremental_post_ops = table.get("incrementalpostOps", [])
-
-    # Replace table references in the query with test table names if available
-    for original_table, test_versions in test_table_map.items():
-        original_query_table = f"`{original_table}`"
-        test_query_table = f"`{test_versions['test_table']}`"
-        
-        if query:
-            query = query.replace(original_query_table, test_query_table)
-        if incremental_query:
-            incremental_query = incremental_query.replace(original_query_table, test_query_table)
+    # Replace table references with test table names if available, one pass per SQL string
+    query = rewrite_references(table.get("query", ""), test_table_map)
+    pre_ops = rewrite_operations(table.get("preOps", []), test_table_map)
+    incremental_query = rewrite_references(table.get("incrementalQuery", ""), test_table_map)
+    incremental_pre_ops = rewrite_operations(table.get("incrementalPreOps", []), test_table_map)
 
     # Generate different random suffixes for temp tables
     temp_suffix_sql = generate_temp_suffix()  # Suffix for SQL query
@@ -73,6 +85,13 @@ def build_sql_query(table: Dict, test_table_map: Dict[str, Dict[str, str]]) -> s
     temp_table_name_sql = f"{target['name']}_test_{temp_suffix_sql}"
     temp_table_name_incremental = f"{target['name']}_test_{temp_suffix_incremental}"
 
+    # Post operations run after the test table exists, so references to the table itself point to it
+    table_id = f"{target['database']}.{target['schema']}.{target['name']}"
+    post_ops = rewrite_operations(table.get("postOps", []), ChainMap(
+        {table_id: {"test_table": f"{target['database']}.{target['schema']}.{temp_table_name_sql}"}}, test_table_map))
+    incremental_post_ops = rewrite_operations(table.get("incrementalPostOps", []), ChainMap(
+        {table_id: {"test_table": f"{target['database']}.{target['schema']}.{temp_table_name_incremental}"}}, test_table_map))
+
     # Generate the 'CREATE TABLE' clause for both queries
     create_table_clause_sql = f"CREATE TABLE `{target['database']}.{target['schema']}.{temp_table_name_sql}`"
     create_table_clause_incremental = f"CREATE TABLE `{target['database']}.{target['schema']}.{temp_table_name_incremental}`"
@@ -84,6 +103,12 @@ def build_sql_query(table: Dict, test_table_map: Dict[str, Dict[str, str]]) -> s
         create_table_clause_sql = f"{create_table_clause_sql} {partition_clause}"
         create_table_clause_incremental = f"{create_table_clause_incremental} {partition_clause}"
 
+    # Test tables expire on their own, so a run killed before its cleanup leaves nothing behind
+    if expiration_hours:
+        options_clause = f"OPTIONS(expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL {int(expiration_hours)} HOUR))"
+        create_table_clause_sql = f"{create_table_clause_sql}\n{options_clause}"
+        create_table_clause_incremental = f"{create_table_clause_incremental}\n{options_clause}"
+
     pre_ops_str = ""
     post_ops_str = ""
     sql_query = ""
@@ -155,7 +180,7 @@ def is_schema_altering(query: str) -> bool:
 def get_current_schema(client: bigquery.Client, project_id: str, dataset_id: str, table_id: str):
     try:
         table_ref = client.get_table(f"{project_id}.{dataset_id}.{table_id}")
-        return {field.name: field.field_type for field in table_ref.schema}  # Return a dict with column names and types
+        return flatten_schema(table_ref.schema)  # Return a dict with column paths and types
     except NotFound:
         return {}  # Return an empty dictionary if the table doesn't exist
 
@@ -167,11 +192,14 @@ def table_exists(client: bigquery.Client, project_id: str, dataset_id: str, tabl
     except NotFound:
         return False
 
+# Function to perform a dry run, the returned job holds the output schema and bytes processed
+def dry_run_query(client: bigquery.Client, query: str) -> bigquery.QueryJob:
+    job_config = bigquery.QueryJobConfig(dry_run=True, use_legacy_sql=False)  # Enable dry run
+    return client.query(query, job_config=job_config)
+
 # Function to perform a dry run and get the estimated size of the query
 def get_query_size_estimate(client: bigquery.Client, query: str) -> int:
-    job_config = bigquery.QueryJobConfig(dry_run=True, use_legacy_sql=False)  # Enable dry run
-    dry_run_job = client.query(query, job_config=job_config)
-    return dry_run_job.total_bytes_processed
+    return dry_run_query(client, query).total_bytes_processed
 
 # Function to compare schemas and identify added, dropped, or type-changed columns
 # Function to compare schemas and identify added, dropped, or type-changed columns
@@ -216,145 +244,642 @@ def compare_schemas(schema_before: Dict[str, str], schema_after: Dict[str, str],
         warning_messages.append(warning_message)
         print(f"::warning::{warning_message}")  # GitHub CI warning annotation
 
-def store_test_tables(test_tables_file: str, created_tables: List[str]):
-    """
-    Store the created test tables into a JSON file for later use.
-
-    Args:
-        test_tables_file (str): Path to the file where test tables will be stored.
-        created_tables (List[str]): List of created test table names.
-    """
-    try:
-        # Load existing data from the file if it exists
-        if os.path.exists(test_tables_file):
-            with open(test_tables_file, "r") as f:
-                existing_tables = json.load(f)
+# Function to collect the hashes of the inputs of an action for the result cache
+def get_upstream_hashes(table: Dict, test_table_map: Dict[str, Dict[str, str]], state_lock: threading.Lock, catalog: SchemaCatalog) -> List[str]:
+    # Upstream actions built in this run are described by their own cache key,
+    # tables read as they are by a hash of their current schema
+    dependency_ids = [
+        f"{dep.get('database', '')}.{dep.get('schema', '')}.{dep.get('name', '')}"
+        for dep in table.get("dependencyTargets", [])
+    ]
+    with state_lock:
+        built_hashes = {dep_id: test_table_map[dep_id].get("hash") for dep_id in dependency_ids if dep_id in test_table_map}
+
+    upstream_hashes = []
+    for dep_id in dependency_ids:
+        if built_hashes.get(dep_id):
+            upstream_hashes.append(built_hashes[dep_id])
         else:
-            existing_tables = []
+            project_id, dataset_id, table_name = dep_id.split(".", 2)
+            upstream_hashes.append(hash_value({"table": dep_id, "schema": catalog.get_schema(project_id, dataset_id, table_name)}))
+    return upstream_hashes
 
-        # Merge new test tables with the existing ones
-        updated_tables = list(set(existing_tables + created_tables))
+def run_incremental_path(client, table, test_table: str, full_bytes: int, test_table_map: Dict[str, Dict[str, str]],
+                         state_lock: threading.Lock, max_prune_ratio: float = 0.9) -> bool:
+    """
+    Apply the incremental query of an action to its test table seeded by the full query.
 
-        # Save back to the file
-        with open(test_tables_file, "w") as f:
-            json.dump(updated_tables, f, indent=4)
+    The rows are merged on `uniqueKey` as Dataform does (see incremental_merge.py), into
+    the seeded table itself, so the incremental path is validated without building a
+    second table. The bytes processed by the merge are compared with those of the seed
+    (a full refresh), and a warning is raised when the incremental filter doesn't prune,
+    i.e. it processes more than `max_prune_ratio` of the full refresh.
 
-        print(f"Test tables successfully stored in {test_tables_file}.")
+    Returns:
+        bool: True if the incremental path ran successfully, False otherwise.
+    """
+    table_id = target_key(table.get("target", {}))
+    try:
+        columns = [field.name for field in client.get_table(test_table).schema]
+        with state_lock:
+            incremental_script = build_incremental_script(table, test_table, columns, test_table_map)
+        query_job = client.query(incremental_script)
+        query_job.result()
     except Exception as e:
-        print(f"Error storing test tables: {e}")
+        # Extract and clean the error message
+        error_message = f"Incremental path failed for {table_id}: {parse_error_message(e)}"
+        error_messages.append(error_message)
+        print(f"::error::{error_message}")  # GitHub CI error annotation
+        return False
+
+    incremental_bytes = query_job.total_bytes_processed or 0
+    ratio = check_pruning(full_bytes, incremental_bytes, max_prune_ratio)
+    incremental_reports.append({
+        "table": table_id,
+        "full_bytes": full_bytes,
+        "incremental_bytes": incremental_bytes,
+        "pruned": ratio is None,
+    })
+    print(f"    Incremental path: {format_bytes(incremental_bytes)} processed, full refresh: {format_bytes(full_bytes)}")
+    if ratio is not None:
+        warning_message = (f"Incremental filter of {table_id} doesn't prune: the incremental path processes "
+                           f"{format_bytes(incremental_bytes)}, {ratio:.0%} of a full refresh ({format_bytes(full_bytes)})")
+        warning_messages.append(warning_message)
+        print(f"::warning::{warning_message}")  # GitHub CI warning annotation
+    return True
+
+def print_incremental_report():
+    if not incremental_reports:
+        return
+    print("\nIncremental vs full refresh, bytes processed:")
+    print(f"  {'incremental':>12}  {'full refresh':>12}  table")
+    for report in sorted(incremental_reports, key=lambda report: report["incremental_bytes"], reverse=True):
+        print(f"  {format_bytes(report['incremental_bytes']):>12}  {format_bytes(report['full_bytes']):>12}  "
+              f"{report['table']}{'' if report['pruned'] else '  (not pruned)'}")
+
+def prepare_table(client, table, test_table_map: Dict[str, Dict[str, str]], state_lock: threading.Lock, catalog: SchemaCatalog,
+                  cache: ResultCache = None, expiration_hours: int = None, incremental_mode: str = "incremental") -> Dict:
+    """
+    Plan the build of a single table: read its schema, look it up in the cache and build its script.
 
+    A cache hit is applied right away (the cached test table is registered and the schemas
+    compared), nothing is left to run then.
 
-def process_table(client, table, processed_tables: set[str], data: Dict, created_tables: List[str], test_table_map: Dict[str, Dict[str, str]]):
+    Returns:
+        Dict: {"table_id", "schema_before", "cache_key", "query", "test_table", "both_paths"},
+        with "query" None when there is nothing to run.
+    """
     target = table.get("target", {})
     project_id = target.get("database", "")
     dataset_id = target.get("schema", "")
     table_name = target.get("name", "")
     table_id = f"{project_id}.{dataset_id}.{table_name}"
+    both_paths = builds_both_paths(table, incremental_mode)
+    plan = {"table_id": table_id, "schema_before": None, "cache_key": None, "query": None, "test_table": None,
+            "both_paths": both_paths}
+
+    # Capture the initial schema
+    plan["schema_before"] = catalog.get_schema(project_id, dataset_id, table_name)
+
+    if cache is not None:
+        mode = "build+incremental" if both_paths else "build"
+        plan["cache_key"] = compute_action_key(table, get_upstream_hashes(table, test_table_map, state_lock, catalog), mode)
+        cached = cache.get(plan["cache_key"])
+        if cached and cached.get("test_table"):
+            if catalog.table_exists(*cached["test_table"].split(".", 2)):
+                print(f"Reusing cached test table {cached['test_table']} for {table_id}")
+                with state_lock:
+                    test_table_map[table_id] = {"test_table": cached["test_table"], "hash": plan["cache_key"]}
+                compare_schemas(plan["schema_before"], cached["schema"], table_id)
+                return plan
+            # The test table is gone, build it again
+            cache.discard(plan["cache_key"])
+
+    # Build queries
+    with state_lock:
+        combined_query, combined_incremental_query, target_database, target_schema, temp_table_name_sql, temp_table_name_incremental = build_sql_query(table, test_table_map, expiration_hours)
+
+    # Skip combined_query if combined_incremental_query is available, unless both paths are tested
+    if combined_incremental_query and not both_paths:
+        plan["query"], temp_table_name = combined_incremental_query, temp_table_name_incremental
+    elif combined_query:
+        plan["query"], temp_table_name = combined_query, temp_table_name_sql
+    else:
+        return plan
+    plan["test_table"] = f"{target_database}.{target_schema}.{temp_table_name}"
+    return plan
+
+def finish_table(plan: Dict, succeeded: bool, schema_after: Dict[str, str], created_tables: List[str],
+                 test_table_map: Dict[str, Dict[str, str]], state_lock: threading.Lock, cache: ResultCache = None) -> bool:
+    """Register the test table of a planned build, compare its schema and cache the result if it succeeded."""
+    with state_lock:
+        # Add created tables to the cleanup list
+        created_tables.append(plan["test_table"])
+        # Store new test tables in the map
+        test_table_map[plan["table_id"]] = {
+            "test_table": plan["test_table"],
+            "hash": plan["cache_key"],
+        }
 
-    if table_id in processed_tables:
-        return  # Skip already processed tables
-
-    # Process dependencies first
-    dependencies = table.get("dependencyTargets", [])
-    for dependency in dependencies:
-        dep_table = next((t for t in data.get("tables", []) if t.get("target") == dependency), None)
-        if dep_table:
-            dep_table_id = f"{dependency['database']}.{dependency['schema']}.{dependency['name']}"
-            #print(f"Processing dependency table: {dep_table_id}")
-            process_table(client, dep_table, processed_tables, data, created_tables, test_table_map)
+    compare_schemas(plan["schema_before"], schema_after, plan["table_id"])
+    if succeeded and cache is not None:
+        cache.put(plan["cache_key"], plan["table_id"], schema_after, test_table=plan["test_table"])
+    return succeeded
 
+def run_planned_table(client, table, plan: Dict, created_tables: List[str], test_table_map: Dict[str, Dict[str, str]],
+                      state_lock: threading.Lock, cache: ResultCache = None, max_prune_ratio: float = 0.9) -> bool:
+    """Run the script of a planned build (see prepare_table) in its own job, then register its test table."""
+    succeeded = True
     try:
-        print(f"Processing table: {table_id}")
-        processed_tables.add(table_id)
+        # Submit the job and wait for it in this worker thread only
+        query_job = client.query(plan["query"])
+        query_job.result()
+    except Exception as e:
+        # Extract and clean the error message
+        error_message = parse_error_message(e)
+        error_messages.append(error_message)
+        print(f"::error::{error_message}")  # GitHub CI error annotation
+        succeeded = False
+
+    if succeeded and plan["both_paths"]:
+        # The seeded table is registered for cleanup below even if the merge fails
+        succeeded = run_incremental_path(client, table, plan["test_table"], query_job.total_bytes_processed or 0,
+                                         test_table_map, state_lock, max_prune_ratio)
+
+    schema_after = get_current_schema(client, *plan["test_table"].split(".", 2))
+    return finish_table(plan, succeeded, schema_after, created_tables, test_table_map, state_lock, cache)
+
+def process_table(client, table, created_tables: List[str], test_table_map: Dict[str, Dict[str, str]], state_lock: threading.Lock, catalog: SchemaCatalog, cache: ResultCache = None, expiration_hours: int = None,
+                  incremental_mode: str = "incremental", max_prune_ratio: float = 0.9) -> bool:
+    """
+    Build the test version of a single table and compare its schema with the current one.
 
-        # Capture the initial schema
-        schema_before = get_current_schema(client, project_id, dataset_id, table_name)
+    Called from the scheduler worker threads once every upstream table is done, so
+    `test_table_map` already holds the test tables of all dependencies. Shared state
+    (`created_tables`, `test_table_map`) is only touched while holding `state_lock`.
+    The schema before the change is read from the run-wide `catalog`.
 
-        # Build queries
-        #combined_query, combined_incremental_query, target_database, target_schema, temp_table_name_sql, temp_table_name_incremental = build_sql_query(table)
-        combined_query, combined_incremental_query, target_database, target_schema, temp_table_name_sql, temp_table_name_incremental = build_sql_query(table, test_table_map)
+    With a `cache`, an action whose SQL and inputs are unchanged since a previous run
+    reuses the test table and output schema recorded back then instead of running a job.
+    Test tables are created with an expiration of `expiration_hours`, if given.
 
-        # Skip combined_query if combined_incremental_query is available
-        if combined_incremental_query:
-            #print(f"Skipping combined query for {table_name} because incremental query is available.")
-            try:
-                query_job = client.query(combined_incremental_query)
-                query_job.result()  # Wait for query to complete
-                #print(f"Incremental query executed successfully for {table_name}")
-            except Exception as e:
-                # Extract and clean the error message
-                error_message = parse_error_message(e)
-                error_messages.append(error_message)
-                print(f"::error::{error_message}")  # GitHub CI error annotation
+    Incremental tables are built from their incremental query only, unless `incremental_mode`
+    is "both": the test table is then seeded from the full query (the full-refresh path) and
+    the incremental query is merged into it (see run_incremental_path).
+
+    Returns:
+        bool: True if the table was built successfully, False otherwise.
+    """
+    target = table.get("target", {})
+    table_name = target.get("name", "")
+
+    try:
+        print(f"Processing table: {target_key(target)}")
+        plan = prepare_table(client, table, test_table_map, state_lock, catalog, cache, expiration_hours, incremental_mode)
+        if plan["query"] is None:
+            return True
+        return run_planned_table(client, table, plan, created_tables, test_table_map, state_lock, cache, max_prune_ratio)
+
+    except Exception as e:
+        print(f"Error processing table {table_name}: {e}")
+        return False
+
+def process_pack(client, tables: List[Dict], created_tables: List[str], test_table_map: Dict[str, Dict[str, str]], state_lock: threading.Lock, catalog: SchemaCatalog, cache: ResultCache = None, expiration_hours: int = None,
+                 incremental_mode: str = "incremental") -> Dict[str, bool]:
+    """
+    Build several independent, cheap tables with a single script job (see action_packing.py).
 
+    Each table is planned like in process_table, then all their scripts run in one job,
+    each in a block with its own error handler, so one failing table doesn't stop the
+    others and its error is reported under its name. The child jobs of the script are
+    recorded per table, and the output schemas are read back with one query per dataset.
+    If the script fails as a whole (e.g. it doesn't parse), the planned scripts run one by one.
 
-            schema_after = get_current_schema(client, project_id, dataset_id, temp_table_name_incremental)
-            compare_schemas(schema_before, schema_after, table_id)
-            # Add created tables to the cleanup list
-            created_tables.append(f"{target_database}.{target_schema}.{temp_table_name_incremental}")
-            # Store new test tables in the map
-            test_table_map[table_id] = {
-                "test_table": f"{target_database}.{target_schema}.{temp_table_name_incremental}",
-            }
+    Returns:
+        Dict[str, bool]: Success per table id.
+    """
+    results = {}
+    plans = []
+    for table in tables:
+        table_id = target_key(table.get("target", {}))
+        try:
+            print(f"Processing table: {table_id} (packed)")
+            plan = prepare_table(client, table, test_table_map, state_lock, catalog, cache, expiration_hours, incremental_mode)
+        except Exception as e:
+            print(f"Error processing table {table_id}: {e}")
+            results[table_id] = False
+            continue
+        if plan["query"] is None:
+            results[table_id] = True
         else:
-            if combined_query:
+            plans.append((table, plan))
+    if not plans:
+        return results
+
+    try:
+        script_job = client.query(build_pack_script([(plan["table_id"], plan["query"]) for _, plan in plans]))
+        action_errors = {row.action: row.message for row in script_job.result()}
+    except Exception as e:
+        print(f"Pack of {len(plans)} tables failed as a whole ({parse_error_message(e).splitlines()[0]}), running them one by one...")
+        # The plans (schemas, cache keys, test table names) still hold, only their jobs are submitted again
+        for table, plan in plans:
+            with job_action(plan["table_id"]):
                 try:
-                    query_job = client.query(combined_query)
-                    query_job.result()  # Wait for query to complete
-                    #print(f"Query executed successfully for {table_name}")
+                    results[plan["table_id"]] = run_planned_table(client, table, plan, created_tables, test_table_map,
+                                                                  state_lock, cache)
                 except Exception as e:
-                    # Extract and clean the error message
-                    error_message = parse_error_message(e)
-                    error_messages.append(error_message)
-                    print(f"::error::{error_message}")  # GitHub CI error annotation
-
-                schema_after = get_current_schema(client, project_id, dataset_id, temp_table_name_sql)
-                compare_schemas(schema_before, schema_after, table_id)
-                # Add created tables to the cleanup list
-                created_tables.append(f"{target_database}.{target_schema}.{temp_table_name_sql}")
-                # Store new test tables in the map
-                test_table_map[table_id] = {
-                    "test_table": f"{target_database}.{target_schema}.{temp_table_name_sql}",
-                }
-            
+                    print(f"Error processing table {plan['table_id']}: {e}")
+                    results[plan["table_id"]] = False
+        return results
+
+    try:
+        test_tables = {plan["test_table"]: plan["table_id"] for _, plan in plans}
+        record_child_jobs(client, script_job, test_tables)
+        schemas = load_output_schemas(client, [plan["test_table"] for _, plan in plans if plan["table_id"] not in action_errors])
+        for _, plan in plans:
+            if plan["table_id"] in action_errors:
+                # The script job is shared, so the error is reported with the table it belongs to
+                error_message = f"Build failed for {plan['table_id']}: {action_errors[plan['table_id']]}"
+                error_messages.append(error_message)
+                print(f"::error::{error_message}")  # GitHub CI error annotation
+            results[plan["table_id"]] = finish_table(plan, plan["table_id"] not in action_errors,
+                                                     schemas.get(plan["test_table"], {}),
+                                                     created_tables, test_table_map, state_lock, cache)
     except Exception as e:
-        print(f"Error processing table {table_name}: {e}")
+        print(f"Error processing pack of {len(plans)} tables: {e}")
+        for _, plan in plans:
+            results.setdefault(plan["table_id"], False)
+    return results
+
+def dry_run_table(client, table, catalog: SchemaCatalog, max_bytes: int = None, cache: ResultCache = None,
+                  tested_keys: frozenset = frozenset()):
+    """
+    Validate a single table with a dry-run job only, no table is created.
+
+    The query is not rewritten: it runs against the real upstream tables, as nothing
+    else is built in this mode. The output schema of the dry-run job is compared with
+    the schema of the current table, and the action fails if it would process more
+    than `max_bytes`. With a `cache`, the schema and bytes of an unchanged action are
+    taken from a previous run instead of submitting the dry run again. If an upstream
+    table among `tested_keys` doesn't exist yet (a new action), the dry run is skipped
+    with a warning.
+
+    Returns:
+        Tuple of (succeeded, total_bytes_processed).
+    """
+    target = table.get("target", {})
+    project_id = target.get("database", "")
+    dataset_id = target.get("schema", "")
+    table_name = target.get("name", "")
+    table_id = f"{project_id}.{dataset_id}.{table_name}"
+
+    # Same choice as process_table: the incremental query is used when available
+    query = table.get("incrementalQuery") or table.get("query", "")
+    if not query:
+        return True, 0
+
+    print(f"Dry-running table: {table_id}")
+    schema_before = catalog.get_schema(project_id, dataset_id, table_name)
+
+    cache_key = None
+    cached = None
+    if cache is not None:
+        # Nothing is built in this mode, every upstream table is read as it is
+        cache_key = compute_action_key(table, get_upstream_hashes(table, {}, threading.Lock(), catalog), mode="dry-run")
+        cached = cache.get(cache_key)
+
+    if cached:
+        print(f"Reusing cached dry-run result for {table_id}")
+        total_bytes, schema_after = cached.get("total_bytes") or 0, cached["schema"]
+    else:
+        try:
+            dry_run_job = dry_run_query(client, query)
+        except NotFound as e:
+            # Upstream tables are not built in this mode, a new one can't be read yet
+            missing = [
+                key for key in (target_key(dep) for dep in table.get("dependencyTargets", []))
+                if key in tested_keys and not table_exists(client, *key.split(".", 2))
+            ]
+            if missing:
+                warning_message = (f"Dry run skipped for {table_id}: upstream {', '.join(missing)} is tested in this run "
+                                   f"but doesn't exist yet")
+                warning_messages.append(warning_message)
+                print(f"::warning::{warning_message}")  # GitHub CI warning annotation
+                return True, 0
+            error_message = f"Dry run failed for {table_id}: {parse_error_message(e)}"
+            error_messages.append(error_message)
+            print(f"::error::{error_message}")  # GitHub CI error annotation
+            return False, 0
+        except Exception as e:
+            # Extract and clean the error message
+            error_message = f"Dry run failed for {table_id}: {parse_error_message(e)}"
+            error_messages.append(error_message)
+            print(f"::error::{error_message}")  # GitHub CI error annotation
+            return False, 0
+        total_bytes, schema_after = dry_run_job.total_bytes_processed or 0, flatten_schema(dry_run_job.schema)
+        if cache is not None:
+            cache.put(cache_key, table_id, schema_after, total_bytes=total_bytes)
+
+    compare_schemas(schema_before, schema_after, table_id)
+
+    if max_bytes is not None and total_bytes > max_bytes:
+        error_message = (f"Byte budget exceeded for {table_id}: {format_bytes(total_bytes)} processed, "
+                         f"budget is {format_bytes(max_bytes)}")
+        error_messages.append(error_message)
+        print(f"::error::{error_message}")  # GitHub CI error annotation
+        return False, total_bytes
+
+    return True, total_bytes
+
+def run_dry_run(client, graph: DataformGraph, catalog: SchemaCatalog, test_config: Dict, max_concurrency: int,
+                keys: List[str] = None, cache: ResultCache = None) -> Dict[str, int]:
+    """
+    Dry-run every compiled table (or only `keys`) concurrently and check the configured byte budgets.
+
+    Budgets come from the "schema_test" section of src/config.json:
+        max_bytes_per_action: default budget for every action
+        action_max_bytes: per-action budgets keyed by "project.dataset.table"
+        max_bytes_total: budget for the sum over all actions
+
+    Returns:
+        Dict[str, int]: Bytes processed per table id.
+    """
+    default_budget = test_config.get("max_bytes_per_action")
+    action_budgets = test_config.get("action_max_bytes", {})
+    total_budget = test_config.get("max_bytes_total")
+
+    bytes_processed = {}
+    keys = graph.keys_of_type("tables") if keys is None else keys
+    tested_keys = frozenset(keys)
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = {
+            executor.submit(dry_run_table, client, graph.get(key), catalog, action_budgets.get(key, default_budget), cache,
+                            tested_keys): key
+            for key in keys
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                _, bytes_processed[key] = future.result()
+            except Exception as e:
+                print(f"Error processing table {key}: {e}")
+
+    total_bytes = sum(bytes_processed.values())
+    print("\nBytes processed per action (dry run):")
+    for key, num_bytes in sorted(bytes_processed.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {format_bytes(num_bytes):>12}  {key}")
+    print(f"  {format_bytes(total_bytes):>12}  total")
+
+    if total_budget is not None and total_bytes > total_budget:
+        error_message = (f"Global byte budget exceeded: {format_bytes(total_bytes)} processed, "
+                         f"budget is {format_bytes(total_budget)}")
+        error_messages.append(error_message)
+        print(f"::error::{error_message}")  # GitHub CI error annotation
+
+    return bytes_processed
+
+def report_assertions(results: List[Dict]):
+    """Turn assertion results into CI annotations: failures and errors are errors, skips are warnings."""
+    for result in sorted(results, key=lambda result: result["assertion"]):
+        if result["status"] == "failed":
+            error_message = f"Assertion failed: {result['assertion']} returned {result['failing_rows']} rows"
+        elif result["status"] == "error":
+            error_message = f"Assertion could not run: {result['assertion']}: {result['error']}"
+        elif result["status"] == "skipped":
+            warning_message = f"Skipped assertion: {result['assertion']}, {result['error']}."
+            warning_messages.append(warning_message)
+            print(f"::warning::{warning_message}")  # GitHub CI warning annotation
+            continue
+        else:
+            continue
+        error_messages.append(error_message)
+        print(f"::error::{error_message}")  # GitHub CI error annotation
+    if results:
+        passed = sum(1 for result in results if result["status"] == "passed")
+        print(f"\nAssertions: {passed} of {len(results)} passed")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Dataform schema tests against BigQuery.")
+    parser.add_argument("--mode", choices=["build", "dry-run"], default="build",
+                        help="build: create test tables for every action (default). dry-run: validate with dry-run jobs only, no tables are created.")
+    parser.add_argument("--graph", default=None,
+                        help=f"Compiled Dataform graph to test (default: compile.graph_path in src/config.json, else {DEFAULT_GRAPH_PATH}).")
+    parser.add_argument("--env", choices=ENVIRONMENTS, default=None,
+                        help="Compile the graph of this environment first, as set by switch_env, reusing the cached graph "
+                             "if the sources didn't change (see compile_graph.py). Default: test --graph as it is.")
+    parser.add_argument("--changed-only", action="store_true",
+                        help="Only test actions affected by files changed since --base-ref, plus their downstream dependents.")
+    parser.add_argument("--base-ref", default="origin/main",
+                        help="Git ref to diff against with --changed-only (default: origin/main).")
+    parser.add_argument("--sample", action="store_true",
+                        help="Read declaration sources through samples (TABLESAMPLE and a partition window), "
+                             "configured in schema_test.sampling in src/config.json. Build mode only.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Don't read or write the result cache (schema_test.cache_path in src/config.json).")
+    parser.add_argument("--max-concurrency", type=int, default=None,
+                        help="Maximum number of tables processed at the same time (default: schema_test.max_concurrency, "
+                             "or schema_test.dry_run_concurrency in dry-run mode, from src/config.json).")
+    parser.add_argument("--incremental", choices=INCREMENTAL_MODES, default=None,
+                        help="incremental: build incremental tables from their incremental query only. both: seed them from "
+                             "the full query, then merge the incremental query on uniqueKey (default: schema_test.incremental_mode).")
+    parser.add_argument("--client", default=None,
+                        help=f"BigQuery client: {' or '.join(CLIENT_CHOICES)} (in-process fake, no BigQuery access), "
+                             "or module:factory for a custom one (default: $BQ_CLIENT, else bigquery).")
+    args = parser.parse_args(argv)
+    if args.sample and args.mode == "dry-run":
+        # Dry runs read the real upstream tables, sources are never rewritten in that mode
+        parser.error("--sample only applies to --mode build")
+    return args
+
+def load_test_config(config_path: str) -> Dict:
+    """Load the "schema_test" section of the general configuration file, if any."""
+    try:
+        with open(config_path, "r") as f:
+            return json.load(f).get("schema_test", {})
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
 
 # Main logic to generate and run queries
 def main():
     # Start timer
     start_time = time.time()
 
-    dataform_json_path = "src/tests/compiled_queries/result.json"  # Path to your Dataform JSON file
-    client = bigquery.Client()  # Initialize BigQuery client
+    args = parse_args()
+    test_config = load_test_config("src/config.json")
+    if args.mode == "dry-run":
+        max_concurrency = args.max_concurrency or test_config.get("dry_run_concurrency", 32)
+    else:
+        max_concurrency = args.max_concurrency or test_config.get("max_concurrency", 8)
 
-    with open(dataform_json_path, "r") as f:
-        data = json.load(f)  # Load Dataform JSON
+    compile_config = load_compile_config("src/config.json")
+    dataform_json_path = args.graph or compile_config.get("graph_path", DEFAULT_GRAPH_PATH)  # Path to your Dataform JSON file
+    recorder = JobRecorder()  # Records every BigQuery job of the run
+    client = RecordingClient(create_client(args.client), recorder)  # Initialize BigQuery client
 
-    processed_tables = set()  # Set to track already processed tables
     created_tables = []  # List to track temporary tables for cleanup
     test_table_map = {}  # Dictionary to map original tables to test tables
+    state_lock = threading.Lock()  # Guards created_tables and test_table_map across workers
+
+    # Result cache shared between runs, keyed by the content hash of each action and its inputs
+    cache = None
+    if test_config.get("cache_path") and not args.no_cache:
+        cache = ResultCache(
+            test_config["cache_path"],
+            ttl_seconds=test_config.get("cache_ttl_hours", 24) * 3600,
+            max_entries=test_config.get("cache_max_entries", 1000),
+        ).load()
 
     try:
-        # Process each table in the Dataform JSON
-        for table in data.get("tables", []):
-            process_table(client, table, processed_tables, data, created_tables, test_table_map)
+        try:
+            if args.env:
+                prepare_graph(args.env, dataform_json_path, compile_config)
+            # Load and index the Dataform JSON, only the skeleton if it was written with its lazy store
+            graph = DataformGraph.load(dataform_json_path)
+        except (CompileError, OSError, json.JSONDecodeError) as e:
+            error_message = f"Could not load the compiled graph {dataform_json_path}: {e}"
+            error_messages.append(error_message)
+            print(f"::error::{error_message}")  # GitHub CI error annotation
+            return
+
+        for cycle in graph.find_cycles():
+            error_message = f"Dependency cycle detected: {' -> '.join(cycle)}"
+            error_messages.append(error_message)
+            print(f"::error::{error_message}")  # GitHub CI error annotation
+
+        selected_keys = graph.keys_of_type("tables")
+        assertion_keys = graph.keys_of_type("assertions")
+        if args.changed_only:
+            # Only test what the change touches; unchanged upstream tables are read as they are
+            changed_files = get_changed_files(args.base_ref)
+            changed_keys = map_changed_files_to_actions(graph, changed_files)
+            selected_keys = select_actions(graph, changed_keys)
+            assertion_keys = select_actions(graph, changed_keys, "assertions")
+            print(f"{len(changed_files)} changed files since {args.base_ref}, "
+                  f"{len(changed_keys)} changed actions, {len(selected_keys)} tables to test:")
+            for key in selected_keys:
+                print(f"  - {key}")
+
+        if test_config.get("preflight", True):
+            # Check the SQL offline first, so a broken query fails the run before any job is submitted
+            findings = preflight_graph(graph, selected_keys + assertion_keys, workers=test_config.get("preflight_workers"))
+            for finding in findings:
+                message = format_finding(finding)
+                if finding["severity"] == ERROR:
+                    error_messages.append(message)
+                    print(f"::error::{message}")  # GitHub CI error annotation
+                else:
+                    warning_messages.append(message)
+                    print(f"::warning::{message}")  # GitHub CI warning annotation
+            errors = [finding for finding in findings if finding["severity"] == ERROR]
+            if errors:
+                print(f"SQL pre-flight found {len(errors)} problems, no BigQuery job submitted")
+                return
+            print(f"SQL pre-flight passed for {len(selected_keys) + len(assertion_keys)} actions")
+
+        # Load the current schemas of all target datasets up front, one query per dataset
+        catalog = SchemaCatalog(client)
+        catalog.prefetch(
+            [(graph.targets[key].get("database", ""), graph.targets[key].get("schema", ""))
+             for key in selected_keys],
+            max_concurrency=max_concurrency,
+        )
+
+        if args.mode == "dry-run":
+            # Validate every table with dry-run jobs only, they don't depend on each other
+            print(f"Running dry-run schema tests with up to {max_concurrency} concurrent jobs")
+            run_dry_run(client, graph, catalog, test_config, max_concurrency, keys=selected_keys, cache=cache)
+            return
+
+        if args.sample:
+            # Point every read of a declaration source at a small sample of it
+            samples = prepare_samples(client, graph, selected_keys, test_config.get("sampling", {}),
+                                      generate_temp_suffix, max_concurrency=max_concurrency)
+            test_table_map.update(samples)
+            created_tables.extend(entry["test_table"] for entry in samples.values() if entry.get("created"))
+
+        incremental_mode = args.incremental or test_config.get("incremental_mode", "incremental")
+        if incremental_mode == "both":
+            print("Testing both the full-refresh and the incremental path of incremental tables")
+
+        # Cached test tables must live as long as their cache entry
+        expiration_hours = test_config.get("test_table_expiration_hours", 6)
+        if cache is not None:
+            expiration_hours = max(expiration_hours, test_config.get("cache_ttl_hours", 24))
+
+        def run_table(table):
+            # Jobs of the worker thread are recorded under the table they build
+            with job_action(target_key(table.get("target", {}))):
+                return process_table(client, table, created_tables, test_table_map, state_lock, catalog, cache,
+                                     expiration_hours, incremental_mode, test_config.get("incremental_max_prune_ratio", 0.9))
+
+        # Views and cheap tables that are ready at the same time share one script job
+        packable, max_pack_size = set(), test_config.get("pack_max_actions", 20)
+        if max_pack_size > 1:
+            packable = select_packable(client, graph, selected_keys, test_config.get("pack_max_bytes", 100 * 1024 ** 2),
+                                       incremental_mode, max_concurrency=test_config.get("dry_run_concurrency", 32))
+            print(f"{len(packable)} of {len(selected_keys)} tables can be packed, up to {max_pack_size} per script job")
+
+        def run_pack(tables):
+            with job_action(f"pack of {len(tables)} tables"):
+                return process_pack(client, tables, created_tables, test_table_map, state_lock, catalog, cache,
+                                    expiration_hours, incremental_mode)
+
+        # Process the tables of the Dataform JSON in dependency order, independent branches in parallel
+        print(f"Running schema tests with up to {max_concurrency} concurrent tables")
+        # Assertions run in batches per dataset as soon as the test tables they check exist
+        assertions = [graph.get(key) for key in assertion_keys]
+        if test_config.get("assert_unique_keys", True):
+            assertions.extend(unique_key_assertions(graph, selected_keys))
+        batcher = AssertionBatcher(client, assertions, selected_keys, test_table_map, state_lock,
+                                   batch_size=test_config.get("assertion_batch_size", 50),
+                                   max_concurrency=test_config.get("assertion_concurrency", 4))
+        if len(batcher):
+            print(f"Running {len(batcher)} assertions in batches per dataset")
+        batcher.start()
+        try:
+            table_status = run_dag(graph, run_table, max_concurrency=max_concurrency, keys=selected_keys,
+                                   on_done=batcher.on_table_done, packable=packable, run_pack=run_pack,
+                                   max_pack_size=max_pack_size)
+        finally:
+            report_assertions(batcher.finish())
+        for table_id, status in table_status.items():
+            if status == "skipped":
+                warning_message = f"Skipped table: {table_id}, an upstream table failed."
+                warning_messages.append(warning_message)
+                print(f"::warning::{warning_message}")  # GitHub CI warning annotation
+            elif status == "cycle":
+                print(f"Table not processed because of a dependency cycle: {table_id}")
 
     except Exception as e:
         print(f"Error in processing: {e}")
 
     finally:
-        # Clean up temporary tables
-        print("\nCleaning up temporary tables...")
-        for created_table in created_tables:
-            try:
-                print(f"Dropping table: {created_table}")
-                client.query(f"DROP TABLE IF EXISTS `{created_table}`").result()
-            except Exception as e:
-                # Extract and clean the error message
-                error_message = parse_error_message(e)
-                error_messages.append(error_message)
-                print(f"::error::{error_message}")  # GitHub CI error annotation
+        tables_to_drop = list(created_tables)
+        if cache is not None:
+            # Test tables of valid cache entries are kept for later runs, evicted entries release theirs
+            tables_to_drop.extend(entry["test_table"] for entry in cache.evict() if entry.get("test_table"))
+            kept_tables = set(cache.kept_tables())
+            tables_to_drop = [table for table in dict.fromkeys(tables_to_drop) if table not in kept_tables]
+            cache.save()
+            print(f"\nResult cache: {cache.hits} hits, {cache.misses} misses, {len(cache.entries)} entries in {cache.path}")
+
+        # Clean up temporary tables, one script per dataset
+        print(f"\nCleaning up {len(tables_to_drop)} temporary tables...")
+        with job_action("cleanup"):
+            drop_errors = drop_tables(client, tables_to_drop, max_concurrency=test_config.get("cleanup_concurrency", 8))
+        for created_table, e in drop_errors.items():
+            # Extract and clean the error message
+            error_message = f"Could not drop {created_table}: {parse_error_message(e)}"
+            error_messages.append(error_message)
+            print(f"::error::{error_message}")  # GitHub CI error annotation
+
+        # Report where the time went, per action and as a trace of every job
+        print_incremental_report()
+        recorder.print_report(test_config.get("slowest_actions", 10))
+        try:
+            recorder.write_trace(test_config.get("trace_path", "/tmp/test_trace.json"))
+        except OSError as e:
+            print(f"Could not write the job trace: {e}")
 
         # Calculate and print total runtime
         end_time = time.time()
@@ -389,6 +914,10 @@ def main():
 
         print(log_messages)
 
+        # Every BigQuery job of the run, see job_telemetry.JobRecorder
+        log_messages["jobs"] = recorder.records
+        log_messages["incremental"] = incremental_reports
+
         print("create the file:")
         # Write the log messages to a file
         with open("/tmp/test_log.json", "w") as log_file:
@@ -398,6 +927,7 @@ def main():
         # Read back the file to ensure it was written correctly
         with open("/tmp/test_log.json", "r") as log_file:
             content = json.load(log_file)
+            content["jobs"] = f"{len(content['jobs'])} jobs"  # Too long to print, see the trace
             print("File contents:", json.dumps(content, indent=4))  # Pretty-print the content
        
        
@@ -0,0 +1,391 @@
+"""
+Offline pre-flight check of the compiled SQL, before any BigQuery job is submitted.
+
+Every SQL string of the compiled graph (queries, incremental queries, pre/post operations
+and the queries of operations and assertions) is tokenized and checked for:
+  - lexical errors: unterminated strings, quoted identifiers and comments, unexpected
+    characters, unresolved Dataform expressions (`${...}`)
+  - structure: balanced parentheses and brackets, known statement keywords (a typo like
+    SELCT fails), and BEGIN/END, CASE/END, IF/END IF and the loop blocks of scripts
+    (reported as warnings: the block tracking is a heuristic)
+  - incomplete clauses: SELECT FROM, WHERE followed by GROUP BY, a dangling AND, `= )`...
+  - references: every fully qualified table read or written must be a compiled target or
+    a declaration of the graph (or be created by the same SQL).
+It is a fast approximation of the BigQuery parser, not a full grammar: errors are only
+reported for what is certainly wrong. Keywords used as identifiers (`x.end`, `` `end` ``)
+are not taken for keywords. Actions are checked in parallel processes on large graphs.
+
+Usage:
+    python src/tests/sql_preflight.py [--graph src/tests/compiled_queries/result.json] [--workers 4]
+"""
+import argparse
+import bisect
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from dataform_graph import DataformGraph
+
+# Fields of compiled actions holding SQL, a string or a list of statements
+SQL_FIELDS = ("query", "incrementalQuery", "preOps", "postOps", "incrementalPreOps", "incrementalPostOps", "queries")
+
+# Below this many SQL strings, starting worker processes costs more than it saves
+PARALLEL_MIN_ITEMS = 500
+
+_TOKEN_PATTERN = re.compile(
+    r"(?P<space>\s+)"
+    r"|(?P<comment>--[^\n]*|#[^\n]*|/\*.*?\*/)"
+    r"|(?P<string>(?:[rRbB]{1,2})?(?:'''.*?'''|\"\"\".*?\"\"\"|'(?:[^'\\\n]|\\.)*'|\"(?:[^\"\\\n]|\\.)*\"))"
+    r"|(?P<quoted>`[^`\n]+`)"
+    r"|(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)"
+    r"|(?P<param>@@?\w+|@`[^`\n]+`)"
+    r"|(?P<word>[A-Za-z_]\w*)"
+    r"|(?P<op><>|!=|<=|>=|\|\||<<|>>|=>|->|[-+*/%=<>&|^~.,;:()\[\]?{}])",
+    re.DOTALL,
+)
+
+STATEMENT_KEYWORDS = {
+    "SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "MERGE", "CREATE", "DROP", "ALTER", "TRUNCATE", "UNDROP",
+    "DECLARE", "SET", "BEGIN", "END", "IF", "ELSEIF", "ELSE", "LOOP", "WHILE", "REPEAT", "UNTIL", "FOR", "BREAK",
+    "LEAVE", "CONTINUE", "ITERATE", "RETURN", "CALL", "EXECUTE", "RAISE", "COMMIT", "ROLLBACK", "EXCEPTION",
+    "GRANT", "REVOKE", "EXPORT", "LOAD", "ASSERT", "CASE", "WHEN",
+}
+# Blocks closed by END <keyword>; a plain END closes BEGIN and CASE expressions
+_END_KEYWORDS = {"IF": "IF", "LOOP": "LOOP", "WHILE": "WHILE", "REPEAT": "REPEAT", "FOR": "FOR", "CASE": "CASE STATEMENT"}
+# Keywords that start a new clause, so they can't directly follow one expecting an expression
+_CLAUSE_KEYWORDS = {"FROM", "WHERE", "GROUP", "ORDER", "HAVING", "QUALIFY", "LIMIT", "UNION", "INTERSECT", "WINDOW"}
+_EXPECTS_EXPRESSION = {
+    "SELECT": _CLAUSE_KEYWORDS,
+    "FROM": _CLAUSE_KEYWORDS,
+    "WHERE": _CLAUSE_KEYWORDS,
+    "HAVING": _CLAUSE_KEYWORDS,
+    "QUALIFY": _CLAUSE_KEYWORDS,
+    "JOIN": _CLAUSE_KEYWORDS | {"ON", "USING"},
+    "ON": _CLAUSE_KEYWORDS,
+    "BY": _CLAUSE_KEYWORDS,
+    "AND": _CLAUSE_KEYWORDS | {"AND", "OR", "THEN"},
+    "OR": _CLAUSE_KEYWORDS | {"AND", "OR", "THEN"},
+}
+_BINARY_OPERATORS = {"=", "!=", "<>", "<=", ">=", "+", "-", "/", "||", ","}
+_OPERATOR_FOLLOWERS = {"FROM", "WHERE", "GROUP", "ORDER", "HAVING", "LIMIT", "AND", "OR", "THEN"}
+# Keywords reading or writing the table that follows them
+_REFERENCE_KEYWORDS = {"FROM", "JOIN", "INTO", "UPDATE", "MERGE", "TABLE", "USING", "CLONE", "COPY", "VIEW"}
+_CREATE_KEYWORDS = {"TABLE", "VIEW"}
+_CREATE_MODIFIERS = {"CREATE", "REPLACE", "TEMP", "TEMPORARY", "EXTERNAL", "SNAPSHOT", "MATERIALIZED"}
+
+ERROR = "error"
+# Findings of the block tracking, which can't follow every construct of the grammar
+WARNING = "warning"
+
+
+def _tokenize(sql: str) -> Tuple[List[Tuple[str, str, int]], List[Tuple[int, str]]]:
+    """Split SQL into (kind, value, position) tokens without whitespace and comments, plus lexical errors."""
+    tokens, errors = [], []
+    position, length = 0, len(sql)
+    while position < length:
+        match = _TOKEN_PATTERN.match(sql, position)
+        if match is None:
+            rest = sql[position:position + 2]
+            if rest == "${":
+                errors.append((position, "unresolved Dataform expression ${...}"))
+            elif rest == "/*":
+                errors.append((position, "unterminated comment"))
+            elif rest[0] in "'\"":
+                errors.append((position, "unterminated string literal"))
+            elif rest[0] == "`":
+                errors.append((position, "unterminated quoted identifier"))
+            else:
+                errors.append((position, f"unexpected character {rest[0]!r}"))
+            return tokens, errors
+        kind = match.lastgroup
+        if kind not in ("space", "comment"):
+            value = match.group()
+            tokens.append((kind, value.upper() if kind == "word" else value, position))
+        position = match.end()
+    return tokens, errors
+
+
+def _table_path(tokens: List[Tuple[str, str, int]], index: int, sql: str) -> List[str]:
+    """The parts of the identifier path starting at tokens[index] (p.d.t, `p.d.t`, `p`.d.`t`...), in their original case."""
+    parts = []
+    while index < len(tokens):
+        kind, value, position = tokens[index]
+        if kind == "quoted":
+            parts.extend(value.strip("`").split("."))
+        elif kind == "word":
+            parts.append(sql[position:position + len(value)])
+        else:
+            break
+        if index + 1 < len(tokens) and tokens[index + 1][0] == "op" and tokens[index + 1][1] == ".":
+            index += 2
+        else:
+            break
+    return parts
+
+
+def check_sql(sql: str, known_tables: Iterable[str] = (), projects: Iterable[str] = ()) -> List[Tuple[int, str, str]]:
+    """
+    Check one SQL string (a query or a script).
+
+    Args:
+        sql (str): The SQL to check.
+        known_tables: Sorted "project.dataset.table" keys that may be referenced. Empty to skip
+            the reference check.
+        projects: Projects of the graph; unquoted three-part paths in other projects are
+            taken for column paths (alias.struct.field) and not checked.
+
+    Returns:
+        List[Tuple[int, str, str]]: (position in `sql`, message, ERROR or WARNING) per problem found.
+    """
+    tokens, lexical_errors = _tokenize(sql)
+    if lexical_errors:
+        return [(position, message, ERROR) for position, message in lexical_errors]
+    findings = []
+
+    brackets = []  # (token, position) of the open parentheses and brackets
+    blocks = []  # [kind, position, in exception handler] of the open blocks
+    statement_start = True
+    created = set()
+
+    def top() -> Optional[str]:
+        return blocks[-1][0] if blocks else None
+
+    closing_index = None  # The keyword of END IF, END LOOP... is not a new block
+    for index, (kind, value, position) in enumerate(tokens):
+        if index == closing_index:
+            continue
+        following = tokens[index + 1] if index + 1 < len(tokens) else None
+        following_value = following[1] if following else None
+
+        if kind == "op":
+            if value in ("(", "["):
+                brackets.append((value, position))
+                if following_value == ",":
+                    findings.append((following[2], f"unexpected ',' after '{value}'", ERROR))
+            elif value in (")", "]"):
+                expected = "(" if value == ")" else "["
+                if not brackets or brackets[-1][0] != expected:
+                    findings.append((position, f"unmatched '{value}'", ERROR))
+                    return findings
+                brackets.pop()
+            elif value == ";":
+                if brackets:
+                    findings.append((brackets[-1][1], f"unclosed '{brackets[-1][0]}'", ERROR))
+                    return findings
+                statement_start = True
+                continue
+            elif value == ":" and statement_start:
+                continue  # label: BEGIN / LOOP ...
+            if value in _BINARY_OPERATORS and (following is None or following_value in (")", "]", ";", ",")
+                                               or (following[0] == "word" and following_value in _OPERATOR_FOLLOWERS)):
+                if not (value == "," and following_value in ("FROM", ")")):  # Trailing commas are allowed
+                    findings.append((position, f"expected an expression after '{value}'", ERROR))
+            if statement_start and value != "(":
+                findings.append((position, f"unexpected '{value}' at the start of a statement", ERROR))
+            statement_start = False
+            continue
+
+        if kind != "word":
+            if statement_start:
+                findings.append((position, "expected a statement", ERROR))
+            statement_start = False
+            continue
+
+        if index > 0 and tokens[index - 1][1] == "." and tokens[index - 1][0] == "op":
+            statement_start = False
+            continue  # Field or table name of a path (x.end, dataset.case), not a keyword
+
+        # Block structure of scripts
+        if value == "END":
+            closing = following_value if following and following[0] == "word" and following_value in _END_KEYWORDS else None
+            expected = _END_KEYWORDS[closing] if closing else None
+            if not blocks:
+                findings.append((position, f"END{' ' + closing if closing else ''} without a matching block", WARNING))
+                return findings
+            if (expected and top() != expected) or (not expected and top() not in ("BEGIN", "CASE")):
+                findings.append((position, f"END{' ' + closing if closing else ''} closes the {top()} of line "
+                                         f"{_line_column(sql, blocks[-1][1])[0]}", WARNING))
+                return findings
+            blocks.pop()
+            if closing:
+                closing_index = index + 1
+            statement_start = False
+            continue
+        if following and following[0] == "op" and following_value == ":" and statement_start:
+            continue  # Label
+        if value == "BEGIN":
+            if following_value not in ("TRANSACTION", "TRAN", ";"):
+                blocks.append(["BEGIN", position, False])
+                statement_start = True
+                continue
+        elif value == "CASE":
+            blocks.append(["CASE STATEMENT" if statement_start else "CASE", position, False])
+            statement_start = False
+            continue
+        elif statement_start and value in ("IF", "WHILE", "FOR"):
+            blocks.append([value, position, False])
+        elif statement_start and value in ("LOOP", "REPEAT"):
+            blocks.append([value, position, False])
+            continue
+        elif value == "EXCEPTION" and statement_start and top() == "BEGIN":
+            blocks[-1][2] = True
+        elif value == "THEN" and (top() in ("IF", "CASE STATEMENT") or (top() == "BEGIN" and blocks[-1][2])):
+            statement_start = True
+            continue
+        elif value == "ELSE" and top() in ("IF", "CASE STATEMENT"):
+            statement_start = True
+            continue
+        elif value == "DO" and top() in ("WHILE", "FOR"):
+            statement_start = True
+            continue
+
+        if statement_start and value not in STATEMENT_KEYWORDS:
+            findings.append((position, f"unknown statement {sql[position:position + len(value)]!r}", ERROR))
+        statement_start = False
+
+        # Clauses without their expression: SELECT FROM, WHERE GROUP BY, a dangling AND...
+        if value in _EXPECTS_EXPRESSION and (following is None or following_value in (")", "]", ";") or (
+                following[0] == "word" and following_value in _EXPECTS_EXPRESSION[value])):
+            findings.append((position, f"expected an expression after {value}", ERROR))
+
+        # References to tables
+        if value in _REFERENCE_KEYWORDS and following and following[0] in ("word", "quoted"):
+            start = index + 1
+            if value == "TABLE":
+                # CREATE TABLE IF NOT EXISTS / DROP TABLE IF EXISTS
+                while start < len(tokens) and tokens[start][1] in ("IF", "NOT", "EXISTS") and tokens[start][0] == "word":
+                    start += 1
+            if start >= len(tokens) or tokens[start][0] not in ("word", "quoted"):
+                continue
+            if tokens[start][0] == "word" and tokens[start][1] in STATEMENT_KEYWORDS | {"UNNEST", "FUNCTION", "PROCEDURE"}:
+                continue
+            parts = _table_path(tokens, start, sql)
+            if len(parts) != 3:
+                continue  # CTE, alias, temporary table or alias.column path
+            table = ".".join(parts)
+            preceding = tokens[index - 1][1] if index > 0 else None
+            if value in _CREATE_KEYWORDS and preceding in _CREATE_MODIFIERS:
+                created.add(table)
+                continue
+            if preceding == "DROP" or table in created or not known_tables:
+                continue
+            if tokens[start][0] != "quoted" and parts[0] not in projects:
+                continue
+            if "INFORMATION_SCHEMA" in (part.upper() for part in parts) or parts[2].startswith("__TABLES") \
+                    or parts[1].lower().startswith("region-"):
+                continue
+            if not _is_known(table, known_tables):
+                findings.append((tokens[start][2], f"reference to {table}, which is neither a compiled action nor a declaration",
+                                 ERROR))
+
+    if brackets:
+        findings.append((brackets[-1][1], f"unclosed '{brackets[-1][0]}'", ERROR))
+    if blocks:
+        findings.append((blocks[-1][1], f"{blocks[-1][0]} without END", WARNING))
+    return findings
+
+
+def _is_known(table: str, known_tables: List[str]) -> bool:
+    """Whether a table (or wildcard table, `events_*`) is in the sorted list of known tables."""
+    if table.endswith("*"):
+        prefix = table[:-1]
+        position = bisect.bisect_left(known_tables, prefix)
+        return position < len(known_tables) and known_tables[position].startswith(prefix)
+    position = bisect.bisect_left(known_tables, table)
+    return position < len(known_tables) and known_tables[position] == table
+
+
+def _line_column(sql: str, position: int) -> Tuple[int, int]:
+    line = sql.count("\n", 0, position) + 1
+    return line, position - (sql.rfind("\n", 0, position) + 1) + 1
+
+
+# Known tables and projects of the graph, set once per worker process
+_worker_context: Dict = {}
+
+
+def _init_worker(known_tables: List[str], projects: Set[str]):
+    _worker_context["known_tables"] = known_tables
+    _worker_context["projects"] = projects
+
+
+def _check_items(items: List[Tuple[str, str, str]]) -> List[Dict]:
+    findings = []
+    for action, field, sql in items:
+        for position, message, severity in check_sql(sql, _worker_context["known_tables"], _worker_context["projects"]):
+            line, column = _line_column(sql, position)
+            findings.append({"action": action, "field": field, "line": line, "column": column, "message": message,
+                             "severity": severity})
+    return findings
+
+
+def sql_items(graph: DataformGraph, keys: Optional[Iterable[str]] = None) -> List[Tuple[str, str, str]]:
+    """(action, field, SQL) for every SQL string of the actions, e.g. ("p.d.t", "preOps[0]", "DECLARE ...")."""
+    items = []
+    for key in (graph.actions if keys is None else keys):
+        action = graph.get(key) or {}
+        if action.get("disabled"):
+            continue
+        for field in SQL_FIELDS:
+            value = action.get(field)
+            if isinstance(value, str) and value.strip():
+                items.append((key, field, value))
+            elif isinstance(value, list):
+                items.extend((key, f"{field}[{i}]", sql) for i, sql in enumerate(value) if sql and sql.strip())
+    return items
+
+
+def preflight_graph(graph: DataformGraph, keys: Optional[Iterable[str]] = None, workers: Optional[int] = None) -> List[Dict]:
+    """
+    Check the SQL of the actions of a compiled graph (all of them by default).
+
+    Large graphs are split in chunks checked by `workers` processes (default: one per core).
+
+    Returns:
+        List[Dict]: {"action", "field", "line", "column", "message", "severity"} per problem, sorted.
+    """
+    known_tables = sorted(graph.actions)
+    projects = {target.get("database", "") for target in graph.targets.values()}
+    items = sql_items(graph, keys)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(items) < PARALLEL_MIN_ITEMS:
+        _init_worker(known_tables, projects)
+        findings = _check_items(items)
+    else:
+        chunk_size = -(-len(items) // (workers * 4))
+        chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(known_tables, projects)) as executor:
+            findings = [finding for chunk_findings in executor.map(_check_items, chunks) for finding in chunk_findings]
+    return sorted(findings, key=lambda finding: (finding["action"], finding["field"], finding["line"], finding["column"]))
+
+
+def format_finding(finding: Dict) -> str:
+    outcome = "warning" if finding.get("severity") == WARNING else "failed"
+    return (f"SQL pre-flight {outcome} for {finding['action']} ({finding['field']}, line {finding['line']}, "
+            f"column {finding['column']}): {finding['message']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--graph", default="src/tests/compiled_queries/result.json", help="Compiled Dataform graph to check.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core).")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    graph = DataformGraph.load(args.graph)
+    findings = preflight_graph(graph, workers=args.workers)
+    errors = [finding for finding in findings if finding["severity"] == ERROR]
+    for finding in findings:
+        print(f"::{finding['severity']}::{format_finding(finding)}")  # GitHub CI annotation
+    print(f"Checked the SQL of {len(graph)} actions in {time.perf_counter() - start:.2f}s, "
+          f"{len(errors)} problems and {len(findings) - len(errors)} warnings found.")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
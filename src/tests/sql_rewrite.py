@@ -0,0 +1,71 @@
+import re
+from typing import Dict, List
+
+# One regex alternation scanned left to right over the SQL:
+#   - string literals and comments are matched first so their content is never rewritten
+#   - a table path is a dot separated chain of backtick-quoted or plain identifiers, e.g.
+#     `p.d.t`, `p`.`d`.`t`, `p.d`.`t` or p.d.t
+# Plain paths only start at a word boundary so the scan never retries inside a word.
+_QUOTED_PART = r"`[^`\n]+`"
+_PART = rf"(?:{_QUOTED_PART}|\w+)"
+_TOKEN_PATTERN = re.compile(
+    r"(?P<skip>'(?:[^'\\\n]|\\.)*'|\"(?:[^\"\\\n]|\\.)*\"|--[^\n]*|#[^\n]*|/\*.*?\*/)"
+    rf"|(?P<path>{_QUOTED_PART}(?:\s*\.\s*{_PART})*|(?<![\w.`])[A-Za-z_]\w*(?:\s*\.\s*{_PART})+)",
+    re.DOTALL,
+)
+_SPLIT_PATTERN = re.compile(rf"{_QUOTED_PART}|\w+")
+
+
+def split_table_path(path: str) -> List[str]:
+    """Split a (partly) quoted identifier path like `p`.`d.t` into its parts ["p", "d", "t"]."""
+    parts = []
+    for part in _SPLIT_PATTERN.findall(path):
+        parts.extend(part.strip("`").split("."))
+    return parts
+
+
+def rewrite_references(sql: str, test_table_map: Dict[str, Dict[str, str]]) -> str:
+    """
+    Replace references to original tables with their test tables in a single pass.
+
+    Every identifier path of the SQL is normalised to its canonical `project.dataset.table`
+    key and looked up in `test_table_map`, so the cost is linear in the length of the SQL
+    and independent of the number of test tables. Paths with more than three parts
+    (e.g. `p.d.t`.column) are matched on their first three parts. String literals and
+    comments are left untouched. Entries with a "sql" key (e.g. sampled sources) are
+    replaced by that SQL instead of the quoted test table name.
+
+    Args:
+        sql (str): The SQL to rewrite.
+        test_table_map (Dict[str, Dict[str, str]]): Original table id -> {"test_table": test table id}.
+
+    Returns:
+        str: The rewritten SQL.
+    """
+    if not sql or not test_table_map:
+        return sql
+
+    def replace(match: re.Match) -> str:
+        path = match.group("path")
+        if path is None:
+            return match.group(0)
+        if path.count(".") < 2:
+            # alias.column or a single identifier, never a table reference
+            return path
+        parts = split_table_path(path)
+        if len(parts) < 3:
+            return path
+        test_versions = test_table_map.get(".".join(parts[:3]))
+        if not test_versions:
+            return path
+        rest = "".join(f".`{part}`" for part in parts[3:])
+        if test_versions.get("sql") and not rest:
+            return test_versions["sql"]
+        return f"`{test_versions['test_table']}`{rest}"
+
+    return _TOKEN_PATTERN.sub(replace, sql)
+
+
+def rewrite_operations(operations: List[str], test_table_map: Dict[str, Dict[str, str]]) -> List[str]:
+    """Apply `rewrite_references` to every statement of a preOps/postOps list."""
+    return [rewrite_references(operation, test_table_map) for operation in operations or []]
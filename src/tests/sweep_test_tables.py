@@ -0,0 +1,113 @@
+"""
+Remove stale test tables left behind by interrupted schema test runs.
+
+Finds test tables (`<name>_test_xxxxxxxx`) and sampled copies (`<name>_sample_xxxxxxxx`)
+of the actions and declarations of the compiled graph, created more than --older-than
+hours ago, and drops them in bulk. Only the datasets test tables are created in are
+swept (or --datasets): those of the compiled tables, plus the datasets sampled copies
+are written to. Test tables kept by valid entries of the result cache are left alone.
+
+Usage:
+    python src/tests/sweep_test_tables.py [--older-than 24] [--datasets project.dataset ...] [--dry-run]
+"""
+import argparse
+import json
+import os, sys
+import time
+from typing import Dict, List, Set, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from bq_client import CLIENT_CHOICES, create_client
+from dataform_graph import DataformGraph
+from result_cache import ResultCache
+from sampling import get_source_settings
+from table_cleanup import drop_tables, find_stale_tables
+
+
+def graph_datasets(graph: DataformGraph, test_config: Dict) -> List[Tuple[str, str]]:
+    """
+    Datasets test tables can be created in: those of the compiled tables, plus those
+    sampled copies of declarations are written to (the "table" sampling strategy).
+    Datasets only read from, like production sources, are never swept.
+    """
+    datasets = {
+        (graph.targets[key].get("database", ""), graph.targets[key].get("schema", ""))
+        for key in graph.keys_of_type("tables")
+    }
+    sampling_config = test_config.get("sampling", {})
+    for key in graph.keys_of_type("declarations"):
+        settings = get_source_settings(sampling_config, key)
+        if settings["strategy"] != "table":
+            continue
+        target = graph.targets[key]
+        sample_dataset = settings.get("sample_dataset") or f"{target.get('database', '')}.{target.get('schema', '')}"
+        datasets.add(tuple(sample_dataset.split(".", 1)))
+    return sorted(datasets)
+
+
+def cached_tables(test_config: Dict) -> Set[str]:
+    """Test tables referenced by unexpired entries of the result cache."""
+    if not test_config.get("cache_path"):
+        return set()
+    cache = ResultCache(test_config["cache_path"], ttl_seconds=test_config.get("cache_ttl_hours", 24) * 3600).load()
+    now = time.time()
+    return {
+        entry["test_table"] for entry in cache.entries.values()
+        if entry.get("test_table") and now - entry.get("created_at", 0) <= cache.ttl_seconds
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--older-than", type=float, default=None,
+                        help="Minimum age in hours of the tables to drop (default: schema_test.sweep_older_than_hours, else 24).")
+    parser.add_argument("--datasets", nargs="+", default=None,
+                        help="Datasets to sweep, as project.dataset (default: the datasets test tables are created in).")
+    parser.add_argument("--graph", default="src/tests/compiled_queries/result.json",
+                        help="Compiled Dataform graph the datasets and table names are read from.")
+    parser.add_argument("--config", default="src/config.json", help="General configuration file.")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the tables that would be dropped.")
+    parser.add_argument("--client", default=None,
+                        help=f"BigQuery client: {' or '.join(CLIENT_CHOICES)}, or module:factory (default: $BQ_CLIENT, else bigquery).")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        with open(args.config, "r") as f:
+            test_config = json.load(f).get("schema_test", {})
+    except (FileNotFoundError, json.JSONDecodeError):
+        test_config = {}
+    older_than = args.older_than if args.older_than is not None else test_config.get("sweep_older_than_hours", 24)
+
+    graph = DataformGraph.load(args.graph)
+    if args.datasets:
+        datasets = [tuple(dataset.split(".", 1)) for dataset in args.datasets]
+    else:
+        datasets = graph_datasets(graph, test_config)
+    names = {target.get("name", "") for target in graph.targets.values()}
+
+    client = create_client(args.client)
+    print(f"Looking for test tables of {len(names)} actions older than {older_than}h in {len(datasets)} datasets...")
+    stale = find_stale_tables(client, datasets, older_than, names)
+    kept = cached_tables(test_config)
+    to_drop = [entry["table"] for entry in stale if entry["table"] not in kept]
+    for entry in stale:
+        note = " (kept, used by the result cache)" if entry["table"] in kept else ""
+        print(f"  {entry['table']}  created {entry['created']:%Y-%m-%d %H:%M}{note}")
+
+    if args.dry_run or not to_drop:
+        print(f"{len(to_drop)} stale tables{' would be dropped' if args.dry_run else ''}.")
+        return
+
+    errors = drop_tables(client, to_drop, max_concurrency=test_config.get("cleanup_concurrency", 8))
+    for table, e in errors.items():
+        print(f"::error::Could not drop {table}: {e}")  # GitHub CI error annotation
+    print(f"Dropped {len(to_drop) - len(errors)} of {len(to_drop)} stale tables.")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Test tables (see build_sql_query) and sampled copies (see sampling.py) end with a random suffix
+TEST_TABLE_PATTERN = r"_(test|sample)_[a-z0-9]{8}$"
+# The suffix always has a letter (see generate_temp_suffix), so date shards like events_sample_20240101 never match
+_TEST_TABLE_NAME = re.compile(r"^(.+)_(?:test|sample)_([a-z0-9]{8})$")
+
+
+def is_test_table(table_name: str, names: Optional[Iterable[str]] = None) -> bool:
+    """
+    Whether a table is a test table or sampled copy: `<name>_test_<suffix>` or `<name>_sample_<suffix>`,
+    with a random suffix of 8 lowercase letters and digits that isn't all digits, and, if
+    `names` is given, the name of one of them.
+    """
+    match = _TEST_TABLE_NAME.match(table_name)
+    if not match or match.group(2).isdigit():
+        return False
+    return names is None or match.group(1) in names
+
+
+def group_by_dataset(tables: Iterable[str]) -> Dict[Tuple[str, str], List[str]]:
+    """Group "project.dataset.table" ids by (project, dataset), without duplicates."""
+    datasets = {}
+    for table in dict.fromkeys(tables):
+        project_id, dataset_id, _ = table.split(".", 2)
+        datasets.setdefault((project_id, dataset_id), []).append(table)
+    return datasets
+
+
+def drop_tables(client, tables: Iterable[str], max_concurrency: int = 8, batch_size: int = 200) -> Dict[str, Exception]:
+    """
+    Drop tables with one multi-statement script per dataset (up to `batch_size` tables each).
+
+    Datasets are dropped concurrently. A script stops at its first failing statement, so
+    when a batch fails its tables are deleted one by one through the tables API instead,
+    which also tells which of them could not be dropped.
+
+    Returns:
+        Dict[str, Exception]: The error per table that could not be dropped.
+    """
+    batches = []
+    for dataset_tables in group_by_dataset(tables).values():
+        for start in range(0, len(dataset_tables), batch_size):
+            batches.append(dataset_tables[start:start + batch_size])
+
+    def drop_batch(batch: List[str]) -> Dict[str, Exception]:
+        script = "\n".join(f"DROP TABLE IF EXISTS `{table}`;" for table in batch)
+        try:
+            client.query(script).result()
+            return {}
+        except Exception as e:
+            print(f"Dropping {len(batch)} tables in one script failed ({str(e).splitlines()[0] if str(e) else e}), "
+                  f"deleting them one by one...")
+        errors = {}
+        for table in batch:
+            try:
+                client.delete_table(table, not_found_ok=True)
+            except Exception as e:
+                errors[table] = e
+        return errors
+
+    errors = {}
+    if not batches:
+        return errors
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(batches)))) as executor:
+        # Jobs run in the caller's context, so they stay attributed to its action (see job_telemetry)
+        futures = [executor.submit(contextvars.copy_context().run, drop_batch, batch) for batch in batches]
+        for future in futures:
+            errors.update(future.result())
+    return errors
+
+
+def find_stale_tables(client, datasets: Iterable[Tuple[str, str]], older_than_hours: float,
+                      names: Optional[Iterable[str]] = None, max_concurrency: int = 8) -> List[Dict]:
+    """
+    Find test tables (see `is_test_table`) created more than `older_than_hours` ago.
+
+    Each dataset is listed with a single INFORMATION_SCHEMA.TABLES query, concurrently.
+    Datasets that don't exist are skipped.
+
+    Args:
+        names (Iterable[str]): Names of the actions and declarations test tables are named after.
+
+    Returns:
+        List[Dict]: {"table": "project.dataset.table", "created": datetime} per stale table.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=older_than_hours)
+    names = set(names) if names is not None else None
+
+    def list_dataset(key: Tuple[str, str]) -> List[Dict]:
+        project_id, dataset_id = key
+        query = f"""
+        SELECT table_name, creation_time
+        FROM `{project_id}.{dataset_id}`.INFORMATION_SCHEMA.TABLES
+        WHERE REGEXP_CONTAINS(table_name, r'{TEST_TABLE_PATTERN}')
+        """
+        try:
+            rows = list(client.query(query).result())
+        except Exception as e:
+            print(f"Could not list {project_id}.{dataset_id}: {str(e).splitlines()[0] if str(e) else e}")
+            return []
+        return [
+            {"table": f"{project_id}.{dataset_id}.{row.table_name}", "created": row.creation_time}
+            for row in rows
+            if is_test_table(row.table_name, names) and row.creation_time < cutoff
+        ]
+
+    datasets = list(dict.fromkeys(datasets))
+    stale = []
+    if not datasets:
+        return stale
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(datasets)))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, list_dataset, key) for key in datasets]
+        for future in futures:
+            stale.extend(future.result())
+    return stale